@@ -0,0 +1,283 @@
+"""
+Benchmarks the update rule of every market class across problem sizes.
+
+For each market class and (n_buyers, n_goods) size this reports time per step, steps per second,
+peak memory and the number of steps until prices converge, on instances generated by Initializer with a fixed seed.
+Each acceleration mode given with --accelerators is also timed until prices converge.
+With --in-place, markets reuse their arrays every step instead of allocating new ones.
+With --backend numba, update rules run as compiled kernels (see Market.set_backend); compiling is not timed.
+Each schedule given with --schedules is timed until prices are within --error-tol of the market's exact equilibrium,
+updating every buyer at once ("sync") or batches of buyers asynchronously.
+Results are written as JSON so runs can be compared for regressions:
+
+    python benchmarks/benchmark_markets.py --output new.json
+    python benchmarks/benchmark_markets.py --compare old.json new.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from root.acceleration import Aitken, Anderson, Damping, Momentum
+from root.asynchronous import BuyerSchedule, CyclicSchedule, PrioritySchedule
+from root.backend import BACKENDS
+from root.chunked_market import ChunkedPropRespLinearMarket, ChunkedPropRespZhangMarket
+from root.equilibrium import get_equilibrium
+from root.initializer import Initializer
+from root.market import (GeneralPropRespCDMarket, GeneralPropRespQLMarketPD, GeneralPropRespQLMarketU, PropRespLinearMarket,
+                         PropRespQLGroupedMarket, PropRespZhangMarket, PropRespZhangMarketSingleLinearBuyer)
+from root.simulation import Simulation
+from root.sparse_market import SparsePropRespLinearMarket, SparsePropRespZhangMarket
+
+def sharded(market):
+    # Buyers sharded over every core.
+    market.set_workers(os.cpu_count())
+    return market
+
+# name: function building the market from Initializer output [budget, bids, util]
+MARKETS = {
+    "PropRespLinearMarket": lambda p: PropRespLinearMarket(*p),
+    "GeneralPropRespCDMarket": lambda p: GeneralPropRespCDMarket(*p),
+    "GeneralPropRespQLMarketU": lambda p: GeneralPropRespQLMarketU(*p, 0.5),
+    "GeneralPropRespQLMarketPD": lambda p: GeneralPropRespQLMarketPD(*p, 0.5),
+    "PropRespZhangMarket": lambda p: PropRespZhangMarket(*p, 0.5),
+    "PropRespZhangMarketSingleLinearBuyer": lambda p: PropRespZhangMarketSingleLinearBuyer(*p, 0.5),
+    "PropRespQLGroupedMarket": lambda p: PropRespQLGroupedMarket(*p, 0.5, p[2].shape[1] // 2),
+    "SparsePropRespLinearMarket": lambda p: SparsePropRespLinearMarket.from_dense(*p),
+    "SparsePropRespZhangMarket": lambda p: SparsePropRespZhangMarket.from_dense(*p, 0.5),
+    "ChunkedPropRespLinearMarket": lambda p: ChunkedPropRespLinearMarket(*p),
+    "ChunkedPropRespZhangMarket": lambda p: ChunkedPropRespZhangMarket(*p, 0.5),
+    "ShardedPropRespLinearMarket": lambda p: sharded(PropRespLinearMarket(*p)),
+    "ShardedPropRespZhangMarket": lambda p: sharded(PropRespZhangMarket(*p, 0.5)),
+}
+
+# name: function building a fresh accelerator, or None for the plain update rule
+ACCELERATORS = {
+    "none": lambda: None,
+    "damping": lambda: Damping(),
+    "momentum": lambda: Momentum(),
+    "aitken": lambda: Aitken(),
+    "anderson": lambda: Anderson(),
+}
+
+# name: function building a fresh schedule updating batch_size buyers per step, or None to update all at once
+SCHEDULES = {
+    "sync": lambda batch_size: None,
+    "random": lambda batch_size: BuyerSchedule(batch_size, 0),
+    "cyclic": lambda batch_size: CyclicSchedule(batch_size),
+    "priority": lambda batch_size: PrioritySchedule(batch_size, seed=0),
+}
+
+SIZES = [(100, 10), (1000, 50), (10000, 100), (100000, 100)]
+QUICK_SIZES = [(100, 10), (1000, 50)]
+
+def make_params(n_buyers, n_goods, seed, method):
+    return getattr(Initializer(n_goods, n_buyers, seed), method)()
+
+def benchmark(name, n_buyers, n_goods, seed, method, min_time, max_convergence_time, price_tol, accelerator="none", in_place=False, backend="numpy"):
+    """
+    Times one market class at one size.
+
+    Returns
+    -------
+    dict
+        Result row. Steps are repeated until min_time seconds have passed.
+        Convergence is run for at most max_convergence_time seconds, using the given accelerator.
+        Markets update in place (see Market.set_in_place) if in_place is set, on the given backend.
+    """
+    params = make_params(n_buyers, n_goods, seed, method)
+    if backend != "numpy":
+        # Compile the kernels, or load them from the cache, before measuring.
+        market = MARKETS[name]([x.copy() for x in params])
+        market.set_backend(backend)
+        market.update()
+    # Peak memory of building the market and one step. Measured apart from timing, since tracing slows allocations.
+    tracemalloc.start()
+    market = MARKETS[name]([x.copy() for x in params])
+    market.set_in_place(in_place)
+    market.set_backend(backend)
+    market.update()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    steps = 0
+    start = time.perf_counter()
+    while True:
+        market.update()
+        steps += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+    time_per_step = elapsed / steps
+
+    market = MARKETS[name]([x.copy() for x in params])
+    market.set_in_place(in_place)
+    market.set_backend(backend)
+    simulation = Simulation(market, strides={variable: 0 for variable in Simulation.getters})
+    max_steps = max(1, int(max_convergence_time / time_per_step))
+    start = time.perf_counter()
+    converged_time, residuals = simulation.run(max_steps, price_tol=price_tol, check_every=10, accelerator=ACCELERATORS[accelerator]())
+    convergence_time = time.perf_counter() - start
+    return {
+        "market": name,
+        "n_buyers": n_buyers,
+        "n_goods": n_goods,
+        "seed": seed,
+        "method": method,
+        "accelerator": accelerator,
+        "in_place": in_place,
+        # The backend that ran, numpy if the one asked for isn't installed.
+        "backend": market.backend,
+        "time_per_step": time_per_step,
+        "steps_per_second": 1 / time_per_step,
+        "peak_memory_bytes": peak_memory,
+        "steps_to_convergence": converged_time,
+        "seconds_to_convergence": convergence_time if converged_time is not None else None,
+        "convergence_step_limit": max_steps,
+        "price_tol": price_tol,
+        "final_price_residual": float(residuals["price"]),
+    }
+
+def benchmark_schedule(name, n_buyers, n_goods, seed, method, schedule, batch_fraction, error_tol, max_time):
+    """
+    Times convergence to the exact equilibrium under a schedule of buyer updates.
+
+    Returns
+    -------
+    dict
+        Result row. The error is checked once per sweep (as many buyer updates as one synchronous step),
+        for at most max_time seconds.
+    """
+    params = make_params(n_buyers, n_goods, seed, method)
+    market = MARKETS[name]([x.copy() for x in params])
+    equilibrium = get_equilibrium(market)
+    batch_size = max(1, int(batch_fraction * n_buyers))
+    stepper = SCHEDULES[schedule](batch_size)
+    sweep = 1 if stepper is None else stepper.get_sweep_steps(market)
+    sweeps = 0
+    error = equilibrium.get_price_error(market.get_price())
+    start = time.perf_counter()
+    while error >= error_tol and time.perf_counter() - start < max_time:
+        for i in range(sweep):
+            if stepper is None:
+                market.update()
+            else:
+                stepper.step(market)
+        sweeps += 1
+        error = equilibrium.get_price_error(market.get_price())
+    seconds = time.perf_counter() - start
+    return {
+        "market": name,
+        "n_buyers": n_buyers,
+        "n_goods": n_goods,
+        "seed": seed,
+        "method": method,
+        "schedule": schedule,
+        "batch_size": batch_size if stepper is not None else n_buyers,
+        "error_tol": error_tol,
+        "sweeps_to_equilibrium": sweeps if error < error_tol else None,
+        "seconds_to_equilibrium": seconds if error < error_tol else None,
+        "final_price_error": float(error),
+    }
+
+def compare(old_path, new_path, threshold):
+    """
+    Prints the change in time per step between two result files.
+
+    Returns
+    -------
+    int
+        Number of cases that got slower by more than a factor of threshold.
+    """
+    with open(old_path) as f:
+        old = {(r["market"], r["n_buyers"], r["n_goods"], r.get("accelerator", "none"), r.get("in_place", False), r.get("backend", "numpy")): r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    regressions = 0
+    for r in new:
+        key = (r["market"], r["n_buyers"], r["n_goods"], r.get("accelerator", "none"), r.get("in_place", False), r.get("backend", "numpy"))
+        if key not in old:
+            continue
+        ratio = r["time_per_step"] / old[key]["time_per_step"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print("%-38s %7d x %-5d %-8s %-5s %-5s %10.3f ms -> %10.3f ms  x%.2f%s" % (key + (old[key]["time_per_step"] * 1e3, r["time_per_step"] * 1e3, ratio, flag)))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--markets", nargs="+", default=list(MARKETS), choices=list(MARKETS))
+    parser.add_argument("--sizes", nargs="+", default=None, help="n_buyers x n_goods, e.g. 1000x50")
+    parser.add_argument("--quick", action="store_true", help="only run the small sizes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--method", default="initialize_linear_utilities_basic", help="Initializer method generating instances")
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds to time steps for")
+    parser.add_argument("--max-convergence-time", type=float, default=10.0, help="seconds to run until convergence for")
+    parser.add_argument("--price-tol", type=float, default=1e-6)
+    parser.add_argument("--accelerators", nargs="+", default=["none"], choices=list(ACCELERATORS), help="acceleration modes to run until convergence with")
+    parser.add_argument("--in-place", action="store_true", help="update markets in place, reusing their arrays")
+    parser.add_argument("--backend", default="numpy", choices=list(BACKENDS), help="backend update rules run on")
+    parser.add_argument("--schedules", nargs="+", default=[], choices=list(SCHEDULES), help="buyer update schedules to time until the exact equilibrium with")
+    parser.add_argument("--batch-fraction", type=float, default=0.05, help="fraction of buyers asynchronous schedules update per step")
+    parser.add_argument("--error-tol", type=float, default=1e-3, help="largest relative price error counted as reaching equilibrium")
+    parser.add_argument("--output", default=None, help="JSON file to write results to")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown factor counted as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    if args.sizes:
+        sizes = [tuple(int(x) for x in size.split("x")) for size in args.sizes]
+    else:
+        sizes = QUICK_SIZES if args.quick else SIZES
+
+    results = []
+    for n_buyers, n_goods in sizes:
+        for name in args.markets:
+            for accelerator in args.accelerators:
+                row = benchmark(name, n_buyers, n_goods, args.seed, args.method, args.min_time, args.max_convergence_time, args.price_tol, accelerator, args.in_place, args.backend)
+                results.append(row)
+                seconds = row["seconds_to_convergence"]
+                print("%-38s %7d x %-5d %-8s %10.3f ms/step %10.1f steps/s %8.1f MB  converged at %s in %s" % (
+                    name, n_buyers, n_goods, accelerator, row["time_per_step"] * 1e3, row["steps_per_second"],
+                    row["peak_memory_bytes"] / 2**20, row["steps_to_convergence"], "-" if seconds is None else "%.2f s" % seconds))
+
+    schedule_results = []
+    for n_buyers, n_goods in sizes:
+        for name in args.markets:
+            for schedule in args.schedules:
+                try:
+                    row = benchmark_schedule(name, n_buyers, n_goods, args.seed, args.method, schedule, args.batch_fraction, args.error_tol, args.max_convergence_time)
+                except ValueError as error:
+                    print("%-38s %7d x %-5d %-8s skipped: %s" % (name, n_buyers, n_goods, schedule, error))
+                    continue
+                schedule_results.append(row)
+                seconds = row["seconds_to_equilibrium"]
+                print("%-38s %7d x %-5d %-8s within %g of equilibrium after %s sweeps in %s (error %.1e)" % (
+                    name, n_buyers, n_goods, schedule, args.error_tol, row["sweeps_to_equilibrium"],
+                    "-" if seconds is None else "%.2f s" % seconds, row["final_price_error"]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results,
+                "schedules": schedule_results,
+            }, f, indent=1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import numpy as np
+
+class Accelerator:
+    """
+    Class to accelerate the convergence of a market's update rule, seen as a fixed point iteration b -> F(b) on bids.
+    Each step runs one market update and may then replace the new bids F(b) with an extrapolated guess.
+
+    Guesses are kept feasible: each bid is kept to at least floor * F(b), which keeps it positive and leaves bids
+    of 0 at 0 as the update rule would, and then each buyer's bids are scaled to spend their whole budget.
+    Bids are raised to the floor one by one, or if shorten_steps is set, the whole step from F(b) is shortened.
+
+    This base class runs the plain update rule.
+
+    Attributes
+    ----------
+    floor : float
+        Smallest fraction of F(b) an extrapolated bid may take, in (0, 1].
+    restart : float
+        History is dropped and a plain step taken whenever the change in bids sum_ij |F(b)_ij - b_ij| grows
+        by more than this factor from the previous step. None never restarts.
+    residual : float
+        sum_ij |F(b)_ij - b_ij| at the last step.
+    n_restarts : int
+        Number of restarts so far.
+    shorten_steps : bool
+        Whether guesses are kept above the floor by shortening the whole step instead of raising single bids.
+
+    Methods
+    -------
+    step(market, extrapolate):
+        Runs one update of market, then extrapolates its bids.
+    reset():
+        Drops the history kept between steps.
+    """
+    shorten_steps = False
+
+    def __init__(self, floor: float = 0.5, restart: float = 1.0):
+        if not 0 < floor <= 1:
+            raise ValueError("floor must be in (0, 1].")
+        self.floor = floor
+        self.restart = restart
+        self.residual = None
+        self.n_restarts = 0
+
+    def reset(self):
+        pass
+
+    def step(self, market, extrapolate: bool = True):
+        """
+        Runs one update of market, then extrapolates its bids unless extrapolate is false.
+        History is kept either way, so plain steps (e.g. to measure convergence) can be mixed in.
+        """
+        if getattr(market, "active_set", None) is not None:
+            raise ValueError("Accelerators set bids of every pair, so they don't run on markets with an active set.")
+        previous_bid = np.array(market.get_bid())
+        market.update()
+        update = market.get_bid()
+        residual = np.sum(np.abs(update - previous_bid))
+        grew = self.residual is not None and self.restart is not None and residual > self.restart * self.residual
+        self.residual = residual
+        if grew:
+            self.n_restarts += 1
+            self.reset()
+            return
+        bid = self._extrapolate(previous_bid, update)
+        if bid is not None and extrapolate:
+            self._set_bid(market, bid)
+
+    def _extrapolate(self, bid: np.array, update: np.array):
+        """
+        Returns new bids given the bids before the last update and after it, or None to keep the update.
+        """
+        return None
+
+    def _set_bid(self, market, bid: np.array):
+        """
+        Sets the market's bids in place to bid, made feasible. Overwrites bid.
+        """
+        update = market.bid
+        if self.shorten_steps:
+            # Shorten the step from F(b) so that no bid falls below floor * F(b), keeping its direction.
+            bid -= update
+            shrinking = bid < 0
+            if np.any(shrinking):
+                bid *= min(np.min((1 - self.floor) * update[shrinking] / -bid[shrinking]), 1)
+            bid += update
+        else:
+            np.maximum(bid, self.floor * update, out=bid)
+        np.multiply(bid, market._per_buyer(market.budget / market._buyer_sum(bid)), out=market.bid, casting='unsafe')
+
+class Damping(Accelerator):
+    """
+    Class to take relaxed steps b <- b + weight * (F(b) - b).
+    A weight below 1 damps the update rule, and a weight between 1 and 2 over-relaxes it.
+    """
+    def __init__(self, weight: float = 1.5, floor: float = 0.5, restart: float = None):
+        if weight <= 0:
+            raise ValueError("weight must be positive.")
+        super().__init__(floor, restart)
+        self.weight = weight
+
+    def _extrapolate(self, bid, update):
+        return bid + self.weight * (update - bid)
+
+class Momentum(Accelerator):
+    """
+    Class to take momentum steps b <- F(b) + beta * (F(b) - F(b_prev)), where b_prev are the bids before the previous step.
+    """
+    def __init__(self, beta: float = 0.9, floor: float = 0.5, restart: float = 1.0):
+        if not 0 <= beta < 1:
+            raise ValueError("beta must be in [0, 1).")
+        super().__init__(floor, restart)
+        self.beta = beta
+        self.previous_update = None
+
+    def reset(self):
+        self.previous_update = None
+
+    def _extrapolate(self, bid, update):
+        previous_update = self.previous_update
+        self.previous_update = update.copy()
+        if previous_update is not None:
+            return update + self.beta * (update - previous_update)
+
+class Aitken(Accelerator):
+    """
+    Class to apply vector Aitken extrapolation (the Irons-Tuck form) after every two plain steps.
+    From bids x0, x1 = F(x0) and x2 = F(x1) it jumps to x2 + c * d2, where d2 = x2 - x1, dd = d2 - (x1 - x0)
+    and c = -(d2.dd) / (dd.dd). c is clipped to [0, max_factor], since steps backwards or far ahead overshoot.
+    """
+    def __init__(self, max_factor: float = 100.0, floor: float = 0.5, restart: float = 1.0):
+        super().__init__(floor, restart)
+        self.max_factor = max_factor
+        self.last = None
+
+    def reset(self):
+        self.last = None
+
+    def _extrapolate(self, bid, update):
+        if self.last is None:
+            self.last = (bid, update.copy())
+            return None
+        x0, x1 = self.last
+        self.last = None
+        d2 = update - bid
+        dd = d2 - (x1 - x0)
+        denominator = np.vdot(dd, dd)
+        if denominator == 0:
+            return None
+        factor = np.clip(-np.vdot(d2, dd) / denominator, 0, self.max_factor)
+        return update + factor * d2
+
+class Anderson(Accelerator):
+    """
+    Class to apply Anderson mixing to the bids, using the last depth steps.
+    With residuals f_k = F(b_k) - b_k, each step solves min_gamma |f_k - dF gamma| over the differences dF of
+    consecutive residuals, and jumps to F(b_k) - dG gamma, where dG are the differences of consecutive updates.
+
+    Anderson steps mix many directions, and raising single bids to the floor throws them off enough to stall
+    convergence on the wrong support, so they are shortened as a whole instead.
+    The whole bid array, including every replica of an ensemble, is treated as one vector.
+    Keeps 2*depth arrays the size of the bids.
+    """
+    shorten_steps = True
+
+    def __init__(self, depth: int = 10, floor: float = 0.5, restart: float = 1.0):
+        if depth <= 0:
+            raise ValueError("depth must be positive.")
+        super().__init__(floor, restart)
+        self.depth = depth
+        self.reset()
+
+    def reset(self):
+        self.last = None
+        self.residual_differences = []
+        self.update_differences = []
+
+    def _extrapolate(self, bid, update):
+        residual = (update - bid).ravel()
+        update = update.ravel()
+        if self.last is not None:
+            last_residual, last_update = self.last
+            self.residual_differences.append(residual - last_residual)
+            self.update_differences.append(update - last_update)
+            if len(self.residual_differences) > self.depth:
+                self.residual_differences.pop(0)
+                self.update_differences.pop(0)
+        self.last = (residual, update.copy())
+        if not self.residual_differences:
+            return None
+        gamma = np.linalg.lstsq(np.stack(self.residual_differences, axis=1), residual, rcond=None)[0]
+        return (update - np.stack(self.update_differences, axis=1) @ gamma).reshape(bid.shape)
@@ -0,0 +1,221 @@
+import numpy as np
+
+class ActiveSet:
+    """
+    Class to run a dense linear or CES market's update rule on its active (i, j) pairs only.
+
+    Under proportional response most bids decay toward 0, as each buyer ends up spending on a few goods. Pairs whose
+    bid falls below threshold times the buyer's budget are pruned: their bid is taken out of the market, and each step
+    only computes prices, quantities and bids of the pairs left, in O(support) instead of O(nm). The market's dense
+    bid and qty arrays are only brought up to date, with pruned pairs at 0, when get_bid() or get_qty() reads them.
+
+    Pruned bids are still followed exactly, in O(n + m) per step: with exponent a (1 for linear buyers), the rule is
+    log b_ij(t+1) = a (log u_ij + log b_ij(t) - log p_j(t)) + log B_i - log Z_i(t), where Z_i(t) normalizes buyer i's
+    responses. Summing -a log p_j over steps for each good, and log B_i - log Z_i for each buyer, each decayed by a,
+    gives any pruned bid after k steps from its bid when pruned. Every recheck_every steps, pruned bids are computed,
+    those above the threshold re-enter, and active bids below it are pruned, in one O(nm) pass.
+
+    Pruned pairs are left out of prices and normalizations, so the active market moves as if buyers spent their pruned
+    bids nowhere. The error this introduces in each buyer's spending is at most the share of their budget held by
+    pruned bids: below n_goods * threshold right after a recheck, and measured again at the next one (see error).
+
+    Indexing the active pairs costs more per pair than the dense update, so pruning only pays once few pairs are left.
+    While more than max_density of the pairs would be kept, at the start or at a recheck, nothing is pruned and the
+    market updates densely until the next recheck (see dense).
+
+    Attributes
+    ----------
+    threshold : float
+        Bids below threshold * budget are pruned, in (0, 1). Each buyer's largest bid is always kept.
+    recheck_every : int
+        Number of steps between rechecks of the pruned pairs.
+    exponent : float
+        Exponent of every pair, 1 for linear markets.
+    max_density : float
+        Largest share of the pairs kept for which pruning pays, in (0, 1].
+    dense : bool
+        Whether the last recheck kept more than max_density of the pairs, so the market updates every pair.
+    rows, indices : np.array
+        Buyer and good of each active pair, by buyer.
+    error : float
+        Largest share of a buyer's budget held by pruned bids at the last recheck, before pairs re-entered.
+
+    Methods
+    -------
+    get_support():
+        returns the number of active pairs, every pair while dense.
+    sync(market):
+        Writes the active bids and quantities into the market's dense arrays.
+    restore(market):
+        Puts the pruned bids back into the market, to run it densely again.
+    """
+    def __init__(self, market, threshold: float, recheck_every: int, exponent: float, max_density: float = 0.5):
+        if not 0 < threshold < 1:
+            raise ValueError("threshold must be in (0, 1).")
+        if recheck_every < 1:
+            raise ValueError("recheck_every must be at least 1.")
+        if not 0 < max_density <= 1:
+            raise ValueError("max_density must be in (0, 1].")
+        if np.ndim(market.bid) != 2:
+            raise ValueError("Active sets run markets without replica axes. Bids should be nxm.")
+        self.threshold = threshold
+        self.recheck_every = recheck_every
+        self.exponent = float(exponent)
+        self.max_density = max_density
+        self.dense = False
+        self.size = market.bid.size
+        self.log_budget = np.log(market.budget)
+        self.error = 0.0
+        self.pruned_rows = np.zeros(0, dtype=np.int64)
+        self.pruned_indices = np.zeros(0, dtype=np.int64)
+        self.pruned_log_bid = np.zeros(0)
+        self.good_sum = np.zeros(market.n_goods)
+        self.buyer_sum = np.zeros(market.n_buyers)
+        self.steps = 0
+        self.synced = True
+        # Pruned quantities are set to 0, so the market gets its own array.
+        market.qty = np.array(market.qty, dtype=np.result_type(market.bid, market.price))
+        self._prune(market)
+
+    def get_support(self):
+        return self.size if self.dense else len(self.rows)
+
+    def _get_pruned_bid(self, market):
+        """
+        Returns the bid each pruned pair would have now, from its bid when pruned and the sums since.
+        """
+        if self.steps == 0:
+            return np.exp(self.pruned_log_bid)
+        a = self.exponent
+        k = self.steps
+        decay = a ** k
+        # sum_{s<k} a^s, the weight of log u_ij over the k steps.
+        weight = k if a == 1 else (1 - decay) / (1 - a)
+        log_utility = market._get_log_utility()[self.pruned_rows, self.pruned_indices]
+        log_bid = decay * self.pruned_log_bid + a * weight * log_utility
+        log_bid += self.good_sum[self.pruned_indices]
+        log_bid += self.buyer_sum[self.pruned_rows]
+        return np.exp(log_bid)
+
+    def _prune(self, market):
+        """
+        Brings pruned bids up to date, lets those above the threshold re-enter, prunes active bids below it,
+        and rebuilds the active pairs. If too many pairs are kept, puts every bid back and turns dense instead.
+        """
+        self.sync(market)
+        bid = market.bid
+        budget = market.budget
+        restored = len(self.pruned_rows) > 0
+        if restored:
+            pruned_bid = self._get_pruned_bid(market)
+            bid[self.pruned_rows, self.pruned_indices] = pruned_bid
+            self.error = np.max(np.bincount(self.pruned_rows, weights=pruned_bid, minlength=market.n_buyers) / budget)
+        kept = bid >= self.threshold * budget[:, None]
+        kept[np.arange(market.n_buyers), np.argmax(bid, axis=-1)] = True
+        self.steps = 0
+        if np.count_nonzero(kept) > self.max_density * kept.size:
+            self.dense = True
+            self.pruned_rows = self.pruned_indices = self.rows = self.indices = self.flat = np.zeros(0, dtype=np.int64)
+            self.pruned_log_bid = self.bid = self.qty = np.zeros(0)
+            if restored:
+                # Bids spend the whole budget again, as in restore. Prices and quantities follow in the dense update.
+                np.multiply(bid, (budget / np.sum(bid, axis=-1))[:, None], out=bid, casting='unsafe')
+            return
+        if self.dense:
+            # Dense updates wrote the market's workspace, and pruned quantities are set to 0.
+            market.qty = np.array(market.qty)
+            self.dense = False
+        pruned = ~kept
+        self.pruned_rows, self.pruned_indices = np.nonzero(pruned)
+        with np.errstate(divide='ignore'):
+            self.pruned_log_bid = np.log(bid[pruned])
+        bid[pruned] = 0
+        market.qty[pruned] = 0
+        # Active bids spend the whole budget, as they would after the next step.
+        np.multiply(bid, (budget / np.sum(bid, axis=-1))[:, None], out=bid, casting='unsafe')
+
+        self.rows, self.indices = np.nonzero(kept)
+        self.flat = np.flatnonzero(kept)
+        # Every buyer keeps a pair, so each buyer's pairs are the run of counts[i] pairs from starts[i].
+        self.counts = np.bincount(self.rows, minlength=market.n_buyers)
+        self.starts = np.cumsum(self.counts) - self.counts
+        self.bid = bid[kept]
+        self.qty = market.qty[kept]
+        self.budget = budget[self.rows]
+        self.utility = market.utility[kept]
+        if self.exponent != 1:
+            self.log_utility = market._get_log_utility()[kept]
+        self.good_sum[:] = 0
+        self.buyer_sum[:] = 0
+
+    def sync(self, market):
+        if not self.synced:
+            np.put(market.bid, self.flat, self.bid)
+            np.put(market.qty, self.flat, self.qty)
+            self.synced = True
+
+    def restore(self, market):
+        """
+        Puts the pruned bids back into the market, with each buyer's bids scaled to spend their budget.
+        Prices move by the change in bids, as when buyers change (see Market.set_budgets), and quantities follow.
+        """
+        self.sync(market)
+        bid = market.bid
+        before = np.sum(bid, axis=-2)
+        bid[self.pruned_rows, self.pruned_indices] = self._get_pruned_bid(market)
+        np.multiply(bid, (market.budget / np.sum(bid, axis=-1))[:, None], out=bid, casting='unsafe')
+        market._set_price(market.price + np.sum(bid, axis=-2) - before)
+
+    def update_price(self, market):
+        """
+        Sets prices from the active pairs, rechecking them first every recheck_every steps.
+
+        Returns
+        -------
+        bool
+            False if the active set is dense, for the market to run its dense update instead.
+        """
+        if self.steps == self.recheck_every:
+            self._prune(market)
+        if self.dense:
+            self.steps += 1
+            return False
+        price = np.bincount(self.indices, weights=self.bid, minlength=market.n_goods)
+        if not np.all(price):
+            raise ZeroDivisionError("Price of good " + str(np.argwhere(price == 0)[0]) + " reached 0 at time " + str(market.time) + ".")
+        market.price = price
+        return True
+
+    def update_qty(self, market):
+        self.qty = self.bid / market.price[self.indices]
+        self.synced = False
+
+    def update_bids(self, market):
+        if self.exponent == 1:
+            response = self.utility * self.qty
+            sum_response = np.add.reduceat(response, self.starts)
+            market._check_sum_utility(sum_response)
+            np.multiply(self.budget, response, out=self.bid)
+            self.bid /= np.repeat(sum_response, self.counts)
+            individual_utility = sum_response
+            log_sum_response = np.log(sum_response)
+        else:
+            with np.errstate(divide='ignore'):
+                log_response = np.log(self.qty)
+            log_response += self.log_utility
+            log_response *= self.exponent
+            log_max = np.maximum.reduceat(log_response, self.starts)
+            market._check_sum_utility(np.where(log_max > -np.inf, 1, 0))
+            log_response -= np.repeat(log_max, self.counts)
+            response = np.exp(log_response, out=log_response)
+            sum_response = np.add.reduceat(response, self.starts)
+            np.multiply(response, np.repeat(market.budget / sum_response, self.counts), out=self.bid)
+            log_sum_response = log_max + np.log(sum_response)
+            individual_utility = np.exp(log_sum_response)
+        market.individual_utility[:] = individual_utility
+
+        self.good_sum *= self.exponent
+        self.good_sum -= self.exponent * np.log(market.price)
+        self.buyer_sum *= self.exponent
+        self.buyer_sum += self.log_budget - log_sum_response
+        self.steps += 1
@@ -0,0 +1,267 @@
+import numpy as np
+
+class RunningStats:
+    """
+    Class to summarize a metric streamed one value per step, elementwise for array values, in memory of the size of
+    one value: running min, max and mean, an exponentially decayed mean, and an estimate of its convergence rate.
+
+    A sequence converging linearly, x_t -> x*, has steps d_t = x_t - x_{t-1} shrinking by a factor r each step.
+    rate estimates r by exponentially decaying the log of |d_t / d_{t-1}|, and error estimates |x_t - x*| as
+    |d_t| r / (1 - r), the sum of the steps still to come. Both are nan until there are enough steps, or if the value
+    stopped changing or isn't converging (r >= 1).
+
+    Attributes
+    ----------
+    decay : float
+        Weight of the past in decayed averages, in [0, 1). Averages cover about 1 / (1 - decay) steps.
+    count : int
+        Number of values seen.
+    last : np.array
+        Last value, or None.
+
+    Methods
+    -------
+    update(value):
+        Adds the next value.
+    get_summary():
+        returns the summaries as a dict.
+    """
+    fields = ("count", "last", "min", "max", "mean", "decayed_mean", "weight", "step", "log_ratio", "ratio_weight")
+
+    def __init__(self, decay: float = 0.9):
+        if not 0 <= decay < 1:
+            raise ValueError("decay must be in [0, 1).")
+        self.decay = decay
+        self.count = 0
+        self.last = None
+        self.min = None
+        self.max = None
+        self.mean = None
+        self.decayed_mean = None
+        # Sums of the decayed weights, to correct decayed averages for starting at 0.
+        self.weight = 0.0
+        self.step = None
+        self.log_ratio = None
+        self.ratio_weight = None
+
+    def update(self, value):
+        value = np.array(value, dtype=float)
+        if self.count == 0:
+            self.min = value.copy()
+            self.max = value.copy()
+            self.mean = value.copy()
+            self.decayed_mean = np.zeros_like(value)
+            self.log_ratio = np.zeros_like(value)
+            self.ratio_weight = np.zeros_like(value)
+        else:
+            np.minimum(self.min, value, out=self.min)
+            np.maximum(self.max, value, out=self.max)
+            self.mean += (value - self.mean) / (self.count + 1)
+            step = np.abs(value - self.last)
+            if self.step is not None:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    log_ratio = np.log(step / self.step)
+                # Steps of 0 give no ratio, and are skipped.
+                finite = np.isfinite(log_ratio)
+                self.log_ratio[finite] = self.decay * self.log_ratio[finite] + (1 - self.decay) * log_ratio[finite]
+                self.ratio_weight[finite] = self.decay * self.ratio_weight[finite] + (1 - self.decay)
+            self.step = step
+        self.decayed_mean *= self.decay
+        self.decayed_mean += (1 - self.decay) * value
+        self.weight = self.decay * self.weight + (1 - self.decay)
+        self.last = value
+        self.count += 1
+
+    def get_rate(self):
+        """
+        Returns the estimated factor the metric's steps shrink by each step, or nan.
+        """
+        with np.errstate(invalid='ignore'):
+            return np.exp(self.log_ratio / self.ratio_weight)
+
+    def get_error(self):
+        """
+        Returns the estimated distance of the last value from the metric's limit, or nan.
+        """
+        rate = self.get_rate()
+        if self.step is None:
+            return rate
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(rate < 1, self.step * rate / (1 - rate), np.nan)
+
+    def get_summary(self):
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "last": _to_python(self.last),
+            "min": _to_python(self.min),
+            "max": _to_python(self.max),
+            "mean": _to_python(self.mean),
+            "decayed_mean": _to_python(self.decayed_mean / self.weight),
+            "rate": _to_python(self.get_rate()),
+            "error": _to_python(self.get_error()),
+        }
+
+    def get_state(self):
+        """
+        Returns copies of the accumulators, which later updates change in place.
+        """
+        return {name: _copy(getattr(self, name)) for name in self.fields}
+
+    def set_state(self, state: dict):
+        for name in self.fields:
+            value = state[name]
+            setattr(self, name, None if value is None else np.array(value, dtype=float))
+        self.count = int(self.count)
+        self.weight = float(self.weight)
+
+def _copy(value):
+    return value.copy() if isinstance(value, np.ndarray) else value
+
+def _to_python(value: np.array):
+    return value.item() if value.ndim == 0 else value
+
+def _replica_sum(market, x: np.array):
+    """
+    Sums x over everything but the market's replica axes, giving one value per replica (a scalar without replicas).
+    """
+    return np.sum(x, axis=tuple(range(np.ndim(market.budget) - 1, np.ndim(x))))
+
+def eisenberg_gale(market, previous_price, previous_bid):
+    """
+    Returns the Eisenberg-Gale objective sum_i B_i log u_i, the log of the budget-weighted Nash social welfare.
+    Equilibrium allocations maximize it.
+    """
+    with np.errstate(divide='ignore'):
+        return _replica_sum(market, market.budget * np.log(market.get_individual_utility()))
+
+def kl_divergence(market, previous_price, previous_bid):
+    """
+    Returns the KL divergence sum_ij b_ij(t) log(b_ij(t) / b_ij(t-1)) between successive bids, the potential
+    proportional response decreases. Pairs with 0 bids contribute 0.
+    """
+    bid = market.get_bid()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = bid * np.log(bid / previous_bid)
+    return _replica_sum(market, np.where(bid > 0, terms, 0))
+
+def excess_spending(market, previous_price, previous_bid):
+    """
+    Returns the excess spending at the previous prices, sum_j |p_j(t) - p_j(t-1)|, relative to total budget.
+    """
+    return _replica_sum(market, np.abs(market.get_price() - previous_price)) / _replica_sum(market, market.budget)
+
+def buyer_utility(market, previous_price, previous_bid):
+    """
+    Returns each buyer's utility, so that per-buyer trends are summarized elementwise.
+    """
+    return market.get_individual_utility()
+
+def price(market, previous_price, previous_bid):
+    return market.get_price()
+
+class TrajectoryAnalytics:
+    """
+    Class to compute metrics of a simulation's trajectory as it runs, keeping only RunningStats summaries of each.
+    Analyzing a run this way takes memory of the size of the metrics' values (O(n+m)) instead of a full history;
+    metrics comparing successive steps also keep the previous prices. kl_divergence needs the previous bids too, a
+    copy of O(nm) memory and an O(nm) copy each update, so it is left out of the defaults; ask for it by name.
+    Pass to Simulation to update after each step, and record no history with strides of 0 to save the memory.
+
+    Attributes
+    ----------
+    metrics : dict
+        metrics[name] gives fn(market, previous_price, previous_bid), computing the metric after an update from the
+        prices and bids before it. Defaults to DEFAULT_METRICS, every metric in METRICS but kl_divergence.
+    every : int
+        Number of steps between updates. Previous prices and bids are those every steps before.
+    decay : float
+        decay of the RunningStats.
+    stats : dict
+        stats[name] gives the RunningStats of metric name.
+
+    Methods
+    -------
+    start(market):
+        Keeps the market's current prices and bids to compare the next update with.
+    update(market):
+        Computes every metric after an update.
+    get_summary():
+        returns the summary of every metric as a dict.
+    """
+    def __init__(self, metrics=None, every: int = 1, decay: float = 0.9):
+        if every <= 0:
+            raise ValueError("every must be positive.")
+        if metrics is None:
+            metrics = DEFAULT_METRICS
+        if not isinstance(metrics, dict):
+            unknown = set(metrics) - set(METRICS)
+            if unknown:
+                raise ValueError("Unknown metrics " + str(sorted(unknown)) + ". Choose from " + str(list(METRICS)) + ", or pass functions.")
+            metrics = {name: METRICS[name] for name in metrics}
+        self.metrics = metrics
+        self.every = every
+        self.decay = decay
+        self.stats = {name: RunningStats(decay) for name in metrics}
+        self.keep_bid = kl_divergence in metrics.values()
+        self.previous_price = None
+        self.previous_bid = None
+
+    def start(self, market):
+        self.previous_price = np.array(market.get_price())
+        if self.keep_bid:
+            if self.previous_bid is None or np.shape(self.previous_bid) != np.shape(market.get_bid()):
+                self.previous_bid = np.array(market.get_bid())
+            else:
+                np.copyto(self.previous_bid, market.get_bid())
+
+    def update(self, market):
+        """
+        Computes every metric, if the market's time is a multiple of every.
+        """
+        if market.get_time() % self.every:
+            return
+        for name, fn in self.metrics.items():
+            self.stats[name].update(fn(market, self.previous_price, self.previous_bid))
+        self.start(market)
+
+    def get_summary(self):
+        """
+        Returns
+        -------
+        dict
+            summary[name] gives the RunningStats summary of metric name: count, last, min, max, mean, decayed_mean,
+            rate and error.
+        """
+        return {name: stats.get_summary() for name, stats in self.stats.items()}
+
+    def get_state(self):
+        """
+        Returns the accumulators and previous values, to continue the summaries exactly after a checkpoint.
+        """
+        return {
+            "stats": {name: stats.get_state() for name, stats in self.stats.items()},
+            "previous_price": _copy(self.previous_price),
+            "previous_bid": _copy(self.previous_bid),
+        }
+
+    def set_state(self, state: dict):
+        if set(state["stats"]) != set(self.stats):
+            raise ValueError("Checkpointed analytics computed " + str(sorted(state["stats"])) + ".")
+        for name, stats in self.stats.items():
+            stats.set_state(state["stats"][name])
+        self.previous_price = state["previous_price"]
+        self.previous_bid = state["previous_bid"]
+
+# name: function computing the metric, see TrajectoryAnalytics.metrics
+METRICS = {
+    "eisenberg_gale": eisenberg_gale,
+    "kl_divergence": kl_divergence,
+    "excess_spending": excess_spending,
+    "buyer_utility": buyer_utility,
+    "price": price,
+}
+
+# Metrics computed by default, in O(n+m) memory.
+DEFAULT_METRICS = [name for name in METRICS if name != "kl_divergence"]
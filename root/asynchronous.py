@@ -0,0 +1,118 @@
+import numpy as np
+
+class BuyerSchedule:
+    """
+    Class to run a market's update rule asynchronously: each step updates only batch_size buyers against the current
+    prices (see Market.update_buyers), so it costs O(batch_size * m) instead of O(nm).
+    Prices are kept by adding the change in the updated buyers' bids, and summed again from all bids once per sweep
+    (n / batch_size steps) so that rounding errors don't build up.
+
+    This base class picks buyers uniformly at random.
+
+    Attributes
+    ----------
+    batch_size : int
+        Number of buyers updated per step.
+    change : np.array
+        1d 1xn array. change[i] gives the change in buyer i's bids at their last update, relative to their budget,
+        or inf if they haven't been updated yet. The largest change over replicas, if any.
+    steps : int
+        Number of steps taken.
+
+    Methods
+    -------
+    step(market):
+        Updates one batch of buyers.
+    get_residual():
+        returns the largest change of any buyer at their last update.
+    run(market, max_steps, tol):
+        Steps until every buyer's last change is below tol.
+    """
+    def __init__(self, batch_size: int, seed: int = None):
+        if batch_size <= 0:
+            raise ValueError("batch_size must be positive.")
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+        self.change = None
+        self.steps = 0
+
+    def get_sweep_steps(self, market):
+        """
+        Returns the number of steps that update as many buyers as one synchronous update.
+        """
+        return -(-market.n_buyers // self.batch_size)
+
+    def step(self, market):
+        if self.change is None or len(self.change) != market.n_buyers:
+            self.change = np.full(market.n_buyers, np.inf)
+        buyers = self._choose(market)
+        change = market.update_buyers(buyers)
+        self.change[buyers] = np.max(change, axis=tuple(range(change.ndim - 1)))
+        self.steps += 1
+        if self.steps % self.get_sweep_steps(market) == 0:
+            market._update_price()
+
+    def get_residual(self):
+        return np.max(self.change)
+
+    def run(self, market, max_steps: int, tol: float):
+        """
+        Steps until every buyer's last change is below tol, checking once per sweep.
+
+        Returns
+        -------
+        int
+            Number of steps taken, or None if it didn't converge in max_steps.
+        """
+        sweep = self.get_sweep_steps(market)
+        for i in range(max_steps):
+            self.step(market)
+            if (i + 1) % sweep == 0 and self.get_residual() < tol:
+                return i + 1
+        return None
+
+    def _choose(self, market):
+        """
+        Returns the buyers to update next, as indices or a slice.
+        """
+        return self.rng.choice(market.n_buyers, min(self.batch_size, market.n_buyers), replace=False)
+
+class CyclicSchedule(BuyerSchedule):
+    """
+    Class to update buyers in order, batch_size consecutive buyers at a time, wrapping around.
+    Consecutive buyers are contiguous in memory, so each step reads and writes whole blocks.
+    """
+    def __init__(self, batch_size: int):
+        super().__init__(batch_size)
+        self.next = 0
+
+    def _choose(self, market):
+        if self.next >= market.n_buyers:
+            self.next = 0
+        start = self.next
+        self.next = min(start + self.batch_size, market.n_buyers)
+        return slice(start, self.next)
+
+class PrioritySchedule(BuyerSchedule):
+    """
+    Class to update the buyers whose bids changed most at their last update, since they are furthest from their
+    response to the current prices. A fraction explore of each batch is picked at random instead, so that buyers
+    whose change was small are revisited as prices move.
+    """
+    def __init__(self, batch_size: int, explore: float = 0.25, seed: int = None):
+        if not 0 <= explore <= 1:
+            raise ValueError("explore must be in [0, 1].")
+        super().__init__(batch_size, seed)
+        self.explore = explore
+
+    def _choose(self, market):
+        n_buyers = market.n_buyers
+        batch_size = min(self.batch_size, n_buyers)
+        n_random = int(round(self.explore * batch_size))
+        n_top = batch_size - n_random
+        top = np.argpartition(self.change, n_buyers - n_top)[n_buyers - n_top:] if n_top else np.zeros(0, dtype=int)
+        if not n_random:
+            return top
+        rest = np.ones(n_buyers, dtype=bool)
+        rest[top] = False
+        return np.concatenate([top, self.rng.choice(np.flatnonzero(rest), n_random, replace=False)])
@@ -0,0 +1,79 @@
+import numpy as np
+
+# Numba is optional. Without it, markets run the NumPy reference whatever backend they ask for.
+try:
+    import numba
+    prange = numba.prange
+except ImportError:
+    numba = None
+    prange = range
+
+def _linear_response(qty, utility, budget, bid, individual_utility):
+    """
+    Fused linear update of rows of a market: bid[i,j] = budget[i] * utility[i,j] * qty[i,j] / u_i, where
+    u_i = sum_j utility[i,j] * qty[i,j] is written to individual_utility[i]. Rows with u_i = 0 are left as they are.
+    """
+    n, m = qty.shape
+    for i in prange(n):
+        total = 0.0
+        for j in range(m):
+            total += utility[i, j] * qty[i, j]
+        individual_utility[i] = total
+        if total != 0:
+            for j in range(m):
+                bid[i, j] = budget[i] * (utility[i, j] * qty[i, j]) / total
+
+def _separable_response(qty, log_utility, exponent, log_coefficient, budget, bid, log_total):
+    """
+    Fused separable update of rows of a market, normalized with log-sum-exp as in Market._respond_log:
+    each buyer responds (log_utility[i,j] + log(qty[i,j])) * exponent[i,j] + log_coefficient[i,j] in the log domain.
+    The log of the sum of each buyer's responses is written to log_total[i]. Rows that respond log(0) to every good
+    get a log_total of -inf, and their bids are left undefined, since the market raises for them.
+    The bid row is the scratch space of the log responses, so it takes no memory beyond the market's arrays.
+    """
+    n, m = qty.shape
+    for i in prange(n):
+        log_max = -np.inf
+        for j in range(m):
+            log_response = (np.log(qty[i, j]) + log_utility[i, j]) * exponent[i, j] + log_coefficient[i, j]
+            bid[i, j] = log_response
+            if log_response > log_max:
+                log_max = log_response
+        if log_max == -np.inf:
+            log_total[i] = -np.inf
+        else:
+            total = 0.0
+            for j in range(m):
+                response = np.exp(bid[i, j] - log_max)
+                bid[i, j] = response
+                total += response
+            scale = budget[i] / total
+            for j in range(m):
+                bid[i, j] *= scale
+            log_total[i] = log_max + np.log(total)
+
+# Reference kernels in Python, by name, for debugging and testing the fused logic without compiling.
+PYTHON_KERNELS = {
+    "linear_response": _linear_response,
+    "separable_response": _separable_response,
+}
+
+# backend: {name: kernel}. Kernels are compiled on first use, and cached on disk so later processes skip compiling.
+KERNELS = {}
+if numba is not None:
+    KERNELS["numba"] = {name: numba.njit(parallel=True, cache=True)(fn) for name, fn in PYTHON_KERNELS.items()}
+
+# Backends markets accept. "numpy" is the reference, and every other backend must match it to rounding.
+BACKENDS = ("numpy", "numba")
+
+def get_backends():
+    """
+    Returns the backends that can run here: "numpy", and those whose compiler is installed.
+    """
+    return ["numpy"] + [backend for backend in BACKENDS if backend in KERNELS]
+
+def get_kernel(backend: str, name: str):
+    """
+    Returns kernel name of backend, or None to run the NumPy reference instead.
+    """
+    return KERNELS.get(backend, {}).get(name)
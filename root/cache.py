@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import numpy as np
+from root.checkpoint import load_state, save_state
+
+class ResultCache:
+    """
+    Class to cache the results of Simulation.run on disk, keyed by a hash of everything the run depends on:
+    the market's class and full state (budgets, bids, utilities, alpha, time...), the simulation's state (strides,
+    history so far, analytics) and the run's parameters (tolerances, check_every).
+
+    Each entry stores the simulation's state at the end of a run, so its final market and summaries, the history it
+    recorded (the trajectory, if strides keep one) and its result (converged_time and residuals). Entries of the same
+    start are files steps.npz, or steps-converged.npz for runs that converged after steps updates, in a directory
+    named by the key. A run of more steps continues from the longest entry it extends, instead of starting over.
+    Files are evicted least recently used first once the cache holds more than max_bytes.
+
+    Attributes
+    ----------
+    directory : str
+        Directory the cache is kept in. Several processes may share it.
+    max_bytes : int
+        Size the cache is kept under.
+
+    Methods
+    -------
+    get_key(state, params):
+        returns the key of a run from the simulation's state and the run's parameters.
+    get(key, time_steps, check_every):
+        returns the cached entry that a run of time_steps updates can use, or None.
+    put(key, steps, converged, state):
+        Stores the state after a run of steps updates.
+    get_size():
+        returns the number of bytes cached.
+    """
+    def __init__(self, directory: str, max_bytes: int = 2 ** 30):
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive.")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def get_key(self, state: dict, params: dict):
+        """
+        Returns the hex digest of a state dict of arrays and JSON-able values (see save_state) and of params.
+        """
+        key = hashlib.sha1()
+        _hash(key, {"state": state, "params": params})
+        return key.hexdigest()
+
+    def _get_entries(self, key):
+        """
+        Returns (steps, converged, path) of each entry of key.
+        """
+        try:
+            names = os.listdir(os.path.join(self.directory, key))
+        except FileNotFoundError:
+            return []
+        entries = []
+        for name in names:
+            if not name.endswith(".npz"):
+                continue
+            steps, _, flag = name[:-len(".npz")].partition("-")
+            entries.append((int(steps), flag == "converged", os.path.join(self.directory, key, name)))
+        return entries
+
+    def get(self, key: str, time_steps: int, check_every: int = 1):
+        """
+        Finds the longest entry of key that a run of up to time_steps updates, checked every check_every steps, can use.
+        A run that converged after steps <= time_steps updates gives the same result, as long as that step is also
+        checked. A run that did not converge is a prefix of any longer run it was checked the same way as.
+
+        Returns
+        -------
+        steps : int
+            Number of updates the entry ran.
+        finished : bool
+            Whether the entry is the result of the whole run, or only its first steps.
+        state : dict
+            Simulation state after the entry, with its "result".
+        Or None if there is no usable entry.
+        """
+        usable = []
+        for steps, converged, path in self._get_entries(key):
+            if converged and steps <= time_steps and (steps % check_every == 0 or steps == time_steps):
+                usable.append((steps, True, path))
+            elif not converged and steps == time_steps:
+                usable.append((steps, True, path))
+            elif not converged and steps < time_steps and steps % check_every == 0:
+                usable.append((steps, False, path))
+        # Finished entries first, then the longest prefix.
+        for steps, finished, path in sorted(usable, key=lambda entry: (entry[1], entry[0]), reverse=True):
+            try:
+                state = load_state(path)
+                # Mark it recently used.
+                os.utime(path)
+            except FileNotFoundError:
+                # Evicted by another process meanwhile.
+                continue
+            return steps, finished, state
+        return None
+
+    def put(self, key: str, steps: int, converged: bool, state: dict):
+        """
+        Stores state, the simulation's state after a run of steps updates with its "result", then evicts the least
+        recently used entries beyond max_bytes.
+        """
+        name = str(steps) + ("-converged" if converged else "") + ".npz"
+        while True:
+            os.makedirs(os.path.join(self.directory, key), exist_ok=True)
+            try:
+                save_state(os.path.join(self.directory, key, name), state)
+                break
+            except FileNotFoundError:
+                # Another process evicted the key's last entry and removed its directory in between.
+                pass
+        self._evict()
+
+    def _get_files(self):
+        """
+        Returns (last use time, size, path) of every cached file.
+        """
+        files = []
+        for key in os.listdir(self.directory):
+            for _, _, path in self._get_entries(key):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def get_size(self):
+        return sum(size for _, size, _ in self._get_files())
+
+    def _evict(self):
+        files = sorted(self._get_files())
+        size = sum(size for _, size, _ in files)
+        for _, file_size, path in files:
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                # Other entries of the key are left.
+                pass
+
+def _hash(key, value):
+    """
+    Feeds a state dict of arrays and JSON-able values into hashlib object key, in an order independent of insertion.
+    """
+    if isinstance(value, dict):
+        key.update(b"{")
+        for name in sorted(value):
+            key.update(json.dumps(name).encode())
+            _hash(key, value[name])
+        key.update(b"}")
+    elif isinstance(value, np.ndarray):
+        array = np.ascontiguousarray(value)
+        key.update(str((array.shape, array.dtype.str)).encode())
+        key.update(array.data)
+    else:
+        key.update(json.dumps(value, sort_keys=True).encode())
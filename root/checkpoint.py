@@ -0,0 +1,172 @@
+import importlib
+import json
+import os
+import tempfile
+import threading
+import numpy as np
+
+def get_market_state(market):
+    """
+    Copies the full state of a market, so the market can keep updating while the copy is saved.
+
+    Returns
+    -------
+    dict
+        "class" gives the market's class as module.name, "arrays" copies of its array attributes
+        (time-varying or not, e.g. bid, price, budget, utility) and "scalars" its other attributes (e.g. time, alpha, n_linear).
+    """
+    if getattr(market, "active_set", None) is not None:
+        raise ValueError("Turn the market's active set off (set_active_set(None)) before saving it.")
+    arrays = {}
+    scalars = {}
+    for key, value in vars(market).items():
+        if key in market.transient:
+            continue
+        if isinstance(value, np.ndarray):
+            arrays[key] = value.copy()
+        elif isinstance(value, np.generic):
+            scalars[key] = value.item()
+        else:
+            scalars[key] = value
+    return {"class": type(market).__module__ + "." + type(market).__qualname__, "arrays": arrays, "scalars": scalars}
+
+def set_market_state(state, market=None):
+    """
+    Rebuilds a market from get_market_state(), without running its constructor.
+    If a market of the same class is given, it is restored in place instead, keeping its transient attributes
+    (e.g. its observer); cached values among them are checked against the arrays they came from, so they are not reused.
+    """
+    module, name = state["class"].rsplit(".", 1)
+    market_class = getattr(importlib.import_module(module), name)
+    if market is not None:
+        if type(market) is not market_class:
+            raise ValueError("Cannot restore a " + state["class"] + " into a " + type(market).__name__ + ".")
+    else:
+        market = market_class.__new__(market_class)
+        for key in market.transient:
+            setattr(market, key, None)
+    market.__dict__.update(state["scalars"])
+    market.__dict__.update(state["arrays"])
+    return market
+
+def save_state(path: str, state: dict):
+    """
+    Writes a state dict of arrays and JSON-able values to path as an uncompressed .npz file.
+    The file is written to a unique temporary file next to path and then renamed, so a crash never leaves a partial
+    checkpoint, and processes writing the same path at once each rename a whole file.
+    """
+    arrays = {}
+    meta = {}
+    def flatten(prefix, value):
+        if isinstance(value, dict):
+            meta[prefix] = "dict"
+            for key, item in value.items():
+                flatten(prefix + "/" + key, item)
+        elif isinstance(value, np.ndarray):
+            arrays[prefix] = value
+        else:
+            meta[prefix] = ["value", value]
+    for key, value in state.items():
+        flatten(key, value)
+    arrays["__meta__"] = np.array(json.dumps(meta))
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", prefix=os.path.basename(path) + ".", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def load_state(path: str):
+    """
+    Reads a state dict written by save_state.
+    """
+    state = {}
+    def insert(prefix, value):
+        keys = prefix.split("/")
+        d = state
+        for key in keys[:-1]:
+            d = d.setdefault(key, {})
+        d.setdefault(keys[-1], value)
+    with np.load(path, allow_pickle=False) as f:
+        meta = json.loads(f["__meta__"][()])
+        for prefix, value in meta.items():
+            insert(prefix, {} if value == "dict" else value[1])
+        for prefix in f.files:
+            if prefix != "__meta__":
+                insert(prefix, f[prefix])
+    return state
+
+def append_records(path: str, records: np.array, start: int):
+    """
+    Writes records to the raw file path after its first start records, dropping any records after those
+    (e.g. appended for a checkpoint that never finished), so earlier records are never written again.
+    """
+    size = start * records.dtype.itemsize * int(np.prod(records.shape[1:]))
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() < size:
+            raise ValueError("File " + path + " has fewer than " + str(start) + " records.")
+        f.truncate(size)
+        f.seek(size)
+        np.ascontiguousarray(records).tofile(f)
+
+def load_records(path: str, dtype, shape: tuple, count: int):
+    """
+    Reads the first count records of the given dtype and shape from a raw file written by append_records.
+    """
+    dtype = np.dtype(dtype)
+    records = np.fromfile(path, dtype=dtype, count=count * int(np.prod(shape)))
+    if len(records) < count * int(np.prod(shape)):
+        raise ValueError("File " + path + " has fewer than " + str(count) + " records.")
+    return records.reshape((count,) + tuple(shape))
+
+def save_market(path: str, market):
+    save_state(path, {"market": get_market_state(market)})
+
+def load_market(path: str):
+    return set_market_state(load_state(path)["market"])
+
+class Checkpointer:
+    """
+    Class to save states in a background thread.
+    At most one save is in flight; a new save first waits for the previous one to finish.
+
+    Methods
+    -------
+    save(path, state):
+        Starts saving state to path.
+    submit(fn):
+        Starts running fn, e.g. to write several files.
+    wait():
+        Waits for the last save to finish, raising any error it hit.
+    """
+    def __init__(self):
+        self.thread = None
+        self.error = None
+
+    def _run(self, fn):
+        try:
+            fn()
+        except Exception as e:
+            self.error = e
+
+    def save(self, path: str, state: dict):
+        self.submit(lambda: save_state(path, state))
+
+    def submit(self, fn):
+        self.wait()
+        self.thread = threading.Thread(target=self._run, args=(fn,), daemon=True)
+        self.thread.start()
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise IOError("Failed writing checkpoint.") from error
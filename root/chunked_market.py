@@ -0,0 +1,165 @@
+import os
+import threading
+import numpy as np
+from root.market import Market, MixedUtilityMarket, PropRespLinearMarket, PropRespZhangMarket
+
+# Bytes of each nxm array a chunk of buyers may take in memory. A step holds a few such arrays at once.
+CHUNK_BYTES = 2 ** 22
+
+FILES = ("budget", "bid", "utility")
+
+def create_market_files(directory: str, n_buyers: int, n_goods: int, dtype=np.float64):
+    """
+    Creates budget.npy, bid.npy and utility.npy in directory, to be filled chunk by chunk without holding them in memory.
+
+    Returns
+    -------
+    list
+        [budget, bids, util] as writable memory-mapped arrays of shapes n, nxm and nxm.
+    """
+    os.makedirs(directory, exist_ok=True)
+    shapes = {"budget": (n_buyers,), "bid": (n_buyers, n_goods), "utility": (n_buyers, n_goods)}
+    return [np.lib.format.open_memmap(os.path.join(directory, name + ".npy"), mode="w+", dtype=dtype, shape=shapes[name]) for name in FILES]
+
+def open_market_files(directory: str):
+    """
+    Opens the files written by create_market_files. Budgets and utilities are read-only, and bids are updated in place.
+
+    Returns
+    -------
+    list
+        [budget, bids, util] as memory-mapped arrays.
+    """
+    return [np.load(os.path.join(directory, name + ".npy"), mmap_mode="r+" if name == "bid" else "r") for name in FILES]
+
+class ChunkedMarket(Market):
+    """
+    Class to represent a market whose budgets, bids and utilities can be larger than memory, e.g. memory-mapped files.
+    Prices are sums over buyers, and a buyer's new bids only need their own row and the prices, so each update
+    streams over blocks of chunk_size buyers twice: once summing bids into prices, then once computing quantities
+    and new bids with the market's update rule and writing them back. Both passes read the arrays in order, and
+    only a few chunks are held in memory at once, besides 1xm prices and 1xn individual utilities.
+    Chunks are the shards of a sharded Market update (see Market.set_workers), so they can also be updated on several
+    threads at once, with results that depend on chunk_size but never on the number of workers.
+
+    Quantities are written chunk by chunk as each update computes them, into qty.npy next to a memory-mapped bid file,
+    or into memory otherwise, so get_qty() gives the quantities the last bids were computed from, as in Market.
+    log(utility) isn't cached, so each chunk computes its own every step. Updating in place (see set_in_place), each
+    thread reuses one set of scratch arrays per chunk length, log(utility) included.
+    Checkpoints and other whole-array operations (e.g. acceleration) read every array into memory.
+
+    Attributes
+    ----------
+    chunk_size : int
+        Number of buyers updated at once, the market's shard_size. Defaults to as many as fit in CHUNK_BYTES.
+    workers : int
+        Number of threads chunks are updated on.
+    Other attributes are as in Market. Arrays have no replica axes.
+    """
+    def __init__(self, budget: np.array, start_bids: np.array, utility: np.array):
+        if utility.ndim != 2:
+            raise ValueError("Chunked markets have no replica axes. Utility should be nxm.")
+        self.n_buyers, self.n_goods = utility.shape
+        if np.shape(budget) != (self.n_buyers,):
+            raise ValueError("Check that budget and utility dimensions conform. Budget should be 1xn and Utility should be mxn")
+        if start_bids.shape != utility.shape:
+            raise ValueError("Check that starting bids and utility have the same dimensions.")
+
+        self.chunk_size = max(1, CHUNK_BYTES // (self.n_goods * start_bids.itemsize))
+        self.workers = 1
+        self.pool = None
+        self.time = 0
+        self.bid = start_bids
+        self.budget = budget
+        self.utility = utility
+        for chunk in self._get_shards():
+            if np.any(np.sum(start_bids[chunk], axis=-1) > budget[chunk]):
+                raise ValueError("Starting bids of each invididual cannot be greater than their budget!")
+        self._update_price()
+        self._set_qty()
+        self.individual_utility = np.zeros(self.n_buyers)
+        self._log_utility = None
+        self._log_utility_source = None
+        self.observer = None
+        self._buffers = None
+        self._workspace = None
+
+    @property
+    def chunk_size(self):
+        return self.shard_size
+
+    @chunk_size.setter
+    def chunk_size(self, chunk_size: int):
+        self.shard_size = chunk_size
+
+    @classmethod
+    def from_files(cls, directory: str, *args):
+        """
+        Builds a market on the files written by create_market_files. Its bids are updated in the bid file.
+        """
+        return cls(*open_market_files(directory), *args)
+
+    def set_workers(self, workers: int, shard_size: int = None):
+        """
+        Sets the number of threads chunks are updated on, and optionally chunk_size. Use enough chunks to keep every
+        worker busy. Chunked markets are always sharded, by chunk.
+        """
+        if workers is None:
+            raise ValueError("Chunked markets are always updated chunk by chunk.")
+        super().set_workers(workers, shard_size or self.chunk_size)
+
+    def _set_qty(self):
+        """
+        Sets quantities to bids over prices, chunk by chunk.
+        """
+        qty = self._get_shard_qty()
+        def set_chunk(chunk):
+            qty[chunk] = self.bid[chunk] / self.price
+        self._map_shards(set_chunk)
+
+    def _get_shard_qty(self):
+        """
+        Returns the market's quantity array, made again if the market's shape changed.
+        A memory-mapped bid file gets a qty.npy file next to it.
+        """
+        if np.shape(getattr(self, "qty", None)) != self.bid.shape:
+            dtype = np.result_type(self.bid, self.price)
+            filename = getattr(self.bid, "filename", None)
+            if filename is not None:
+                path = os.path.join(os.path.dirname(filename), "qty.npy")
+                self.qty = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=self.bid.shape)
+            else:
+                self.qty = np.empty(self.bid.shape, dtype=dtype)
+        return self.qty
+
+    def _get_shard_workspace(self, chunk: slice):
+        """
+        Returns the workspace of the market updating chunk when updating in place, or None. Scratch arrays for every
+        chunk would take as much memory as the market, so each thread keeps one set per chunk length instead.
+        """
+        if not self.in_place:
+            return None
+        return self._workspace.setdefault(("chunk", threading.get_ident(), chunk.stop - chunk.start), {})
+
+    def _cache_log_utility(self):
+        # log(utility) would be as large as utility, so chunks compute theirs as they go.
+        pass
+
+    def _set_price(self, price: np.array):
+        self.price = price
+        self._set_qty()
+
+class ChunkedPropRespLinearMarket(PropRespLinearMarket, ChunkedMarket):
+    """
+    Class to represent a chunked market, using proportionate response dynamics with linear utilities.
+    """
+
+class ChunkedPropRespZhangMarket(PropRespZhangMarket, ChunkedMarket):
+    """
+    Class to represent a chunked market with Zhang's CES preferences, using the proportional response dynamic detailed in his paper.
+    """
+
+class ChunkedMixedUtilityMarket(MixedUtilityMarket, ChunkedMarket):
+    """
+    Class to represent a chunked market where buyers and goods can each have their own form of utility, as in MixedUtilityMarket.
+    """
@@ -0,0 +1,84 @@
+import numpy as np
+from root.market import Market
+
+class EnsembleMarket:
+    """
+    Class to run K independent replicas of a market as one stacked market.
+    Replicas share a market class, number of buyers and number of goods, but can have different budgets, bids and utilities.
+    All replicas are advanced by a single batched update.
+
+    Attributes
+    ----------
+    market : Market
+        Market holding Kxn budgets and Kxnxm bids and utilities.
+    n_replicas : int
+        Number of replicas K.
+    price_change : np.array
+        1d 1xK array. price_change[k] gives the largest relative change in price of replica k over the last update.
+
+    Methods
+    -------
+    update():
+        Performs the update rule for every replica.
+    run(time_steps):
+        Performs time_steps updates.
+    get_converged(tol):
+        returns which replicas have relative price changes below tol.
+    """
+    def __init__(self, market_class: type, budgets: np.array, start_bids: np.array, utilities: np.array, *args):
+        """
+        Params
+        ------
+        market_class : type
+            Subclass of Market whose update rule is used.
+        budgets : np.array
+            2d Kxn array. budgets[k] gives the budgets of replica k.
+        start_bids : np.array
+            3d Kxnxm array. start_bids[k] gives the starting bids of replica k.
+        utilities : np.array
+            3d Kxnxm array. utilities[k] gives the utilities of replica k.
+        *args
+            Extra parameters of market_class, e.g. alpha. Parameters that vary by replica can be given as Kx1x1 arrays.
+        """
+        if not issubclass(market_class, Market):
+            raise ValueError("market_class must be a subclass of Market.")
+        if utilities.ndim != 3:
+            raise ValueError("Utilities should be Kxnxm.")
+        self.market = market_class(budgets, start_bids, utilities, *args)
+        self.n_replicas = utilities.shape[0]
+        self.price_change = np.full(self.n_replicas, np.inf)
+
+    @classmethod
+    def from_params(cls, market_class: type, params: list, *args):
+        """
+        Stacks a list of [budget, bids, util] as returned by Initializer into an ensemble.
+        """
+        budgets, start_bids, utilities = (np.stack(x) for x in zip(*params))
+        return cls(market_class, budgets, start_bids, utilities, *args)
+
+    def update(self):
+        previous_price = np.array(self.market.get_price())
+        self.market.update()
+        self.price_change = np.max(np.abs(self.market.get_price() - previous_price) / self.market.get_price(), axis=-1)
+
+    def run(self, time_steps):
+        for i in range(time_steps):
+            self.update()
+
+    def get_converged(self, tol: float):
+        return self.price_change < tol
+
+    def get_price(self):
+        return self.market.get_price()
+
+    def get_qty(self):
+        return self.market.get_qty()
+
+    def get_bid(self):
+        return self.market.get_bid()
+
+    def get_time(self):
+        return self.market.get_time()
+
+    def get_individual_utility(self):
+        return self.market.get_individual_utility()
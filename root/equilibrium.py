@@ -0,0 +1,407 @@
+import collections
+import hashlib
+import numpy as np
+from root.market import MixedUtilityMarket, PropRespLinearMarket
+
+class Equilibrium:
+    """
+    Class to hold the equilibrium of a Fisher market, as found by solve_equilibrium.
+
+    Attributes
+    ----------
+    price : np.array
+        1d 1xm array of equilibrium prices.
+    bid : np.array
+        2d nxm array of equilibrium bids.
+    individual_utility : np.array
+        1d 1xn array of each buyer's utility at equilibrium, defined as in the market.
+    residual : float
+        How far price and bid are from satisfying the equilibrium conditions, relative to total budget:
+        the gap between the solver's prices and the sum of bids, plus the spending of linear buyers on goods
+        that don't give them the most utility per unit price. Around 1e-15 when solved exactly.
+
+    All arrays carry the market's leading replica axes, if any.
+
+    Methods
+    -------
+    get_price_error(price):
+        returns the largest relative error of price.
+    get_utility_error(individual_utility):
+        returns the largest relative error of individual_utility.
+    """
+    def __init__(self, price: np.array, bid: np.array, individual_utility: np.array, residual: float):
+        self.price = price
+        self.bid = bid
+        self.individual_utility = individual_utility
+        self.residual = residual
+
+    def get_price_error(self, price: np.array):
+        return np.max(np.abs(price - self.price) / self.price)
+
+    def get_utility_error(self, individual_utility: np.array):
+        return np.max(np.abs(individual_utility - self.individual_utility) / self.individual_utility)
+
+def _softmax(z: np.array):
+    """
+    Returns the softmax of each row of z. Overwrites z.
+    """
+    z_max = np.max(z, axis=1, keepdims=True)
+    z -= z_max
+    share = np.exp(z, out=z)
+    total = np.sum(share, axis=1, keepdims=True)
+    share /= total
+    return share
+
+def _spending(y, budget, log_utility, c):
+    """
+    Returns each buyer's bids at prices exp(y), if buyer i has CES preferences with elasticity parameter c[i].
+    Buyer i spends in proportion to (utility[i,j] / price[j]) ** c[i].
+    """
+    return budget[:, None] * _softmax(c[:, None] * (log_utility - y))
+
+def _newton(y, budget, log_utility, c, fixed_spending, tol, max_iter=200):
+    """
+    Finds log prices y at which the CES buyers' spending and fixed_spending add up to the prices,
+    by Newton's method on the convex potential sum_j exp(y_j) + sum_i budget[i] / c[i] * log(sum_j exp(c[i] * (log_utility[i,j] - y_j))),
+    whose gradient is prices minus spending. Stops when the excess spending is below tol, or at working precision.
+
+    Returns
+    -------
+    y : np.array
+        Log prices.
+    bid : np.array
+        CES buyers' bids at exp(y).
+    excess : float
+        sum_j |exp(y_j) - spending_j|.
+    """
+    bid = _spending(y, budget, log_utility, c)
+    excess = np.exp(y) - np.sum(bid, axis=0) - fixed_spending
+    for _ in range(max_iter):
+        norm = np.linalg.norm(excess)
+        if np.sum(np.abs(excess)) <= tol:
+            break
+        # Hessian of the potential is diag(price) + sum_i c[i] * budget[i] * (diag(share_i) - share_i share_i^T).
+        weighted = bid * np.sqrt(c / budget)[:, None]
+        hessian = -(weighted.T @ weighted)
+        hessian[np.diag_indices_from(hessian)] += np.exp(y) + np.sum(c[:, None] * bid, axis=0)
+        step = np.linalg.solve(hessian, -excess)
+        t = 1.0
+        while t > 1e-10:
+            new_y = y + t * step
+            new_bid = _spending(new_y, budget, log_utility, c)
+            new_excess = np.exp(new_y) - np.sum(new_bid, axis=0) - fixed_spending
+            if np.linalg.norm(new_excess) <= (1 - t / 4) * norm:
+                break
+            t /= 2
+        else:
+            break # no more progress at working precision
+        y, bid, excess = new_y, new_bid, new_excess
+    return y, bid, np.sum(np.abs(excess))
+
+def _linear_equilibrium(budget, log_utility, y, max_gap, fixed_spending):
+    """
+    Solves a linear market exactly, given approximate log prices y.
+    Each buyer spends on the good giving them the most utility per unit price. Buyers also spending on other goods
+    are guessed by joining goods with the pairs closest to a tie (within max_gap in log utility per unit price),
+    smallest gap first, without making cycles. The guessed spending graph is then a forest, which fixes prices up to
+    a scale per connected component. Bids are then found on every tie at those prices, which also covers degenerate
+    markets where the forest's own edges would need negative spending, and checked to add up to the prices.
+
+    Returns
+    -------
+    y : np.array
+        Log prices from the guessed graph.
+    bid : np.array
+        Bids, or None if the guessed graph was wrong.
+    """
+    n, m = log_utility.shape
+    rows = np.arange(n)
+    surplus = log_utility - y
+    top = np.argmax(surplus, axis=1)
+    gap = surplus[rows, top][:, None] - surplus
+    gap[rows, top] = np.inf
+
+    # Join goods with the closest ties, as in Kruskal's algorithm.
+    n_candidates = min(gap.size - 1, 20 * m)
+    candidates = np.argpartition(gap, n_candidates, axis=None)[:n_candidates]
+    candidates = candidates[gap.flat[candidates] <= max_gap]
+    candidates = candidates[np.argsort(gap.flat[candidates], kind='stable')]
+    parent = list(range(m))
+    def find(j):
+        while parent[j] != j:
+            parent[j] = parent[parent[j]]
+            j = parent[j]
+        return j
+    extra = []
+    for flat in candidates:
+        i, j = divmod(int(flat), m)
+        a, b = find(int(top[i])), find(j)
+        if a != b:
+            parent[a] = b
+            extra.append((i, j))
+            if len(extra) == m - 1:
+                break
+
+    # Log prices relative to a root good of each component, from tied pairs.
+    neighbours = [[] for _ in range(m)]
+    for i, j in extra:
+        offset = log_utility[i, top[i]] - log_utility[i, j] # y[top[i]] - y[j]
+        neighbours[j].append((top[i], offset))
+        neighbours[top[i]].append((j, -offset))
+    relative = np.zeros(m)
+    component = np.full(m, -1)
+    n_components = 0
+    for root in range(m):
+        if component[root] >= 0:
+            continue
+        component[root] = n_components
+        queue = [root]
+        while queue:
+            j = queue.pop()
+            for k, offset in neighbours[j]:
+                if component[k] < 0:
+                    component[k] = n_components
+                    relative[k] = relative[j] + offset
+                    queue.append(k)
+        n_components += 1
+
+    # Each component's goods are bought with exactly its buyers' budgets.
+    component_budget = np.bincount(component[top], weights=budget, minlength=n_components)
+    component_budget += np.bincount(component, weights=fixed_spending, minlength=n_components)
+    component_value = np.bincount(component, weights=np.exp(relative), minlength=n_components)
+    y = relative + (np.log(component_budget) - np.log(component_value))[component]
+
+    # At these prices buyers may spend on any good within rounding of their most utility per unit price.
+    # Most have one such good and spend their budget on it. The rest are grouped by which goods they have,
+    # and groups split their budgets over them by maximum flow, so that spending on each good adds up to its price.
+    surplus = log_utility - y
+    best = surplus >= np.max(surplus, axis=1, keepdims=True) - 1e-9
+    single = np.count_nonzero(best, axis=1) == 1
+    single_top = np.argmax(best[single], axis=1)
+    bid = np.zeros((n, m))
+    bid[single, single_top] = budget[single]
+    demand = np.exp(y) - np.bincount(single_top, weights=budget[single], minlength=m) - fixed_spending
+    scale = np.sum(budget) + np.sum(fixed_spending)
+    if np.any(demand < -1e-9 * scale):
+        return y, None
+    tied = np.flatnonzero(~single)
+    if len(tied):
+        goods, group = np.unique(best[tied], axis=0, return_inverse=True)
+        group = group.ravel()
+        group_budget = np.bincount(group, weights=budget[tied])
+        n_groups = len(goods)
+        source, sink = n_groups + m, n_groups + m + 1
+        capacity = np.zeros((n_groups + m + 2, n_groups + m + 2))
+        capacity[source, :n_groups] = group_budget
+        capacity[:n_groups, n_groups:n_groups + m] = np.where(goods, scale, 0)
+        capacity[n_groups:n_groups + m, sink] = demand
+        flow = _max_flow(capacity, source, sink, 1e-12 * scale)
+        bid[tied] = flow[:n_groups, n_groups:n_groups + m][group] * (budget[tied] / group_budget[group])[:, None]
+    if np.sum(np.abs(np.sum(bid, axis=0) + fixed_spending - np.exp(y))) > 1e-9 * scale:
+        return y, None
+    return y, bid
+
+def _max_flow(capacity, source, sink, eps):
+    """
+    Returns a maximum flow from source to sink through a network with a dense capacity matrix, as a skew-symmetric
+    matrix of flows, by Edmonds-Karp: augmenting along shortest paths. Residual capacities up to eps count as 0.
+    """
+    flow = np.zeros_like(capacity)
+    n = len(capacity)
+    while True:
+        residual = capacity - flow
+        parent = np.full(n, -1)
+        parent[source] = source
+        frontier = [source]
+        while frontier and parent[sink] < 0:
+            reached = []
+            for u in frontier:
+                v = np.flatnonzero((residual[u] > eps) & (parent < 0))
+                parent[v] = u
+                reached.extend(v)
+            frontier = reached
+        if parent[sink] < 0:
+            return flow
+        path = []
+        v = sink
+        while v != source:
+            path.append((parent[v], v))
+            v = parent[v]
+        push = min(residual[u, v] for u, v in path)
+        for u, v in path:
+            flow[u, v] += push
+            flow[v, u] -= push
+
+# Lead in log utility per unit price, times the smoothing, beyond which a linear buyer's best good is taken as settled.
+# They'd spend at most exp(-FREEZE_GAP) of their budget elsewhere; more than the tolerance biases prices in degenerate markets.
+FREEZE_GAP = 30
+
+def _solve(budget, utility, exponent, cobb_douglas, tol, max_smoothing):
+    n, m = utility.shape
+    exponent = np.broadcast_to(np.asarray(exponent, dtype=float), utility.shape)
+    if np.any(exponent != exponent[:, :1]):
+        raise ValueError("The equilibrium solver supports one exponent per buyer, not per good.")
+    exponent = exponent[:, 0]
+    cobb_douglas = np.zeros(n, dtype=bool) if cobb_douglas is None else np.asarray(cobb_douglas, dtype=bool)
+    separable = ~cobb_douglas
+    if np.any(separable & ((exponent <= 0) | (exponent > 1))):
+        raise ValueError("Exponents must be in (0, 1].")
+    if np.any(np.sum(utility, axis=1) <= 0):
+        raise ValueError("Every buyer must have positive utility for some good.")
+    if not np.all(np.any(utility[separable] > 0, axis=0) | np.any(utility[cobb_douglas] > 0, axis=0)):
+        raise ValueError("Every good must be wanted by some buyer to have an equilibrium price.")
+
+    bid = np.zeros((n, m))
+    # Cobb-Douglas buyers spend a fixed share of their budget on each good, whatever the prices.
+    power = utility[cobb_douglas]
+    bid[cobb_douglas] = budget[cobb_douglas, None] * power / np.sum(power, axis=1, keepdims=True)
+    fixed_spending = np.sum(bid[cobb_douglas], axis=0)
+    total = np.sum(budget)
+    residual = 0.0
+
+    if np.any(separable):
+        budget_s = budget[separable]
+        with np.errstate(divide='ignore'):
+            log_utility = np.log(utility[separable])
+        exponent_s = exponent[separable]
+        linear = exponent_s == 1
+        # CES buyers spend in proportion to (utility / price) ** c, with c = alpha / (1 - alpha).
+        # Linear buyers are the limit c -> infinity, approached by raising c until their spending graph is found.
+        with np.errstate(divide='ignore'):
+            c_ces = exponent_s / (1 - exponent_s)
+        smoothing = 1.0
+        y = np.full(m, np.log(total / m))
+        bid_s = np.zeros((len(budget_s), m))
+        active = np.ones(len(budget_s), dtype=bool)
+        frozen_spending = np.zeros(m)
+        while True:
+            c = np.where(linear, smoothing, c_ces)[active]
+            # Smoothed levels are only steps towards the linear limit, so they don't need to be solved precisely.
+            level_tol = max(tol, 1e-3 / smoothing) if np.any(linear) and smoothing < max_smoothing else tol
+            y, bid_s[active], excess = _newton(y, budget_s[active], log_utility[active], c, fixed_spending + frozen_spending, level_tol * total)
+            if not np.any(linear):
+                break
+            # The spending graph can only be read off once few buyers are still close to a tie.
+            if np.all(linear) and (np.count_nonzero(active) <= 10 * m or smoothing >= max_smoothing):
+                solved_y, solved = _linear_equilibrium(budget_s, log_utility, y, 20 / smoothing, fixed_spending)
+                if solved is not None:
+                    y, bid_s = solved_y, solved
+                    excess = np.sum(np.abs(np.exp(y) - np.sum(bid_s, axis=0) - fixed_spending))
+                    break
+            if smoothing >= max_smoothing:
+                break
+            # Linear buyers whose best good leads by far more than 1 / smoothing spend only on it at sharper levels,
+            # so those only solve for the buyers that are close to a tie. Settled buyers are chosen again at every level.
+            if m > 1:
+                surplus = log_utility - y
+                top_two = np.partition(surplus, -2, axis=1)[:, -2:]
+                settled = linear & (top_two[:, 1] - top_two[:, 0] > FREEZE_GAP / smoothing)
+                if not np.all(settled):
+                    active = ~settled
+                    top = np.argmax(surplus[settled], axis=1)
+                    bid_s[settled] = 0
+                    bid_s[np.flatnonzero(settled), top] = budget_s[settled]
+                    frozen_spending = np.bincount(top, weights=budget_s[settled], minlength=m)
+            smoothing *= 10
+        # Linear buyers should only spend on the goods that give them the most utility per unit price.
+        surplus = log_utility[linear] - y
+        off_best = surplus < np.max(surplus, axis=1, keepdims=True) - 1e-9
+        residual = (excess + np.sum(bid_s[linear][off_best])) / total
+        bid[separable] = bid_s
+
+    price = np.sum(bid, axis=0)
+    qty = bid / price
+    individual_utility = np.empty(n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        individual_utility[separable] = np.sum((utility[separable] * qty[separable]) ** exponent[separable, None], axis=1)
+        individual_utility[cobb_douglas] = np.exp(np.sum(power * np.log(qty[cobb_douglas]), axis=1, where=power != 0))
+    return Equilibrium(price, bid, individual_utility, residual)
+
+def solve_equilibrium(budget: np.array, utility: np.array, exponent=1.0, cobb_douglas: np.array = None, tol: float = 1e-12, max_smoothing: float = 1e8):
+    """
+    Finds the Fisher market equilibrium for buyers with linear, CES or Cobb-Douglas preferences,
+    as in MixedUtilityMarket with one exponent per buyer.
+
+    Works on the dual of the Eisenberg-Gale program, whose variables are the m log prices: at prices p,
+    buyer i with CES exponent alpha spends in proportion to (u_ij / p_j) ** (alpha / (1 - alpha)), and equilibrium
+    prices minimize a smooth convex potential whose gradient is prices minus spending. Newton's method on it takes
+    O(nm^2) per step, one matrix product, and converges in a few steps.
+    Linear buyers are the limit alpha -> 1, so the potential is smoothed and then sharpened until each buyer's
+    best goods can be read off; prices and bids are then solved exactly from that spending graph and checked.
+
+    Params
+    ------
+    budget : np.array
+        1d 1xn array, or Kxn for K replicas.
+    utility : np.array
+        2d nxm array, or Kxnxm.
+    exponent : float or np.array
+        Exponent of each buyer, broadcastable to utility and constant over goods. 1 is linear.
+    cobb_douglas : np.array
+        1d 1xn boolean array of buyers with Cobb-Douglas preferences, or None.
+    tol : float
+        Tolerance for excess spending, relative to total budget.
+    max_smoothing : float
+        Largest elasticity linear buyers are approximated with, if their spending graph isn't found before it.
+        Only reached when linear and CES buyers are mixed.
+
+    Returns
+    -------
+    Equilibrium
+    """
+    budget = np.asarray(budget, dtype=float)
+    utility = np.asarray(utility, dtype=float)
+    if np.shape(budget) != utility.shape[:-1]:
+        raise ValueError("Check that budget and utility dimensions conform. Budget should be 1xn and Utility should be mxn")
+    if utility.ndim == 2:
+        return _solve(budget, utility, exponent, cobb_douglas, tol, max_smoothing)
+    exponent = np.broadcast_to(np.asarray(exponent, dtype=float), utility.shape)
+    replicas = [
+        _solve(budget[k], utility[k], exponent[k], cobb_douglas, tol, max_smoothing)
+        for k in np.ndindex(utility.shape[:-2])
+    ]
+    shape = utility.shape[:-2]
+    return Equilibrium(
+        np.stack([e.price for e in replicas]).reshape(shape + (-1,)),
+        np.stack([e.bid for e in replicas]).reshape(utility.shape),
+        np.stack([e.individual_utility for e in replicas]).reshape(budget.shape),
+        max(e.residual for e in replicas),
+    )
+
+# Equilibria already solved, by instance.
+_cache = collections.OrderedDict()
+CACHE_SIZE = 16
+
+def _get_preferences(market):
+    """
+    Returns the dense budget, utility, exponent and Cobb-Douglas buyers of a market.
+    """
+    utility = market.utility
+    if hasattr(market, "to_dense"):
+        utility = market.to_dense(utility)
+    if isinstance(market, MixedUtilityMarket):
+        return market.budget, utility, market.exponent, market.cobb_douglas
+    if isinstance(market, PropRespLinearMarket):
+        return market.budget, utility, 1.0, None
+    raise ValueError("No reference equilibrium for " + type(market).__name__ + ".")
+
+def get_equilibrium(market, tol: float = 1e-12):
+    """
+    Returns the equilibrium of a market's instance (budgets, utilities and preferences), solving it only the first
+    time it is asked for. The last CACHE_SIZE instances are kept.
+    """
+    budget, utility, exponent, cobb_douglas = _get_preferences(market)
+    key = hashlib.sha1()
+    for array in [budget, utility, exponent, cobb_douglas, tol]:
+        array = np.ascontiguousarray(array if array is not None else np.zeros(0, dtype=bool))
+        key.update(str((array.shape, array.dtype.str)).encode())
+        key.update(array.tobytes())
+    key = key.hexdigest()
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+    equilibrium = solve_equilibrium(budget, utility, exponent, cobb_douglas, tol)
+    _cache[key] = equilibrium
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return equilibrium
@@ -1,17 +1,33 @@
+import concurrent.futures
 import numpy as np
+from root.chunked_market import CHUNK_BYTES, create_market_files
+from root.sparse_market import BuyerCSR
 
 class Initializer:
     """
     Class to initialize variables for dynamics.
 
+    Random numbers come from NumPy Generators seeded from seed, never the global generator, so the same seed gives the
+    same instances. Instances are generated in chunks of chunk_size buyers, each with its own stream spawned from the
+    seed, so chunks can be generated on several threads and written straight into preallocated arrays (see the out
+    parameter of each method), e.g. shared memory or the memory-mapped files of to_files. An instance depends on
+    the seed, the sizes and chunk_size, but not on workers or where it is written.
+    Each call of an initialize method draws a new instance from the seed, as successive draws from one generator would.
+
     Attributes
     ----------
     n_goods : int
-        Number of goods in the market. 
+        Number of goods in the market.
     n_buyers : int
         Number of buyers in the market.
     seed : int
         Number for random number generation
+    chunk_size : int
+        Number of buyers generated at once. Defaults to as many as fit in CHUNK_BYTES.
+    dtype : np.dtype
+        Type of the generated arrays.
+    workers : int
+        Number of threads chunks are generated on.
 
     Methods
     -------
@@ -19,73 +35,98 @@ class Initializer:
         returns the number of goods.
     get_n_buyers():
         returns the number of buyers.
+    to_files(directory, method):
+        Generates an instance into memory-mapped files.
+
+    Every initialize method returns [budget, bids, util], 1xn budgets and nxm bids and utilities. They take
+    out=[budget, bids, util] to fill preallocated arrays instead, or sparse=True to return bids and utilities
+    as BuyerCSR, keeping only their nonzero pairs, for SparseMarket.
     """
-    def __init__(self, n_goods: int, n_buyers: int, seed: int):
+    def __init__(self, n_goods: int, n_buyers: int, seed: int = None, chunk_size: int = None, dtype=np.float64, workers: int = 1):
         if (n_goods <= 0 or n_buyers <= 0):
             raise ValueError("Must have more than 0 buyers and goods.")
+        if workers < 1:
+            raise ValueError("Must have at least 1 worker.")
         self.n_goods = n_goods
         self.n_buyers = n_buyers
         self.seed = seed
-    
-    def initialize_linear_utilities_basic(self):
-        util = np.random.rand(self.n_buyers, self.n_goods)
-        # utilities are sampled from Unif[0,1]
-        
-        # normalize utilities to 1. In line with Zhang's convergence proof
-        util_row_sums = util.sum(axis=1)
-        util = util / util_row_sums[:, np.newaxis]
-        
-        # budgets sum to 1 - again in line with zhang's convergence proof
-
-        budget = np.ones(self.n_buyers)
-
-        # bids - initialise start bid as the amount of utility they get from the good?
-        # bids - rescale utilities to sum to budget per good.
-        # multiply by 1.01 for easy fix for loss of precision for floats
-        
-        bids = (util.T/(1.01*util.sum(axis=1))).T
-
-        #bids = np.full((self.n_buyers, self.n_goods), 1/self.n_goods)
-        
-        return [budget, bids, util]
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size or max(1, CHUNK_BYTES // (n_goods * self.dtype.itemsize))
+        self.workers = workers
+        self.seed_sequence = np.random.SeedSequence(seed)
+
+    def get_n_goods(self):
+        return self.n_goods
+
+    def get_n_buyers(self):
+        return self.n_buyers
+
+    def initialize_linear_utilities_basic(self, out: list = None, sparse: bool = False):
+        """
+        Initializes utilities sampled from Unif[0,1], normalized to sum to 1 for each buyer.
+        """
+        def fill(rng, bids, util):
+            # utilities are sampled from Unif[0,1]
+            rng.random(out=util, dtype=util.dtype)
+            _normalize(bids, util)
+        return self._generate(self._next_seed(), fill, out, sparse)
 
-    def initialize_linear_utilities_discrete(self, high=2):
+    def initialize_linear_utilities_discrete(self, high=2, out: list = None, sparse: bool = False):
         """
         Initializes util weights having value 0/1 with 50% probability each. Then normalize utilities to 1.
+        Buyers who drew 0 for every good get a weight of 1 for one good picked at random.
 
         Params
         ------
         high : int
             Upper bound (exclusive) for integer utility weights. Default initializes utility weights of either 0 or 1.
-        
-        """
-        util = np.random.randint(0, high, size=(self.n_buyers, self.n_goods))
-        util_row_sums = util.sum(axis=1)
-        for i in range(len(util_row_sums)):
-            if util_row_sums[i]==0:
-                index = np.random.randint(0, len(util[i]))
-                util[i, index] = 1
-            util_row_sums[i] = 1
-        util = util / util_row_sums[:, np.newaxis]
-        
-        # budgets sum to 1 - again in line with zhang's convergence proof
-
-        budget = np.ones(self.n_buyers)
-        # Don't separate the bidding from utilities.
-        # bids - initialise start bid as the amount of utility they get from the good?
-        # bids - rescale utilities to sum to budget per good.
-        # multiply by 1.01 for easy fix for loss of precision for floats
-        bids = (util.T/(1.01*util.sum(axis=1))).T
-        return [budget, bids, util]
 
-    def initialize_low_mid_high_utilities(self, n_goods): 
+        """
+        def fill(rng, bids, util):
+            util[...] = rng.integers(0, high, size=util.shape)
+            empty = np.flatnonzero(~np.any(util, axis=1))
+            util[empty, rng.integers(0, self.n_goods, size=len(empty))] = 1
+            _normalize(bids, util)
+        return self._generate(self._next_seed(), fill, out, sparse)
+
+    def initialize_low_mid_high_utilities(self, n_groups: int = 3, levels: tuple = (1.0, 2.0, 3.0), noise: float = 0.1, out: list = None, sparse: bool = False):
         """
         Initializes utilities for certain individuals having preferences for certain goods.
         Good's preferences are randomly distributed among groups of individuals.
 
+        Each group rates each good at one of levels (low, mid or high by default), picked at random, and buyers are
+        assigned to groups at random. See initialize_structured_utilities for noise.
+        """
+        seed = self._next_seed()
+        taste = np.random.default_rng(seed.spawn(1)[0]).choice(np.asarray(levels, dtype=float), size=(n_groups, self.n_goods))
+        return self._generate(seed, _fill_grouped(taste, noise, 0.0), out, sparse)
 
-         
+    def initialize_structured_utilities(self, n_groups: int = 1, tiers: tuple = (1.0,), knockout: float = 0.0, noise: float = 0.5, out: list = None, sparse: bool = False):
         """
+        Initializes utilities with structure among buyers and goods.
+        1. Buyers are assigned to n_groups groups at random, and each group has its own taste for each good, from Unif[0,1].
+        2. Goods are assigned to tiers at random, and their utility for every buyer is scaled by their tier's value.
+        3. Each utility is knocked out (set to 0) with probability knockout, keeping at least one good per buyer.
+        A buyer's utility for a good is their group's taste times the good's tier value times noise from
+        Unif[1 - noise, 1 + noise], normalized to sum to 1 for each buyer.
+
+        Params
+        ------
+        n_groups : int
+            Number of groups of buyers.
+        tiers : tuple
+            Value of each tier of goods.
+        knockout : float
+            Probability, in [0, 1), that a buyer has no utility for a good.
+        noise : float
+            Spread of each buyer's utilities around their group's, in [0, 1].
+        """
+        if not 0 <= knockout < 1:
+            raise ValueError("knockout must be in [0, 1).")
+        seed = self._next_seed()
+        rng = np.random.default_rng(seed.spawn(1)[0])
+        taste = rng.random((n_groups, self.n_goods)) * rng.choice(np.asarray(tiers, dtype=float), size=self.n_goods)
+        return self._generate(seed, _fill_grouped(taste, noise, knockout), out, sparse)
 
     def initialize_preferred_goods_manual(self, input, noise):
         # TODO: Fix this later by adding in automatic generation
@@ -99,21 +140,112 @@ class Initializer:
         noise: float
             non-negative standard deviation of gaussian noise
         """
-        noise_array = np.random.normal(1.0, noise, size=input.shape)
+        noise_array = np.random.default_rng(self._next_seed()).normal(1.0, noise, size=input.shape)
         budget = np.ones(input.shape[0])
         util = input * noise_array
         #bids = (util.T/(1.01*util.sum(axis=1))).T
         # constant bids below
         bids = np.full(shape = input.shape, fill_value = 1 / input.shape[1])
         return [budget, bids, util]
-        
 
-    # TODO: more complicated utility initializations, like below
-    # 1. Randomly assign agents to groups, with different distributions (liking a good more or less)
-    # 2. Giving goods different values
-    # 3. Randomly knock out utilities for some of the goods.
+    def to_files(self, directory: str, method: str = "initialize_linear_utilities_basic", *args, **kwargs):
+        """
+        Generates an instance with the given initialize method into budget.npy, bid.npy and utility.npy in directory,
+        chunk by chunk, for ChunkedMarket.from_files.
 
-    
-        
+        Returns
+        -------
+        list
+            [budget, bids, util] as memory-mapped arrays.
+        """
+        out = create_market_files(directory, self.n_buyers, self.n_goods, self.dtype)
+        getattr(self, method)(*args, out=out, **kwargs)
+        for array in out:
+            array.flush()
+        return out
 
+    def _next_seed(self):
+        """
+        Returns the seed of a new instance.
+        """
+        return self.seed_sequence.spawn(1)[0]
+
+    def _get_chunks(self):
+        return [slice(start, min(start + self.chunk_size, self.n_buyers)) for start in range(0, self.n_buyers, self.chunk_size)]
 
+    def _generate(self, seed, fill, out, sparse):
+        """
+        Generates an instance chunk by chunk. fill(rng, bids, util) sets the bids and utilities of one chunk of buyers
+        in place, drawing from rng; budgets are 1.
+        """
+        if sparse and out is not None:
+            raise ValueError("Sparse instances are built as BuyerCSR and can't fill out. Pass out or sparse=True, not both.")
+        chunks = self._get_chunks()
+        # One stream per chunk, spawned after any the caller drew from seed.
+        chunk_seeds = seed.spawn(len(chunks))
+        shape = (self.n_buyers, self.n_goods)
+        if sparse:
+            budget = np.ones(self.n_buyers, dtype=self.dtype)
+        elif out is None:
+            budget, bids, util = np.ones(self.n_buyers, dtype=self.dtype), np.empty(shape, self.dtype), np.empty(shape, self.dtype)
+        else:
+            budget, bids, util = out
+            if np.shape(budget) != (self.n_buyers,) or np.shape(bids) != shape or np.shape(util) != shape:
+                raise ValueError("out should be [budget, bids, util] with shapes n, nxm and nxm.")
+            if bids.dtype != self.dtype or util.dtype != self.dtype:
+                raise ValueError("out should have the Initializer's dtype.")
+            budget[...] = 1
+
+        def fill_chunk(k):
+            chunk = chunks[k]
+            rng = np.random.default_rng(chunk_seeds[k])
+            if not sparse:
+                fill(rng, bids[chunk], util[chunk])
+                return None
+            chunk_bids = np.empty((chunk.stop - chunk.start, self.n_goods), self.dtype)
+            chunk_util = np.empty_like(chunk_bids)
+            fill(rng, chunk_bids, chunk_util)
+            rows, indices = np.nonzero((chunk_util != 0) | (chunk_bids != 0))
+            return np.bincount(rows, minlength=len(chunk_util)), indices, chunk_bids[rows, indices], chunk_util[rows, indices]
+
+        if self.workers == 1 or len(chunks) == 1:
+            results = [fill_chunk(k) for k in range(len(chunks))]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+                results = list(pool.map(fill_chunk, range(len(chunks))))
+        if not sparse:
+            return [budget, bids, util]
+        counts, indices, bid_data, util_data = (np.concatenate(x) for x in zip(*results))
+        indptr = np.zeros(self.n_buyers + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return [budget, BuyerCSR(indptr, indices, bid_data, shape), BuyerCSR(indptr, indices, util_data, shape)]
+
+def _normalize(bids: np.array, util: np.array):
+    """
+    Normalizes utilities to sum to 1 for each buyer, in line with Zhang's convergence proof,
+    and sets starting bids in proportion to them. Budgets are 1.
+    """
+    util /= np.sum(util, axis=1, keepdims=True)
+    # bids - rescale utilities to sum to budget per buyer.
+    # multiply by 1.01 for easy fix for loss of precision for floats
+    np.divide(util, 1.01, out=bids)
+
+def _fill_grouped(taste: np.array, noise: float, knockout: float):
+    """
+    Returns a fill function for Initializer._generate giving each buyer the taste of a random group,
+    times noise from Unif[1 - noise, 1 + noise], with utilities knocked out with probability knockout.
+    """
+    if not 0 <= noise <= 1:
+        raise ValueError("noise must be in [0, 1].")
+    def fill(rng, bids, util):
+        group = rng.integers(0, len(taste), size=len(util))
+        util[...] = taste[group]
+        util *= rng.uniform(1 - noise, 1 + noise, size=util.shape)
+        if knockout:
+            kept = rng.random(util.shape) >= knockout
+            # Buyers who lost every good keep one at random.
+            empty = np.flatnonzero(~np.any(kept & (util > 0), axis=1))
+            kept[empty, np.argmax(util[empty] * rng.random((len(empty), util.shape[1])), axis=1)] = True
+            util *= kept
+        _normalize(bids, util)
+    return fill
@@ -1,5 +1,17 @@
+import concurrent.futures
+import copy
+import warnings
 import numpy as np
 from abc import ABC, abstractmethod
+from root import backend as backends
+from root.active_set import ActiveSet
+
+# Steps of the update rule buyers joining a market take against its prices, to find their starting bids.
+RESPONSE_STEPS = 50
+
+# Bytes of each nxm array a shard of buyers takes by default (see Market.set_workers). Shards this small stay in
+# cache while they are updated, and large markets split into enough of them to keep every worker busy.
+SHARD_BYTES = 2 ** 22
 
 class Market:
     """
@@ -25,44 +37,92 @@ class Market:
         2d nxm array. utility[i,j] gives the u_ij used in buyer i's utility function.
     individual_utility : np.array
         1d 1xn array. individual_utility[i] gives total utility of buyer i.
+    in_place : bool
+        Whether updates overwrite the same price, quantity and scratch arrays every step (see set_in_place).
+    backend : str
+        Backend the update rule runs on (see set_backend).
+    active_set : ActiveSet
+        Pairs the update rule runs on, or None for every pair (see set_active_set).
+    workers : int
+        Number of threads updates run on (see set_workers).
+    shard_size : int
+        Number of buyers per shard of an update, or None to update every buyer at once.
+
+    All arrays may also carry leading replica axes, e.g. a Kxnxm bid and a Kxn budget,
+    in which case each replica is updated independently as its own market (see EnsembleMarket).
 
     Methods
     -------
-    step_time():
+    update():
         Increments time by one step and performs the update rule.
+    set_observer(observer):
+        Sets an observer to be told about each phase of each update.
+    set_in_place(in_place):
+        Sets whether updates reuse their arrays instead of allocating new ones.
+    set_backend(backend):
+        Sets whether update rules run as NumPy operations or as fused compiled kernels.
+    set_active_set(threshold, recheck_every):
+        Prunes vanishing bids, so that updates only run on the pairs left.
+    set_workers(workers, shard_size):
+        Shards updates over blocks of buyers, run on several threads.
+    add_buyers(budget, utility, bids), remove_buyers(buyers), add_goods(utility, bids), remove_goods(goods):
+        Changes who is in the market, keeping everyone else's bids as a warm start.
+    set_budgets(buyers, budget), set_utilities(buyers, utility, bids):
+        Changes some buyers' budgets or utilities, keeping the market's bids as a warm start.
     """
+    # Attributes that are not part of the market's state, and are not saved in checkpoints.
+    transient = ("_log_utility", "_log_utility_source", "observer", "_buffers", "_workspace", "active_set", "pool")
+    # Axis along buyers, and along goods, of each array attribute with one entry per buyer or good.
+    # Subclasses add the attributes of their update rule, which may also be scalars or broadcast along the axis.
+    buyer_axes = {"bid": -2, "utility": -2, "budget": -1, "individual_utility": -1, "_log_utility": -2}
+    goods_axes = {"bid": -1, "utility": -1, "_log_utility": -1}
+    in_place = False
+    backend = "numpy"
+    active_set = None
+    workers = 1
+    shard_size = None
+    pool = None
 
     def __init__(self, budget: np.array, start_bids: np.array, utility: np.array):
         
-        self.n_buyers, self.n_goods = utility.shape
-        if len(budget) != self.n_buyers:
+        self.n_buyers, self.n_goods = utility.shape[-2:]
+        if np.shape(budget) != utility.shape[:-1]:
             raise ValueError("Check that budget and utility dimensions conform. Budget should be 1xn and Utility should be mxn")
         if start_bids.shape != utility.shape:
             raise ValueError("Check that starting bids and utility have the same dimensions.")
         
-        if any(np.sum(start_bids, axis=1) > budget):
+        if np.any(np.sum(start_bids, axis=-1) > budget):
             raise ValueError("Starting bids of each invididual cannot be greater than their budget!")
 
         self.time = 0
         self.bid = start_bids
-        self.price = np.sum(start_bids, axis=0) # each good's price is the sum of bids
+        self.price = np.sum(start_bids, axis=-2) # each good's price is the sum of bids
         #   TODO: Throw an error if goods start off with 0 price.
         if not np.all(self.price):
             raise ZeroDivisionError("Price of good has reached 0.")
         
-        self.qty = (start_bids.T / self.price[:, None]).T
+        self.qty = start_bids / self.price[..., None, :]
         self.budget = budget
         self.utility = utility
-        self.individual_utility = np.zeros(self.n_buyers)
+        self.individual_utility = np.zeros(np.shape(budget))
+        self._log_utility = None
+        self._log_utility_source = None
+        self.observer = None
+        self._buffers = None
+        self._workspace = None
         # Assume that at time step 0, 
 
     def get_price(self):
         return self.price
 
     def get_qty(self):
+        if self.active_set is not None:
+            self.active_set.sync(self)
         return self.qty
     
     def get_bid(self):
+        if self.active_set is not None:
+            self.active_set.sync(self)
         return self.bid
 
     def get_time(self):
@@ -71,8 +131,737 @@ class Market:
     def get_individual_utility(self):
         return self.individual_utility
 
-    @abstractmethod
+    def set_observer(self, observer):
+        """
+        Sets an observer (e.g. StepObserver) to be told about each phase of each update, or None to stop.
+        """
+        self.observer = observer
+
+    def set_in_place(self, in_place: bool = True):
+        """
+        Sets whether updates run in place. Prices, quantities and the scratch arrays of the update rule are then
+        allocated once and overwritten by every later update, so steps make no new arrays of the market's size.
+        get_price() and get_qty() return arrays the next update overwrites, so copy them to keep their values.
+        Markets mixing Cobb-Douglas buyers with other buyers still copy the Cobb-Douglas rows each step.
+        """
+        self.in_place = in_place
+        self._workspace = None
+
+    def set_backend(self, backend: str = "numba"):
+        """
+        Sets the backend update rules run on. "numpy" runs them as vectorized NumPy operations, the reference.
+        "numba" runs the rules that have one (linear, CES, quasi-linear and their mixes, without Cobb-Douglas buyers)
+        as a compiled kernel per row of buyers, in parallel over buyers, computing each buyer's new bids in one pass
+        over their row instead of through temporary arrays of the market's size. Results match NumPy's to rounding.
+        Rules without a kernel, and sparse markets, keep running on NumPy.
+        If Numba isn't installed, a warning is given and the market stays on NumPy. See backend.get_backends().
+        """
+        if backend not in backends.BACKENDS:
+            raise ValueError("Unknown backend " + str(backend) + ". Choose from " + str(list(backends.BACKENDS)) + ".")
+        if backend not in backends.get_backends():
+            warnings.warn("Backend " + backend + " is not installed. Running on numpy.")
+            backend = "numpy"
+        self.backend = backend
+
+    def set_active_set(self, threshold: float = 1e-8, recheck_every: int = 100, max_density: float = 0.5):
+        """
+        Prunes bids below threshold times their buyer's budget, so that each update only runs on the pairs left,
+        in O(support) instead of O(nm), and rechecks the pruned pairs every recheck_every steps for any to bring back.
+        Supported for linear and CES markets (a single exponent, no Cobb-Douglas buyers) without replica axes.
+        Pruning changes the dynamics by at most the share of a budget held by pruned bids, see ActiveSet.
+        While more than max_density of the pairs would be kept, the market updates densely until the next recheck.
+        Pass threshold=None to put the pruned bids back and update every pair again. Turn the active set off
+        before checkpointing the market or changing its buyers and goods.
+        """
+        if threshold is not None and self.shard_size is not None:
+            raise ValueError("Sharded markets don't support active sets.")
+        if self.active_set is not None:
+            self.active_set.restore(self)
+            self.active_set = None
+        if threshold is not None:
+            self.active_set = ActiveSet(self, threshold, recheck_every, self._get_active_exponent(), max_density)
+
+    def set_workers(self, workers: int, shard_size: int = None):
+        """
+        Shards updates over blocks of shard_size buyers, updated on a pool of workers threads, so that a market with
+        many buyers (n >> m) uses several cores. Each shard sums its bids into partial prices, which are added in shard
+        order, then computes its buyers' quantities and new bids with the update rule. Shards share the market's
+        arrays and write disjoint rows, so nothing is copied between workers, and NumPy releases the GIL for the work
+        on each shard. Results depend on shard_size but never on workers: set_workers(1) runs the same shards, in
+        the same order, on this thread. shard_size defaults to as many buyers as fit in SHARD_BYTES per array,
+        whatever the number of workers. Pass workers=None to turn sharding off.
+        Updating in place (see set_in_place), each shard keeps its scratch arrays, so sharded steps make no new
+        arrays of a shard's size either.
+        """
+        if workers is not None and workers < 1:
+            raise ValueError("Must have at least 1 worker.")
+        if workers is not None and self.active_set is not None:
+            raise ValueError("Sharded markets don't support active sets. Turn the active set off first.")
+        if shard_size is not None and shard_size < 1:
+            raise ValueError("shard_size must be positive.")
+        if shard_size is None and workers is not None:
+            row_bytes = self.n_goods * self.bid.itemsize * int(np.prod(self.bid.shape[:-2]))
+            shard_size = max(1, SHARD_BYTES // row_bytes)
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        # Drops the workspaces of the old shards.
+        self._workspace = None
+        self.workers = 1 if workers is None else workers
+        self.shard_size = None if workers is None else shard_size
+
+    def _get_active_exponent(self):
+        """
+        Returns the exponent of every pair for ActiveSet, or raises an error if the update rule isn't supported.
+        """
+        raise ValueError(type(self).__name__ + " doesn't support active sets. Use a linear or CES market.")
+
+    def add_buyers(self, budget: np.array, utility: np.array, bids: np.array = None, **attributes):
+        """
+        Adds k buyers after the current ones. Other buyers keep their bids, and prices are raised by the new bids.
+        Arrays with one entry per buyer keep spare room, so adding buyers a few at a time rarely reallocates them.
+
+        Params
+        ------
+        budget : np.array
+            1d 1xk array of the new buyers' budgets.
+        utility : np.array
+            2d kxm array of their utilities.
+        bids : np.array
+            2d kxm array of their starting bids. Defaults to their response to the current prices (see _respond_to_prices).
+        **attributes
+            Values for the new buyers of update rule attributes with one entry per buyer, e.g. exponent as a kx1 array.
+        """
+        self._check_mutable()
+        budget = np.asarray(budget, dtype=float)
+        utility = np.asarray(utility)
+        if utility.shape[:-2] != self.utility.shape[:-2] or utility.shape[-1] != self.n_goods or np.shape(budget) != utility.shape[:-1]:
+            raise ValueError("Check that the new buyers' budget is 1xk and utility is kxm, with the market's replica axes.")
+        values = {"utility": utility, "budget": budget, "individual_utility": np.zeros(np.shape(budget))}
+        values.update(self._get_attribute_values(self.buyer_axes, self.n_buyers, attributes, "buyers"))
+        if bids is None:
+            bids = self._respond_to_prices(self.price, values)
+        elif bids.shape != utility.shape:
+            raise ValueError("Check that starting bids and utility have the same dimensions.")
+        elif np.any(np.sum(bids, axis=-1) > budget):
+            raise ValueError("Starting bids of each invididual cannot be greater than their budget!")
+        values["bid"] = bids
+        if self._has_log_utility():
+            with np.errstate(divide='ignore'):
+                values["_log_utility"] = np.log(utility)
+        price = self.price + np.sum(bids, axis=-2)
+        if not np.all(price):
+            raise ZeroDivisionError("Price of good " + str(np.argwhere(price == 0)[0]) + " would be 0.")
+
+        size = self.n_buyers + utility.shape[-2]
+        for name, value in values.items():
+            axis = self.buyer_axes[name]
+            buffer = self._own(name, axis, size)
+            buffer[self._index(axis, slice(self.n_buyers, size))] = value
+            setattr(self, name, buffer[self._index(axis, slice(size))])
+        if "_log_utility" in values:
+            self._log_utility_source = self.utility
+        self.n_buyers = size
+        self._set_price(price)
+
+    def remove_buyers(self, buyers):
+        """
+        Removes buyers (indices or a boolean mask), moving later buyers down. Prices are lowered by their bids.
+        """
+        self._check_mutable()
+        keep = np.ones(self.n_buyers, dtype=bool)
+        keep[buyers] = False
+        removed = np.sum(self.bid[..., ~keep, :], axis=-2)
+        price = self.price - removed
+        # Goods whose bids were (nearly) all removed are summed again exactly, so that none is left at rounding error.
+        resum = removed >= (1 - 1e-9) * self.price
+        if np.any(resum):
+            price[resum] = np.sum(self.bid[..., keep, :], axis=-2)[resum]
+        if not np.all(price):
+            raise ZeroDivisionError("Price of good " + str(np.argwhere(price == 0)[0]) + " would be 0, as only removed buyers bid on it.")
+
+        start = np.argmin(keep)
+        size = np.count_nonzero(keep)
+        has_log_utility = self._has_log_utility()
+        for name, axis in self.buyer_axes.items():
+            if name == "_log_utility" and not has_log_utility or not self._is_along(name, axis, self.n_buyers):
+                continue
+            buffer = self._own(name, axis, self.n_buyers)
+            value = getattr(self, name)
+            tail = value[self._index(axis, start + np.flatnonzero(keep[start:]))]
+            buffer[self._index(axis, slice(start, size))] = tail
+            setattr(self, name, buffer[self._index(axis, slice(size))])
+        if has_log_utility:
+            self._log_utility_source = self.utility
+        self.n_buyers = size
+        self._set_price(price)
+
+    def add_goods(self, utility: np.array, bids: np.array = None, **attributes):
+        """
+        Adds k goods after the current ones. Reallocates every nxm array, since each buyer's row grows.
+
+        Params
+        ------
+        utility : np.array
+            2d nxk array of each buyer's utility for the new goods.
+        bids : np.array
+            2d nxk array of bids on the new goods, added to each buyer's spending. Defaults to each buyer moving
+            their spending to the new goods in proportion to the share of their total utility the new goods bring.
+        **attributes
+            Values for the new goods of update rule attributes with one entry per good, e.g. exponent.
+        """
+        self._check_mutable()
+        utility = np.asarray(utility)
+        if utility.shape[:-1] != self.utility.shape[:-1]:
+            raise ValueError("Check that the new goods' utility is nxk, with the market's replica axes.")
+        bid = self.bid
+        price = self.price
+        if bids is None:
+            spending = np.sum(bid, axis=-1)
+            total = np.sum(self.utility, axis=-1) + np.sum(utility, axis=-1)
+            share = np.sum(utility, axis=-1) / total
+            bid = bid * (1 - share)[..., None]
+            price = np.sum(bid, axis=-2)
+            bids = utility * (spending / total)[..., None]
+        elif bids.shape != utility.shape:
+            raise ValueError("Check that starting bids and utility have the same dimensions.")
+        elif np.any(np.sum(bid, axis=-1) + np.sum(bids, axis=-1) > self.budget):
+            raise ValueError("Starting bids of each invididual cannot be greater than their budget!")
+        new_price = np.sum(bids, axis=-2)
+        if not np.all(new_price):
+            raise ZeroDivisionError("Price of new good " + str(np.argwhere(new_price == 0)[0]) + " would be 0.")
+
+        values = {"bid": bids, "utility": utility}
+        if self._has_log_utility():
+            with np.errstate(divide='ignore'):
+                values["_log_utility"] = np.log(utility)
+        values.update(self._get_attribute_values(self.goods_axes, self.n_goods, attributes, "goods"))
+        self.bid = bid
+        for name, value in values.items():
+            setattr(self, name, np.concatenate([getattr(self, name), np.asarray(value)], axis=self.goods_axes[name]))
+        if "_log_utility" in values:
+            self._log_utility_source = self.utility
+        self.n_goods += utility.shape[-1]
+        self._set_price(np.concatenate([price, new_price], axis=-1))
+
+    def remove_goods(self, goods):
+        """
+        Removes goods (indices or a boolean mask). Each buyer's remaining bids are scaled up to keep their spending,
+        and buyers who only bid on removed goods split it in proportion to their remaining utilities.
+        """
+        self._check_mutable()
+        keep = np.ones(self.n_goods, dtype=bool)
+        keep[goods] = False
+        bid = self.bid[..., keep]
+        utility = self.utility[..., keep]
+        spending = np.sum(self.bid, axis=-1)
+        remaining = np.sum(bid, axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bid *= np.where(remaining > 0, spending / remaining, 0)[..., None]
+        stranded = remaining == 0
+        if np.any(stranded):
+            bid[stranded] = self._spread(spending[stranded], utility[stranded])
+        price = np.sum(bid, axis=-2)
+        if not np.all(price):
+            raise ZeroDivisionError("Price of good " + str(np.argwhere(price == 0)[0]) + " would be 0.")
+
+        has_log_utility = self._has_log_utility()
+        for name, axis in self.goods_axes.items():
+            if name in ("bid", "utility") or name == "_log_utility" and not has_log_utility or not self._is_along(name, axis, self.n_goods):
+                continue
+            setattr(self, name, getattr(self, name)[self._index(axis, keep)])
+        self.bid = bid
+        self.utility = utility
+        if has_log_utility:
+            self._log_utility_source = self.utility
+        self.n_goods = np.count_nonzero(keep)
+        self._set_price(price)
+
+    def set_budgets(self, buyers, budget: np.array):
+        """
+        Changes the budgets of buyers (indices or a boolean mask). Their bids are scaled by the same factor.
+        """
+        self._check_mutable()
+        buyers = np.arange(self.n_buyers)[buyers]
+        budget = np.asarray(budget, dtype=float)
+        if np.any(budget <= 0):
+            raise ValueError("Budgets must be positive.")
+        index = self._index(-2, buyers)
+        old_bids = self.bid[index]
+        new_bids = old_bids * (budget / self.budget[..., buyers])[..., None]
+        price = self.price + np.sum(new_bids, axis=-2) - np.sum(old_bids, axis=-2)
+        self._own("bid", -2, self.n_buyers)[index] = new_bids
+        self._own("budget", -1, self.n_buyers)[..., buyers] = budget
+        self._set_price(price)
+
+    def set_utilities(self, buyers, utility: np.array, bids: np.array = None):
+        """
+        Changes the utilities of buyers (indices or a boolean mask).
+
+        Params
+        ------
+        buyers : np.array
+            Indices or boolean mask of the buyers.
+        utility : np.array
+            Their new utilities, one row per buyer.
+        bids : np.array
+            Their new bids. Defaults to their response to the prices without their current bids (see _respond_to_prices).
+        """
+        self._check_mutable()
+        buyers = np.arange(self.n_buyers)[buyers]
+        index = self._index(-2, buyers)
+        utility = np.broadcast_to(utility, self.utility[index].shape)
+        old_bids = self.bid[index]
+        if bids is None:
+            values = {"utility": utility, "budget": self.budget[..., buyers], "individual_utility": self.individual_utility[..., buyers].copy()}
+            for name in self._get_rule_attributes(self.buyer_axes, self.n_buyers):
+                values[name] = getattr(self, name)[self._index(self.buyer_axes[name], buyers)]
+            bids = self._respond_to_prices(self.price - np.sum(old_bids, axis=-2), values)
+        elif np.any(np.sum(bids, axis=-1) > self.budget[..., buyers]):
+            raise ValueError("Starting bids of each invididual cannot be greater than their budget!")
+        price = self.price + np.sum(bids, axis=-2) - np.sum(old_bids, axis=-2)
+        if not np.all(price):
+            raise ZeroDivisionError("Price of good " + str(np.argwhere(price == 0)[0]) + " would be 0.")
+        has_log_utility = self._has_log_utility()
+        self._own("utility", -2, self.n_buyers)[index] = utility
+        self._own("bid", -2, self.n_buyers)[index] = bids
+        if has_log_utility:
+            with np.errstate(divide='ignore'):
+                self._log_utility[index] = np.log(utility)
+            self._log_utility_source = self.utility
+        self._set_price(price)
+
+    def _check_mutable(self):
+        """
+        Raises an error if the market's buyers and goods can't be changed in place.
+        """
+        if self.active_set is not None:
+            raise ValueError("Turn the active set off (set_active_set(None)) before changing the market.")
+
+    def _set_price(self, price: np.array):
+        """
+        Sets prices after a change to the market, and quantities to match.
+        """
+        self.price = price
+        if np.shape(self.qty) == np.shape(self.bid):
+            np.divide(self.bid, self.price[..., None, :], out=self.qty)
+        else:
+            self._update_qty()
+
+    def _spread(self, budget: np.array, utility: np.array):
+        """
+        Returns bids splitting each budget in proportion to utility.
+        """
+        total = np.sum(utility, axis=-1)
+        self._check_sum_utility(total)
+        return utility * (budget / total)[..., None]
+
+    def _get_buyer_market(self, buyers, copy_bid: bool = True):
+        """
+        Returns a shallow copy of the market restricted to buyers (indices or a slice), on which the update rule
+        runs unchanged. Its bids are a copy unless copy_bid is false; other arrays are views where buyers is a slice.
+        A current cached log(utility) is restricted too, instead of being computed again.
+        """
+        if self.active_set is not None:
+            raise ValueError("Markets with an active set only update all buyers at once.")
+        market = copy.copy(self)
+        has_log_utility = self._has_log_utility()
+        for name, axis in self.buyer_axes.items():
+            if self._is_along(name, axis, self.n_buyers):
+                setattr(market, name, getattr(self, name)[self._index(axis, buyers)])
+        market.n_buyers = market.bid.shape[-2]
+        if copy_bid:
+            market.bid = np.array(market.bid)
+        if has_log_utility:
+            market._log_utility_source = market.utility
+        else:
+            market._log_utility = None
+            market._log_utility_source = None
+        market.observer = None
+        market._workspace = None
+        return market
+
+    def _respond_to_prices(self, price: np.array, values: dict):
+        """
+        Returns starting bids for buyers joining the market at prices price, which leave out their own bids.
+        They split their budget in proportion to utility, then take RESPONSE_STEPS steps of the update rule while
+        everyone else's bids stay fixed. This brings them close to their demand at those prices, so the market
+        starts near its new equilibrium.
+
+        Params
+        ------
+        values : dict
+            The joining buyers' utility, budget, individual_utility and other attributes with one entry per buyer.
+        """
+        market = copy.copy(self)
+        market.__dict__.update(values)
+        market.n_buyers = market.utility.shape[-2]
+        market.bid = self._spread(market.budget, market.utility)
+        market._log_utility = None
+        market._log_utility_source = None
+        market.observer = None
+        for i in range(RESPONSE_STEPS):
+            market.qty = market.bid / (price[..., None, :] + market.bid)
+            market._update_bids()
+        return market.bid
+
+    def _index(self, axis: int, index):
+        """
+        Returns a tuple indexing an array with index along axis, which counts from the end.
+        """
+        return (Ellipsis, index) + (slice(None),) * (-axis - 1)
+
+    def _is_along(self, name: str, axis: int, size: int):
+        """
+        Returns whether attribute name is an array with size entries along axis, rather than a scalar or broadcast.
+        """
+        value = getattr(self, name, None)
+        return isinstance(value, np.ndarray) and value.ndim >= -axis and value.shape[axis] == size
+
+    def _has_log_utility(self):
+        """
+        Returns whether the cached log(utility) is current, so that changes can update it instead of dropping it.
+        """
+        return self._log_utility is not None and self._log_utility_source is self.utility
+
+    def _get_rule_attributes(self, axes: dict, size: int):
+        """
+        Returns the names of the update rule's attributes (e.g. exponent) with size entries along their axis in axes.
+        """
+        return [name for name, axis in axes.items() if name not in Market.buyer_axes and self._is_along(name, axis, size)]
+
+    def _get_attribute_values(self, axes: dict, size: int, attributes: dict, kind: str):
+        """
+        Checks that attributes gives values for new buyers or goods of every update rule attribute along axes, and returns them.
+        """
+        needed = self._get_rule_attributes(axes, size)
+        if set(attributes) != set(needed):
+            raise ValueError("Give values for the new " + kind + " of exactly " + str(needed) + ".")
+        return {name: np.asarray(attributes[name], dtype=getattr(self, name).dtype) for name in needed}
+
+    def _own(self, name: str, axis: int, size: int):
+        """
+        Returns a buffer owned by the market whose start along axis holds attribute name, with room for size entries.
+        Arrays passed in by the caller are copied first, so changes never write into them.
+        Buffers are allocated with twice the room needed, so that they rarely need to grow.
+        """
+        if self._buffers is None:
+            self._buffers = {}
+        value = getattr(self, name)
+        buffer = self._buffers.get(name)
+        if buffer is None or value.base is not buffer or buffer.shape[axis] < size:
+            shape = list(value.shape)
+            shape[axis] = 2 * size
+            buffer = np.empty(shape, dtype=value.dtype)
+            buffer[self._index(axis, slice(value.shape[axis]))] = value
+            self._buffers[name] = buffer
+            setattr(self, name, buffer[self._index(axis, slice(value.shape[axis]))])
+            if name == "utility" and self._log_utility_source is value:
+                self._log_utility_source = self.utility
+        return buffer
+
+    def _get_workspace(self, name: str, shape: tuple, dtype):
+        """
+        Returns an array of the given shape and dtype to write scratch values name into.
+        Updating in place, it is kept and returned again by later steps; otherwise it is new.
+        """
+        if not self.in_place:
+            return np.empty(shape, dtype)
+        if self._workspace is None:
+            self._workspace = {}
+        array = self._workspace.get(name)
+        if array is None or array.shape != tuple(shape) or array.dtype != dtype:
+            array = np.empty(shape, dtype)
+            self._workspace[name] = array
+        return array
+
+    def _get_kernel(self, name: str):
+        """
+        Returns the backend's kernel name, or None to run the NumPy reference. Kernels take dense rows of buyers.
+        """
+        if self.backend == "numpy" or np.ndim(self.bid) < 2:
+            return None
+        return backends.get_kernel(self.backend, name)
+
+    def _respond_kernel(self, kernel, exponent, log_coefficient):
+        """
+        Like _respond_log(_log_utility_qty() * exponent + log_coefficient), fused into the separable_response kernel,
+        which runs on one replica at a time.
+
+        Returns
+        -------
+        np.array
+            1d 1xn array of the log of the sum of each buyer's response.
+        """
+        shape = self.bid.shape
+        exponent = np.broadcast_to(exponent, shape)
+        log_coefficient = np.broadcast_to(log_coefficient, shape)
+        log_utility = self._get_log_utility()
+        budget = np.broadcast_to(self.budget, shape[:-1])
+        log_total = self._get_workspace("log_total", shape[:-1], self.bid.dtype)
+        with np.errstate(divide='ignore'):
+            for index in np.ndindex(shape[:-2]):
+                kernel(self.qty[index], log_utility[index], exponent[index], log_coefficient[index], budget[index], self.bid[index], log_total[index])
+        self._check_sum_utility(np.where(log_total > -np.inf, 1, 0))
+        return log_total
+
+    def update_buyers(self, buyers):
+        """
+        Performs the update rule for some buyers only, against the current prices, and moves prices by the change in
+        their bids. Costs O(km) for k buyers, instead of O(nm) for update(), so schedules (see BuyerSchedule) can run
+        the dynamics asynchronously. Counts as one time step. Quantities are left as of the last full update, and
+        observers aren't told.
+
+        Params
+        ------
+        buyers : np.array
+            Indices of the buyers, or a slice.
+
+        Returns
+        -------
+        np.array
+            1d 1xk array. The change in each buyer's bids, sum_j |b_ij(t+1) - b_ij(t)|, relative to their budget.
+        """
+        market = self._get_buyer_market(buyers)
+        bid = market.bid.copy()
+        market.qty = bid / self.price[..., None, :]
+        market._update_bids()
+        bid -= market.bid
+        price = self.price - np.sum(bid, axis=-2)
+        if not np.all(price):
+            raise ZeroDivisionError("Price of good " + str(np.argwhere(price == 0)[0]) + " reached 0 at time " + str(self.time) + ".")
+        self.price = price
+        self.bid[self._index(-2, buyers)] = market.bid
+        self.individual_utility[..., buyers] = market.individual_utility
+        self.time += 1
+        return np.sum(np.abs(bid), axis=-1) / market.budget
+
     def update(self):
+        """
+        Performs one step of the update rule: prices and quantities from the current bids, then new bids.
+        """
+        if self.shard_size is not None:
+            return self._update_sharded()
+        observer = self.observer
+        if observer is None:
+            self._update_price()
+            self._update_qty()
+            self._update_bids()
+        else:
+            observer.on_phase(self, "start")
+            self._update_price()
+            observer.on_phase(self, "price")
+            self._update_qty()
+            observer.on_phase(self, "qty")
+            self._update_bids()
+            observer.on_phase(self, "bid")
+        self.time += 1
+        if observer is not None:
+            observer.on_step(self)
+
+    def _get_shards(self):
+        """
+        Returns slices over consecutive blocks of shard_size buyers.
+        """
+        return [slice(start, min(start + self.shard_size, self.n_buyers)) for start in range(0, self.n_buyers, self.shard_size)]
+
+    def _map_shards(self, fn):
+        """
+        Returns [fn(shard) for shard in _get_shards()], computed on the workers.
+        """
+        shards = self._get_shards()
+        if self.workers == 1 or len(shards) == 1:
+            return [fn(shard) for shard in shards]
+        if self.pool is None:
+            self.pool = concurrent.futures.ThreadPoolExecutor(self.workers)
+        return list(self.pool.map(fn, shards))
+
+    def _update_sharded(self):
+        """
+        Performs one step of the update rule shard by shard (see set_workers): prices in one pass over the shards,
+        then quantities and new bids in a second. Quantities are computed with the bids, so observers see their time
+        as part of "bid".
+        """
+        observer = self.observer
+        if observer is not None:
+            observer.on_phase(self, "start")
+        self._update_price()
+        if observer is not None:
+            observer.on_phase(self, "price")
+            observer.on_phase(self, "qty")
+        if self.in_place and self._workspace is None:
+            self._workspace = {}
+        qty = self._get_shard_qty()
+        used_log_utility = self._map_shards(lambda shard: self._update_shard_bids(shard, qty))
+        self.qty = qty
+        if any(used_log_utility) and not self._has_log_utility():
+            # Later steps give each shard its rows of the cached log(utility), instead of each shard computing them.
+            self._cache_log_utility()
+        if observer is not None:
+            observer.on_phase(self, "bid")
+        self.time += 1
+        if observer is not None:
+            observer.on_step(self)
+
+    def _get_shard_qty(self):
+        """
+        Returns the array shards write their quantities into.
+        """
+        return self._get_workspace("qty", self.bid.shape, np.result_type(self.bid, self.price))
+
+    def _cache_log_utility(self):
+        self._get_log_utility()
+
+    def _get_shard_workspace(self, shard: slice):
+        """
+        Returns the workspace of the market updating shard when updating in place, or None. Each shard keeps its own,
+        so together they take as much memory as the unsharded market's.
+        """
+        if not self.in_place:
+            return None
+        return self._workspace.setdefault(("shard", shard.start), {})
+
+    def _update_shard_bids(self, shard: slice, qty: np.array):
+        """
+        Sets quantities and new bids of the buyers in shard with the update rule, run on a market of their own.
+        Its individual_utility is a view, so the rule writes through to this market's.
+
+        Returns
+        -------
+        bool
+            Whether the update rule used log(utility).
+        """
+        index = self._index(-2, shard)
+        # Shards are slices, so their bids and quantities are views, written in place by the update rule or below.
+        market = self._get_buyer_market(shard, copy_bid=False)
+        market.shard_size = None
+        market.pool = None
+        market._workspace = self._get_shard_workspace(shard)
+        bid = market.bid
+        market.qty = np.divide(bid, self.price[..., None, :], out=qty[index])
+        market._update_bids()
+        if market.bid is not bid:
+            bid[...] = market.bid
+        return market._log_utility is not None
+
+    def _update_price(self):
+        """
+        Sets each good's price to the sum of its bids. Sharded markets add up each shard's sum, in shard order.
+        """
+        if self.active_set is not None and self.active_set.update_price(self):
+            return
+        if self.shard_size is not None:
+            self.price = self._get_workspace("price", self.bid.shape[:-2] + self.bid.shape[-1:], self.bid.dtype)
+            self.price[...] = 0
+            for partial_price in self._map_shards(lambda shard: np.sum(self.bid[self._index(-2, shard)], axis=-2)):
+                self.price += partial_price
+        else:
+            price = self._get_workspace("price", self.bid.shape[:-2] + self.bid.shape[-1:], self.bid.dtype)
+            self.price = np.sum(self.bid, axis=-2, out=price) # calculate new prices
+        if not np.all(self.price):
+            raise ZeroDivisionError("Price of good " + str(np.argwhere(self.price == 0)[0]) + " reached 0 at time " + str(self.time) + ".") 
+
+    def _update_qty(self):
+        """
+        Sets each buyer's quantity of each good to their share of its price.
+        """
+        if self.active_set is not None and not self.active_set.dense:
+            return self.active_set.update_qty(self)
+        qty = self._get_workspace("qty", self.bid.shape, np.result_type(self.bid, self.price))
+        self.qty = np.divide(self.bid, self.price[..., None, :], out=qty) # calculate new quantities
+
+    def _buyer_sum(self, x: np.array):
+        """
+        Sums an nxm array over goods, giving a 1xn array with one entry per buyer.
+        """
+        return np.sum(x, axis=-1)
+
+    def _buyer_max(self, x: np.array):
+        """
+        Takes the max of an nxm array over goods, giving a 1xn array with one entry per buyer.
+        """
+        return np.max(x, axis=-1)
+
+    def _per_buyer(self, x: np.array):
+        """
+        Broadcasts a 1xn array with one entry per buyer against nxm arrays.
+        """
+        return x[..., None]
+
+    def _get_log_utility(self):
+        """
+        Returns log(utility), computed again only when utility is replaced.
+        """
+        if self._log_utility_source is not self.utility:
+            with np.errstate(divide='ignore'):
+                # Chunks recompute theirs every step, so in place they reuse a workspace.
+                self._log_utility = np.log(self.utility, out=self._get_workspace("log_utility", np.shape(self.utility), np.result_type(self.utility, 1.0)))
+            self._log_utility_source = self.utility
+        return self._log_utility
+
+    def _log_utility_qty(self):
+        """
+        Returns log(utility * qty), computed as a sum of logs so that small products don't underflow.
+        """
+        with np.errstate(divide='ignore'):
+            log_utility_qty = np.log(self.qty, out=self._get_workspace("log_response", self.qty.shape, self.qty.dtype))
+        log_utility_qty += self._get_log_utility()
+        return log_utility_qty
+
+    def _check_sum_utility(self, sum_utility: np.array):
+        """
+        Raises an error for the first buyer whose bundle gives them no utility.
+        """
+        no_utility = np.argwhere(sum_utility == 0)
+        if no_utility.size:
+            replica = " in replica " + str(no_utility[0, :-1]) if sum_utility.ndim > 1 else ""
+            raise ValueError("Individual " + str(no_utility[0, -1]) + replica + " receives no utility from their bundle. The initial bids were inconsistent with their utilities. Check that individual gets positive utility from their initial bids.")
+
+    def _respond(self, response: np.array):
+        """
+        Updates bids in place so that each buyer splits their budget in proportion to their response to each good.
+
+        Params
+        ------
+        response : np.array
+            nxm array. response[i,j] gives the share of buyer i's utility attributed to good j.
+
+        Returns
+        -------
+        np.array
+            1d 1xn array of the sum of each buyer's response.
+        """
+        sum_utility = self._buyer_sum(response)
+        self._check_sum_utility(sum_utility)
+        np.multiply(self._per_buyer(self.budget), response, out=self.bid, casting='unsafe')
+        np.divide(self.bid, self._per_buyer(sum_utility), out=self.bid, casting='unsafe')
+        return sum_utility
+
+    def _respond_log(self, log_response: np.array):
+        """
+        Like _respond, but takes log responses and normalizes them per buyer with log-sum-exp.
+        Responses too small to represent, e.g. (utility * qty) ** alpha for tiny quantities, don't underflow to 0.
+        Works in place, overwriting log_response, so it costs no more than computing the responses directly.
+
+        Returns
+        -------
+        np.array
+            1d 1xn array of the log of the sum of each buyer's response.
+        """
+        log_max = self._buyer_max(log_response)
+        # A buyer whose largest response is log(0) gets no utility.
+        self._check_sum_utility(np.where(log_max > -np.inf, 1, 0))
+        log_response -= self._per_buyer(log_max)
+        response = np.exp(log_response, out=log_response)
+        sum_response = self._buyer_sum(response)
+        np.multiply(response, self._per_buyer(self.budget / sum_response), out=self.bid, casting='unsafe')
+        return log_max + np.log(sum_response)
+
+    @abstractmethod
+    def _update_bids(self):
+        """
+        Sets new bids from the current prices and quantities, according to the market's update rule.
+        """
         pass
 
 class PropRespLinearMarket(Market):
@@ -82,28 +871,110 @@ class PropRespLinearMarket(Market):
     def __init__(self, budget: np.array, start_bids: np.array, utility: np.array):
         super().__init__(budget, start_bids, utility)
 
-    def update(self):
-        self.price = np.sum(self.bid, axis=0) # calculate new prices
-        if not np.all(self.price):
-            raise ZeroDivisionError("Price of good " + str(np.argwhere(self.price == 0)[0]) + " reached 0 at time " + str(self.time) + ".") 
-        self.qty = (self.bid.T / self.price[:, None]).T # calculate new quantities
-        
-        # Update bids. Using for loop for now
-        # Problem: Each time step is very slow!! how to fix?
-        for i in range(self.n_buyers):
-            # vectorised sum
-            sum_utility = np.inner(self.utility[i], self.qty[i])
-
-            self.individual_utility[i] = sum_utility
-            if sum_utility == 0:
-                    raise ValueError("Individual " + str(i) + " receives no utility from their bundle. The initial bids were inconsistent with their utilities. Check that individual gets positive utility from their initial bids.")
-                   
-            for j in range(self.n_goods):
-                self.bid[i, j] = self.budget[i] * self.utility[i, j] * self.qty[i, j] / sum_utility
-        
-        self.time += 1
+    def _get_active_exponent(self):
+        return 1.0
+
+    def _update_bids(self):
+        if self.active_set is not None and not self.active_set.dense:
+            return self.active_set.update_bids(self)
+        kernel = self._get_kernel("linear_response")
+        if kernel is not None:
+            budget = np.broadcast_to(self.budget, self.bid.shape[:-1])
+            for index in np.ndindex(self.bid.shape[:-2]):
+                kernel(self.qty[index], self.utility[index], budget[index], self.bid[index], self.individual_utility[index])
+            self._check_sum_utility(self.individual_utility)
+            return
+        # Update bids for all buyers at once
+        response = np.multiply(self.utility, self.qty, out=self._get_workspace("response", self.qty.shape, np.result_type(self.utility, self.qty)))
+        self.individual_utility[:] = self._respond(response)
+
+class MixedUtilityMarket(Market):
+    """
+    Class to represent a market where buyers and goods can each have their own form of utility, using proportionate response dynamics.
+    Buyer i either has separable preferences u_i = sum_j (u_ijx_ij)^exponent[i,j], where an exponent of 1 makes good j linear
+    for buyer i and an exponent in (0,1) makes it CES (Zhang's dynamic), or Cobb-Douglas preferences u_i = prod_j x_ij^u_ij
+    if cobb_douglas[i] is true.
+    Every buyer is updated in the same vectorized step, so any mix of these needs no special-case subclass.
+
+    Attributes
+    ----------
+    exponent : float or np.array
+        Exponent of each (i, j) pair. Either a scalar, or broadcastable to utility, e.g. 1xm for one exponent per good
+        or nx1 for one per buyer. Sparse markets only support scalars.
+    cobb_douglas : np.array
+        1d 1xn boolean array, or None if no buyer has Cobb-Douglas preferences. For these buyers utility[i,j] is the
+        power of good j, and exponent is ignored.
+    Other attributes are as in Market. individual_utility[i] is u_i as defined above.
+    """
+    buyer_axes = dict(Market.buyer_axes, exponent=-2, cobb_douglas=-1)
+    goods_axes = dict(Market.goods_axes, exponent=-1)
+    def __init__(self, budget: np.array, start_bids: np.array, utility: np.array, exponent=1.0, cobb_douglas: np.array = None):
+        super().__init__(budget, start_bids, utility)
+        self.exponent = exponent
+        if cobb_douglas is not None:
+            cobb_douglas = np.asarray(cobb_douglas, dtype=bool)
+            if cobb_douglas.shape != (self.n_buyers,):
+                raise ValueError("Check that cobb_douglas has one entry per buyer.")
+        self.cobb_douglas = cobb_douglas
+
+    def _get_active_exponent(self):
+        if self.cobb_douglas is not None and np.any(self.cobb_douglas):
+            raise ValueError("Active sets don't support Cobb-Douglas buyers.")
+        if np.ndim(self.exponent) != 0:
+            raise ValueError("Active sets need a single exponent for every pair.")
+        return self.exponent
+
+    def _update_bids(self):
+        if self.active_set is not None and not self.active_set.dense:
+            return self.active_set.update_bids(self)
+        n_cd = 0 if self.cobb_douglas is None else np.count_nonzero(self.cobb_douglas)
+        kernel = self._get_kernel("separable_response")
+        if kernel is not None and n_cd == 0:
+            self.individual_utility[:] = np.exp(self._respond_kernel(kernel, self.exponent, 0.0))
+            return
+        if n_cd == self.n_buyers:
+            # Slicing instead of indexing avoids copies when every buyer is Cobb-Douglas.
+            cd = slice(None)
+            log_response = self._get_workspace("log_response", self.qty.shape, self.qty.dtype)
+            log_cd_utility = self._cobb_douglas_log_response(cd, log_response)
+        else:
+            log_response = self._log_utility_qty()
+            log_response *= self.exponent
+            if n_cd:
+                cd = np.flatnonzero(self.cobb_douglas)
+                log_cd_response = np.empty_like(log_response[..., cd, :])
+                log_cd_utility = self._cobb_douglas_log_response(cd, log_cd_response)
+                log_response[..., cd, :] = log_cd_response
+        log_utility = self._respond_log(log_response)
+        if n_cd:
+            log_utility[..., cd] = log_cd_utility
+        self.individual_utility[:] = np.exp(log_utility)
+
+    def _cobb_douglas_log_response(self, cd, log_response: np.array):
+        """
+        Returns the log utility of the Cobb-Douglas buyers cd, an index array or slice, and writes their log responses
+        into log_response.
+        """
+        # COBB DOUGLAS RESOLVES IN ONE STEP.
+        # Work in the log domain so that utilities of many goods don't underflow.
+        # Goods with 0 power contribute nothing, even at 0 quantity.
+        power = self.utility[..., cd, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.log(self.qty[..., cd, :], out=log_response)
+            log_response *= power
+        # Quantities are at most 1, so every term is at most 0, except 0 * log(0), which is nan and should be 0.
+        np.fmin(log_response, 0, out=log_response)
+        log_utility = np.sum(log_response, axis=-1)
 
-class GeneralPropRespCDMarket(Market):
+        # qty[i,j] * gradient[i,j] = individual_utility[i] * utility[i,j] for goods with positive quantity.
+        # individual_utility[i] cancels when normalizing bids, so leave it out and respond with utility[i,j] directly.
+        # Buyers with 0 quantity of a good they need get no utility (log utility of -inf), and respond -inf to every good;
+        # goods they have 0 quantity of but don't need already respond log(0).
+        log_response[...] = self._get_log_utility()[..., cd, :]
+        log_response[log_utility == -np.inf] = -np.inf
+        return log_utility
+
+class GeneralPropRespCDMarket(MixedUtilityMarket):
     """
     Class to represent a market with Cobb-Douglas Preferences, using general proportionate response dynamics.
     In the CD Market, utility[i,j] is interpreted as the power of good j in buyer i's utility function.
@@ -112,39 +983,9 @@ class GeneralPropRespCDMarket(Market):
     Should converge at the same linear rate, as linear utilities.
     """
     def __init__(self, budget: np.array, start_bids: np.array, utility: np.array):
-        super().__init__(budget, start_bids, utility)
-
-    def update(self):
-        # COBB DOUGLAS RESOLVES IN ONE STEP.
-        self.price = np.sum(self.bid, axis=0) # calculate new prices
-        if not np.all(self.price):
-            raise ZeroDivisionError("Price of good " + str(np.argwhere(self.price == 0)[0]) + " reached 0 at time " + str(self.time) + ".") 
-        self.qty = (self.bid.T / self.price[:, None]).T # calculate new quantities
-        
-        # Update bids. Using for loop for now
-
-
-        for i in range(self.n_buyers):
-            # Calculate gradient vector for individual
-            gradient = np.zeros(self.n_goods) 
-            for j in range(self.n_goods):
-                # feature of cobb douglas! 
-                if self.qty[i,j]==0:
-                    gradient[j] = 0
-                else:
-                    #gradient[j] = self.utility[i, j]
-                    gradient[j] = np.prod(np.power(self.qty[i], self.utility[i]))*  self.qty[i,j]** -1 * (self.utility[i,j])
-
-            sum_utility = np.inner(self.qty[i], gradient) 
-            if sum_utility == 0:
-                    raise ValueError("Individual " + str(i) + " receives no utility from their bundle. The initial bids were inconsistent with their utilities. Check that individual gets positive utility from their initial bids.")
-
-            for j in range(self.n_goods):
-                self.bid[i, j] = self.budget[i] * self.qty[i, j] * gradient[j]/ sum_utility
-        
-        self.time += 1 
+        super().__init__(budget, start_bids, utility, cobb_douglas=np.ones(utility.shape[-2], dtype=bool))
     
-class GeneralPropRespQLMarketU(Market):
+class GeneralPropRespQLMarketU(MixedUtilityMarket):
     """
     Class to represent a market with Quasi-Linear Preferences, using general proportionate response dynamics.
     Preferences are of the form u_i = u_i0x_i0 + \sum_{j\ge 1}(u_ijx_ij)^\alpha
@@ -152,33 +993,10 @@ class GeneralPropRespQLMarketU(Market):
     Should converge at the same linear rate, as linear utilities.
     """
     def __init__(self, budget: np.array, start_bids: np.array, utility: np.array, alpha: float):
-        super().__init__(budget, start_bids, utility)
+        # Good 0 is linear, the rest are raised to alpha.
+        super().__init__(budget, start_bids, utility, np.where(np.arange(utility.shape[-1]) == 0, 1.0, alpha))
         self.alpha = alpha;
 
-    def update(self):
-     
-        self.price = np.sum(self.bid, axis=0) # calculate new prices
-        if not np.all(self.price):
-            raise ZeroDivisionError("Price of good " + str(np.argwhere(self.price == 0)[0]) + " reached 0 at time " + str(self.time) + ".") 
-        self.qty = (self.bid.T / self.price[:, None]).T # calculate new quantities
-        
-        # Update bids. Using for loop for now
-        
-        for i in range(self.n_buyers):
-            sum_utility = 0
-            sum_utility += self.utility[i,0] * self.qty[i,0]
-            for j in range(1, self.n_goods):
-                    sum_utility += (self.utility[i, j] * self.qty[i,j]) ** self.alpha
-            if sum_utility == 0:
-                    raise ValueError("Individual " + str(i) + " receives no utility from their bundle. The initial bids were inconsistent with their utilities. Check that individual gets positive utility from their initial bids.")
-
-            self.bid[i, 0] = self.budget[i] * self.qty[i, 0] * self.utility[i,0] / sum_utility
-
-            for j in range(1, self.n_goods):
-                self.bid[i, j] = (self.budget[i] * (self.qty[i, j] * self.utility[i,j]) ** self.alpha) / sum_utility
-        
-        self.time += 1
-
 class GeneralPropRespQLMarketPD(Market):
     """
     Class to represent a market with Quasi-Linear Preferences, using general proportionate response dynamics.
@@ -190,98 +1008,41 @@ class GeneralPropRespQLMarketPD(Market):
         super().__init__(budget, start_bids, utility)
         self.alpha = alpha;
 
-    def update(self):
+    def _update_bids(self):
         # Gradient method resolves in one step as well ..
-        self.price = np.sum(self.bid, axis=0) # calculate new prices
-        if not np.all(self.price):
-            raise ZeroDivisionError("Price of good " + str(np.argwhere(self.price == 0)[0]) + " reached 0 at time " + str(self.time) + ".") 
-        self.qty = (self.bid.T / self.price[:, None]).T # calculate new quantities
-        
-        # Update bids. Using for loop for now
-        
-        for i in range(self.n_buyers):
-            # Calculate gradient vector for individual
-            gradient = np.zeros(self.n_goods) 
-            gradient[0] = self.utility[i, 0] # gradient for the first good is always constant
-            # TODO: Try setting all values to 1 as well
-            for j in range(1, self.n_goods):
-                if self.qty[i,j]==0:
-                    gradient[j] = 0
-                else:
-                    #gradient[j] = self.utility[i, j]
-                    gradient[j] = self.alpha * (self.utility[i,j]) ** self.alpha * self.qty[i,j] ** (self.alpha-1)
-            sum_utility = np.inner(self.qty[i], gradient) 
-            if sum_utility == 0:
-                    raise ValueError("Individual " + str(i) + " receives no utility from their bundle. The initial bids were inconsistent with their utilities. Check that individual gets positive utility from their initial bids.")
-
-            for j in range(self.n_goods):
-                self.bid[i, j] = self.budget[i] * self.qty[i, j] * gradient[j]/ sum_utility
-        
-        self.time += 1 
+        # qty * gradient is alpha * (utility * qty) ** alpha, or utility * qty for the first good,
+        # whose gradient is always constant. Goods with 0 quantity have 0 gradient (log of -inf).
+        # TODO: Try setting all values to 1 as well
+        kernel = self._get_kernel("separable_response")
+        if kernel is not None:
+            linear = np.arange(self.n_goods) == 0
+            self._respond_kernel(kernel, np.where(linear, 1.0, self.alpha), np.where(linear, 0.0, np.log(self.alpha)))
+            return
+        log_response = self._log_utility_qty()
+        log_response[..., 1:] *= self.alpha
+        log_response[..., 1:] += np.log(self.alpha)
+        self._respond_log(log_response)
 
-class PropRespZhangMarket(Market):
+class PropRespZhangMarket(MixedUtilityMarket):
     """
     Class to represent a market with Zhang's CES preferences, using the proportional response dynamic detailed in his paper.
 
     """
     def __init__(self, budget: np.array, start_bids: np.array, utility: np.array, alpha: float):
-        super().__init__(budget, start_bids, utility)
+        super().__init__(budget, start_bids, utility, alpha)
         self.alpha = alpha;
 
-    def update(self):
-        self.price = np.sum(self.bid, axis=0) # calculate new prices
-        if not np.all(self.price):
-            raise ZeroDivisionError("Price of good " + str(np.argwhere(self.price == 0)[0]) + " reached 0 at time " + str(self.time) + ".") 
-        self.qty = (self.bid.T / self.price[:, None]).T # calculate new quantities
-
-        for i in range(self.n_buyers):
-            # Calculate gradient vector for individua
-            sum_utility = 0
-            for j in range(self.n_goods):
-                    sum_utility += (self.utility[i, j] * self.qty[i,j]) ** self.alpha
-            if sum_utility == 0:
-                    raise ValueError("Individual " + str(i) + " receives no utility from their bundle. The initial bids were inconsistent with their utilities. Check that individual gets positive utility from their initial bids.")
-
-            for j in range(self.n_goods):
-                self.bid[i, j] = (self.budget[i] * (self.qty[i, j] * self.utility[i,j]) ** self.alpha) / sum_utility
-        
-        self.time += 1
-
-class PropRespZhangMarketSingleLinearBuyer(Market):
+class PropRespZhangMarketSingleLinearBuyer(MixedUtilityMarket):
     """
     Class to represent a market with Zhang's CES preferences, with a single buyer having linear preferences, using the proportional response dynamic detailed in his paper.
 
     """
     def __init__(self, budget: np.array, start_bids: np.array, utility: np.array, alpha: float):
-        super().__init__(budget, start_bids, utility)
+        # Buyer 0 is linear, the rest are raised to alpha.
+        super().__init__(budget, start_bids, utility, np.where(np.arange(utility.shape[-2])[:, None] == 0, 1.0, alpha))
         self.alpha = alpha;
 
-    def update(self):
-        self.price = np.sum(self.bid, axis=0) # calculate new prices
-        if not np.all(self.price):
-            raise ZeroDivisionError("Price of good " + str(np.argwhere(self.price == 0)[0]) + " reached 0 at time " + str(self.time) + ".") 
-        self.qty = (self.bid.T / self.price[:, None]).T # calculate new quantities
-
-        for i in range(self.n_buyers):
-            # Calculate gradient vector for individua
-            sum_utility = 0
-            for j in range(self.n_goods):
-                    if i==0:
-                         sum_utility += (self.utility[i, j] * self.qty[i,j])
-                    else:
-                         sum_utility += (self.utility[i, j] * self.qty[i,j]) ** self.alpha
-            if sum_utility == 0:
-                    raise ValueError("Individual " + str(i) + " receives no utility from their bundle. The initial bids were inconsistent with their utilities. Check that individual gets positive utility from their initial bids.")
-
-            for j in range(self.n_goods):
-                if i==0:
-                    self.bid[i, j] = (self.budget[i] * (self.qty[i, j] * self.utility[i,j]) ) / sum_utility 
-                else:
-                    self.bid[i, j] = (self.budget[i] * (self.qty[i, j] * self.utility[i,j]) ** self.alpha) / sum_utility
-        
-        self.time += 1
-
-class PropRespQLGroupedMarket(Market):
+class PropRespQLGroupedMarket(MixedUtilityMarket):
     """
     Class to represent a market with Quasi-Linear Preferences, using general proportionate response dynamics.
     We have groups A and B goods; A are linear, B are not.
@@ -290,39 +1051,11 @@ class PropRespQLGroupedMarket(Market):
     Should converge at the same linear rate, as linear utilities.
     """
     def __init__(self, budget: np.array, start_bids: np.array, utility: np.array, alpha: float, n_linear):
-        super().__init__(budget, start_bids, utility)
+        # The first n_linear goods are linear, the rest are raised to alpha.
+        super().__init__(budget, start_bids, utility, np.where(np.arange(utility.shape[-1]) < n_linear, 1.0, alpha))
         self.alpha = alpha;
         self.n_linear = n_linear # the first n_linear goods will be linear.
 
-    def update(self):
-        # Gradient method resolves in one step as well ..
-        self.price = np.sum(self.bid, axis=0) # calculate new prices
-        if not np.all(self.price):
-            raise ZeroDivisionError("Price of good " + str(np.argwhere(self.price == 0)[0]) + " reached 0 at time " + str(self.time) + ".") 
-        self.qty = (self.bid.T / self.price[:, None]).T # calculate new quantities
-        
-        # Update bids. Using for loop for now
-        
-        for i in range(self.n_buyers):
-            # Calculate gradient vector for individual
-            sum_utility = 0
-            for j in range(self.n_goods):
-                if j < self.n_linear:
-                    sum_utility += (self.utility[i, j] * self.qty[i,j])
-                else:   
-                    sum_utility += (self.utility[i, j] * self.qty[i,j]) ** self.alpha
-            if sum_utility == 0:
-                    raise ValueError("Individual " + str(i) + " receives no utility from their bundle. The initial bids were inconsistent with their utilities. Check that individual gets positive utility from their initial bids.")
-
-            for j in range(self.n_goods):
-                if j<self.n_linear:
-                    self.bid[i, j] = self.budget[i] * (self.qty[i, j] * self.utility[i,j]) / sum_utility
-                else:
-                    self.bid[i, j] = (self.budget[i] * (self.qty[i, j] * self.utility[i,j]) ** self.alpha) / sum_utility
-        
-        self.time += 1 
-
-
 
 # TODO: Add in functions below 
 # - quasilinear
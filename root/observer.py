@@ -0,0 +1,96 @@
+import time
+import numpy as np
+
+class StepObserver:
+    """
+    Class to instrument a market's updates: time spent in each phase, counters and online metrics.
+    Attach with Market.set_observer, or pass to Simulation to also time history recording.
+    Markets without an observer only pay for a check that it is None.
+
+    Phases are "price" (summing bids into prices), "qty" (computing quantities), "bid" (the update rule),
+    "record" (Simulation copying history) and "observer" (the observer's own counters and metrics).
+    Per step, counters cost O(m); the smallest bid needs a pass over all n*m bids, so it is only taken every
+    bid_every steps, like metrics.
+
+    Attributes
+    ----------
+    phase_times : dict
+        phase_times[phase] gives total seconds spent in phase.
+    steps : int
+        Number of updates observed.
+    near_zero_prices : int
+        Number of updates where some price fell below near_zero times the mean price.
+    bid_every : int
+        Number of updates between checks of the smallest bid, 0 to never check it.
+    min_bid : float
+        Smallest positive bid seen after any checked update.
+    metrics : dict
+        metrics[name] gives a list of (time, value) pairs of metric name.
+
+    Methods
+    -------
+    add_metric(name, fn, every):
+        Computes fn(market) every every steps.
+    get_report():
+        returns phase times, counters and the latest metrics as a dict.
+    """
+    def __init__(self, near_zero: float = 1e-8, bid_every: int = 10):
+        if bid_every < 0:
+            raise ValueError("bid_every must be nonnegative.")
+        self.near_zero = near_zero
+        self.bid_every = bid_every
+        self.phase_times = {"price": 0.0, "qty": 0.0, "bid": 0.0, "record": 0.0, "observer": 0.0}
+        self.steps = 0
+        self.near_zero_prices = 0
+        self.min_bid = np.inf
+        self.metrics = {}
+        self.metric_fns = {}
+        self.last = time.perf_counter()
+
+    def add_metric(self, name: str, fn, every: int = 1):
+        """
+        Computes fn(market) after every every-th update, and keeps the values in metrics[name].
+        """
+        self.metric_fns[name] = (fn, every)
+        self.metrics[name] = []
+
+    def on_phase(self, market, phase: str):
+        """
+        Called when phase has just finished, or with phase "start" when an update or recording starts.
+        """
+        now = time.perf_counter()
+        if phase != "start":
+            self.phase_times[phase] += now - self.last
+        self.last = now
+
+    def on_step(self, market):
+        """
+        Called after each update, once the market's time has been incremented.
+        """
+        start = time.perf_counter()
+        self.steps += 1
+        price = market.get_price()
+        if np.min(price) < self.near_zero * np.mean(price):
+            self.near_zero_prices += 1
+        if self.bid_every and market.get_time() % self.bid_every == 0:
+            bid = market.get_bid()
+            self.min_bid = min(self.min_bid, float(np.min(bid, where=bid > 0, initial=np.inf)))
+        for name, (fn, every) in self.metric_fns.items():
+            if market.get_time() % every == 0:
+                self.metrics[name].append((market.get_time(), fn(market)))
+        self.last = time.perf_counter()
+        self.phase_times["observer"] += self.last - start
+
+    def get_report(self):
+        report = {
+            "steps": self.steps,
+            "near_zero_prices": self.near_zero_prices,
+            "min_bid": self.min_bid,
+        }
+        for phase, seconds in self.phase_times.items():
+            report[phase + "_seconds"] = seconds
+            report[phase + "_seconds_per_step"] = seconds / self.steps if self.steps else 0.0
+        for name, values in self.metrics.items():
+            if values:
+                report[name] = values[-1][1]
+        return report
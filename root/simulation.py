@@ -1,48 +1,419 @@
-from market import Market
+from root.market import Market
+from root.trajectory import TrajectoryWriter
+from root.checkpoint import Checkpointer, append_records, get_market_state, load_records, load_state, save_state, set_market_state
+from root.equilibrium import Equilibrium, get_equilibrium
+from root.analytics import TrajectoryAnalytics
+from root.cache import ResultCache
+import numpy as np
+import os
 import warnings
 
+# Most bytes of history rows a buffer grows by beyond the records it needs.
+GROWTH_BYTES = 2 ** 26
+
 class Simulation:
     """
     Class to simulate dynamics.
     Contains a market.
     Keeps track of variables at each time.
     Also has a method to run t time steps.
+
+    History is kept in preallocated arrays holding copies of the market's state, so later updates
+    don't change earlier records. Each variable is recorded every stride steps.
+    If a TrajectoryWriter is given, history is streamed to disk instead and read back with TrajectoryReader.
+    If a reference Equilibrium is given, the errors "price_error" and "utility_error" can be recorded too.
+    If a TrajectoryAnalytics is given, its metrics are summarized online after each step, without any history.
     
     Attributes
     ----------
     market : Market
         Market being simulated
-    prices : list
-        prices[t] gives price np.array at time t
-    qtys : list
-        qtys[t] gives qty np.array at time t
-    bids: list
-        bids[t] gives bid np.array at time t
-    utilities: list
-        utilities[t] gives individual utility np.array at time t
+    strides : dict
+        strides[name] gives how many steps apart variable name ("price", "qty", "bid", "utility", and with an equilibrium
+        "price_error", "utility_error") is recorded. Variables with stride 0 are not recorded.
+    dtype : np.dtype
+        dtype history is stored in, e.g. np.float32 to halve memory. Defaults to the market's dtype.
+    writer : TrajectoryWriter
+        Writer that recorded states are streamed to, or None to keep history in memory.
+    observer : StepObserver
+        Observer of the market's updates and of history recording, or None.
+    equilibrium : Equilibrium
+        Reference equilibrium of the market, e.g. get_equilibrium(market), or None.
+        price_error is the largest relative error of a price, and utility_error of a buyer's utility.
+    analytics : TrajectoryAnalytics
+        Running summaries of metrics of the trajectory, or None.
+    prices : np.array
+        prices[k] gives price np.array at time get_times("price")[k]
+    qtys : np.array
+        qtys[k] gives qty np.array at time get_times("qty")[k]
+    bids: np.array
+        bids[k] gives bid np.array at time get_times("bid")[k]
+    utilities: np.array
+        utilities[k] gives individual utility np.array at time get_times("utility")[k]
     
     """
-    def __init__(self, market: Market):
+    getters = {"price": "get_price", "qty": "get_qty", "bid": "get_bid", "utility": "get_individual_utility"}
+    # name: (Equilibrium method, market getter it compares)
+    errors = {"price_error": ("get_price_error", "get_price"), "utility_error": ("get_utility_error", "get_individual_utility")}
+
+    def __init__(self, market: Market, strides: dict = None, dtype=None, writer: TrajectoryWriter = None, observer=None, equilibrium: Equilibrium = None, analytics: TrajectoryAnalytics = None):
         if (market.get_time() != 0):
             warnings.warn("Warning: Market does not have time 0 at start of simulation")
 
         self.market = market
-        self.prices = []
-        self.qtys = []
-        self.bids = []
-        self.utilities = []
-        self.prices.append(market.get_price())
-        self.qtys.append(market.get_qty())
-        self.bids.append(market.get_bid())
-        self.utilities.append(market.get_individual_utility())
+        self.equilibrium = equilibrium
+        self.strides = {name: 1 for name in self._get_variables()}
+        if strides is not None:
+            unknown = set(strides) - set(self.strides)
+            if unknown:
+                raise ValueError("Cannot record " + str(sorted(unknown)) + ". Choose from " + str(list(self.strides)) + ".")
+            self.strides.update(strides)
+        self.dtype = dtype
+        self.writer = writer
+        self.checkpointer = Checkpointer()
+        self.checkpoint_path = None
+        self.saved_records = {}
+        self.observer = observer
+        if observer is not None:
+            market.set_observer(observer)
+        self.analytics = analytics
+        if analytics is not None:
+            analytics.start(market)
+        self.history = {}
+        self.times = {}
+        self.n_records = {}
+        for name, stride in self.strides.items():
+            if stride:
+                self.n_records[name] = 0
+                if writer is not None:
+                    continue
+                value = self._get_value(name)
+                size = 1 if market.get_time() % stride == 0 else 0
+                self.history[name] = np.empty((size,) + np.shape(value), dtype=dtype or np.result_type(value))
+                self.times[name] = np.empty(size, dtype=np.int64)
+        self._record()
+
+    def _get_variables(self):
+        """
+        Returns the names of the variables that can be recorded.
+        """
+        return list(self.getters) + (list(self.errors) if self.equilibrium is not None else [])
+
+    def _get_value(self, name):
+        """
+        Returns the current value of variable name.
+        """
+        if name in self.errors:
+            method, getter = self.errors[name]
+            return getattr(self.equilibrium, method)(getattr(self.market, getter)())
+        return getattr(self.market, self.getters[name])()
+
+    def _reserve(self, time_steps):
+        """
+        Grows history arrays to fit the records of the next time_steps updates.
+        """
+        time = self.market.get_time()
+        for name in self.history:
+            stride = self.strides[name]
+            self._grow(name, self.n_records[name] + (time + time_steps) // stride - time // stride)
+
+    def _grow(self, name, needed):
+        """
+        Grows the history of variable name to hold at least needed records. Beyond them, arrays grow by as many
+        records as they hold, up to GROWTH_BYTES of records (at least one), so that many short runs, or records added
+        one at a time, copy each record O(1) times on average while memory stays bounded: a buffer holds at most
+        GROWTH_BYTES, or one record, more than it needs, and the old and new arrays coexist only while copying.
+        """
+        buffer = self.history[name]
+        if needed <= len(buffer):
+            return
+        record_bytes = buffer.itemsize * int(np.prod(buffer.shape[1:]))
+        size = max(needed, len(buffer) + min(len(buffer), max(1, GROWTH_BYTES // max(1, record_bytes))))
+        k = self.n_records[name]
+        self.history[name] = np.empty((size,) + buffer.shape[1:], dtype=buffer.dtype)
+        self.history[name][:k] = buffer[:k]
+        times = self.times[name]
+        self.times[name] = np.empty(size, dtype=np.int64)
+        self.times[name][:k] = times[:k]
+
+    def _record(self):
+        """
+        Copies the market's current state into the history of each variable due at this time.
+        """
+        time = self.market.get_time()
+        for name, k in self.n_records.items():
+            if time % self.strides[name] == 0:
+                value = self._get_value(name)
+                if self.writer is not None:
+                    self.writer.write(name, time, value)
+                else:
+                    self._grow(name, k + 1)
+                    self.history[name][k] = value
+                    self.times[name][k] = time
+                self.n_records[name] = k + 1
     
-    def run(self, time_steps):
+    def run(self, time_steps, price_tol=None, bid_tol=None, spending_tol=None, check_every=1, checkpoint_path=None, checkpoint_every=None, accelerator=None, cache: ResultCache = None):
+        """
+        Runs up to time_steps updates, stopping early once every tolerance given is met.
+        Tolerances are checked every check_every steps and after the last step.
+        If checkpoint_path is given, a checkpoint is saved there whenever the market's time is a multiple of checkpoint_every.
+        If an accelerator is given, each update is taken through it. Its history is not checkpointed.
+        Checked steps and the steps just before them are not extrapolated, so residuals measure the update rule's own change.
+        If a cache is given, a run it has the result of restores that result instead of running (the observer and
+        checkpoints see no updates), and a longer run continues from the longest cached run it extends.
+
+        Params
+        ------
+        time_steps : int
+            Maximum number of updates to run.
+        price_tol : float
+            Tolerance for the largest relative change in a good's price, max_j |p_j(t) - p_j(t-1)| / p_j(t).
+        bid_tol : float
+            Tolerance for the largest absolute change in a bid, max_ij |b_ij(t+1) - b_ij(t)|.
+        spending_tol : float
+            Tolerance for the excess spending at the previous prices, sum_j |p_j(t) - p_j(t-1)|, relative to total budget.
+        check_every : int
+            Number of updates between checks.
+        checkpoint_path : str
+            File checkpoints are saved to. Each checkpoint replaces the last.
+        checkpoint_every : int
+            Number of updates between checkpoints.
+        accelerator : Accelerator
+            Acceleration mode for this run, e.g. Anderson(), or None for the plain update rule.
+        cache : ResultCache
+            Cache of results to look this run up in and store it to. Runs with an accelerator or a writer aren't cached.
+
+        Returns
+        -------
+        converged_time : int
+            Market time at which every tolerance was met, or None if the run did not converge.
+        residuals : dict
+            Residuals ("price", "bid", "spending") at the last check, and with an equilibrium the errors ("price_error", "utility_error").
+        """
+        if cache is None:
+            return self._run(time_steps, price_tol, bid_tol, spending_tol, check_every, checkpoint_path, checkpoint_every, accelerator)
+        if accelerator is not None or self.writer is not None:
+            raise ValueError("Runs with an accelerator or a writer can't be cached.")
+        params = {
+            "tols": [price_tol, bid_tol, spending_tol],
+            "check_every": check_every,
+            "errors": self.equilibrium is not None,
+            "analytics": None if self.analytics is None else [self.analytics.every, self.analytics.decay],
+        }
+        key = cache.get_key(self._get_state(), params)
+        start = self.market.get_time()
+        cached = cache.get(key, time_steps, check_every)
+        steps = 0
+        if cached is not None:
+            steps, finished, state = cached
+            set_market_state(state["market"], self.market)
+            self._set_state(state["simulation"])
+            if finished:
+                result = state["result"]
+                return result["converged_time"], {name: value[()] for name, value in result["residuals"].items()}
+        converged_time, residuals = self._run(time_steps - steps, price_tol, bid_tol, spending_tol, check_every, checkpoint_path, checkpoint_every, None)
+        state = self._get_state()
+        state["result"] = {"converged_time": converged_time, "residuals": {name: np.asarray(value) for name, value in residuals.items()}}
+        cache.put(key, self.market.get_time() - start, converged_time is not None, state)
+        return converged_time, residuals
+
+    def _run(self, time_steps, price_tol, bid_tol, spending_tol, check_every, checkpoint_path, checkpoint_every, accelerator):
+        tols = {"price": price_tol, "bid": bid_tol, "spending": spending_tol}
+        tols = {key: tol for key, tol in tols.items() if tol is not None}
+        residuals = {}
+        if not tols:
+            # Runs that can stop early grow their history as they go, instead of for every step they might run.
+            self._reserve(time_steps)
         for i in range(time_steps):
-            self.market.update()
-            self.prices.append(self.market.get_price())
-            self.qtys.append(self.market.get_qty())
-            self.bids.append(self.market.get_bid())
-            self.utilities.append(self.market.get_individual_utility())
+            check = (i + 1) % check_every == 0 or i == time_steps - 1
+            check_next = (i + 2) % check_every == 0 or i + 1 == time_steps - 1
+            if check:
+                previous_price = np.array(self.market.get_price())
+                previous_bid = np.array(self.market.get_bid()) if "bid" in tols or i == time_steps - 1 else None
+
+            if accelerator is None:
+                self.market.update()
+            else:
+                accelerator.step(self.market, extrapolate=not (check or check_next))
+            self._record()
+            if self.analytics is not None:
+                self.analytics.update(self.market)
+            if self.observer is not None:
+                self.observer.on_phase(self.market, "record")
+            if checkpoint_path is not None and self.market.get_time() % checkpoint_every == 0:
+                self.checkpoint(checkpoint_path)
+
+            if check:
+                residuals = self._residuals(previous_price, previous_bid)
+                if tols and all(residuals[key] <= tol for key, tol in tols.items()):
+                    self.checkpointer.wait()
+                    return self.market.get_time(), residuals
+        self.checkpointer.wait()
+        return None, residuals
+
+    def _get_state(self, history: bool = True):
+        """
+        Returns the state of the market and simulation, without the writer's.
+        Without history, in-memory history is left out, and only its record counts are kept.
+        """
+        state = {
+            "market": get_market_state(self.market),
+            "simulation": {
+                "strides": self.strides,
+                "dtype": None if self.dtype is None else np.dtype(self.dtype).str,
+                "n_records": dict(self.n_records),
+            },
+        }
+        if history:
+            # Recorded rows are never changed, so they can be saved without copying.
+            state["simulation"]["history"] = {name: buffer[:self.n_records[name]] for name, buffer in self.history.items()}
+            state["simulation"]["times"] = {name: times[:self.n_records[name]] for name, times in self.times.items()}
+        if self.analytics is not None:
+            state["simulation"]["analytics"] = self.analytics.get_state()
+        return state
+
+    def _set_state(self, saved: dict):
+        """
+        Restores the simulation's part of a state from _get_state, leaving the market and writer.
+        """
+        self.strides = {name: int(stride) for name, stride in saved["strides"].items()}
+        self.dtype = None if saved["dtype"] is None else np.dtype(saved["dtype"])
+        self.n_records = {name: int(k) for name, k in saved["n_records"].items()}
+        self.history = dict(saved.get("history", {}))
+        self.times = dict(saved.get("times", {}))
+        if self.analytics is not None:
+            self.analytics.set_state(saved["analytics"])
+
+    def checkpoint(self, path):
+        """
+        Saves the market and history offsets to path, so the simulation can be resumed with Simulation.resume.
+        The loop only waits to copy the market's arrays; the file is written in a background thread.
+        In-memory history is appended to files in the directory path + ".history", one per variable: each checkpoint
+        to the same path only writes the records since the last one, before the file at path that counts them.
+        If history is streamed, the checkpoint is written after the records before it.
+        """
+        state = self._get_state(history=False)
+        if self.writer is not None:
+            state["simulation"]["writer"] = self.writer.get_state()
+            self.writer.submit(lambda: save_state(path, state))
+            return
+        state["simulation"]["history_files"] = {
+            name: {"dtype": buffer.dtype.str, "shape": list(buffer.shape[1:])} for name, buffer in self.history.items()
+        }
+        saved = self.saved_records if path == self.checkpoint_path else {}
+        directory = path + ".history"
+        # Views of rows that are never changed again, so the background thread can write them without a copy.
+        records = {}
+        for name, buffer in self.history.items():
+            start = saved.get(name, 0)
+            records[name] = (start, buffer[start:self.n_records[name]], self.times[name][start:self.n_records[name]])
+        def save():
+            os.makedirs(directory, exist_ok=True)
+            for name, (start, rows, times) in records.items():
+                append_records(os.path.join(directory, name + ".bin"), rows, start)
+                append_records(os.path.join(directory, name + "_times.bin"), times, start)
+            save_state(path, state)
+        self.checkpointer.submit(save)
+        self.checkpoint_path = path
+        self.saved_records = dict(self.n_records)
+
+    @classmethod
+    def resume(cls, path, writer: TrajectoryWriter = None, analytics: TrajectoryAnalytics = None):
+        """
+        Restores a simulation from a checkpoint saved by Simulation.checkpoint.
+        Continuing the run gives exactly the same results as an uninterrupted run.
+        If errors were being recorded, the reference equilibrium is found again with get_equilibrium.
+
+        Params
+        ------
+        path : str
+            Checkpoint file.
+        writer : TrajectoryWriter
+            New writer on the directory the history was streamed to. Records after the checkpoint are dropped.
+        analytics : TrajectoryAnalytics
+            New analytics with the same metrics as the checkpointed simulation's, to continue its summaries.
+        """
+        state = load_state(path)
+        saved = state["simulation"]
+        if ("writer" in saved) != (writer is not None):
+            raise ValueError("Pass a writer to resume exactly when the checkpointed simulation streamed its history.")
+        if ("analytics" in saved) != (analytics is not None):
+            raise ValueError("Pass analytics to resume exactly when the checkpointed simulation had analytics.")
+        if "history_files" in saved:
+            directory = path + ".history"
+            saved["history"] = {}
+            saved["times"] = {}
+            for name, entry in saved["history_files"].items():
+                k = int(saved["n_records"][name])
+                saved["history"][name] = load_records(os.path.join(directory, name + ".bin"), entry["dtype"], entry["shape"], k)
+                saved["times"][name] = load_records(os.path.join(directory, name + "_times.bin"), np.int64, (), k)
+        simulation = cls.__new__(cls)
+        simulation.market = set_market_state(state["market"])
+        simulation.writer = writer
+        simulation.checkpointer = Checkpointer()
+        # The history files already hold every record before the checkpoint.
+        simulation.checkpoint_path = path
+        simulation.saved_records = {name: int(k) for name, k in saved["n_records"].items()}
+        simulation.observer = None
+        simulation.analytics = analytics
+        simulation._set_state(saved)
+        simulation.equilibrium = get_equilibrium(simulation.market) if any(simulation.strides.get(name) for name in cls.errors) else None
+        if writer is not None:
+            writer.restore(saved["writer"])
+        return simulation
+
+    def _residuals(self, previous_price, previous_bid):
+        """
+        Computes convergence residuals of the last update from the prices and bids before it.
+        """
+        price = self.market.get_price()
+        price_change = np.abs(price - previous_price)
+        residuals = {
+            "price": np.max(price_change / price),
+            "spending": np.sum(price_change) / np.sum(self.market.budget),
+        }
+        if previous_bid is not None:
+            residuals["bid"] = np.max(np.abs(self.market.get_bid() - previous_bid))
+        if self.equilibrium is not None:
+            for name in self.errors:
+                residuals[name] = self._get_value(name)
+        return residuals
+
+    def get_history(self, name):
+        """
+        Returns the recorded values of variable name, one row per record.
+        """
+        if self.writer is not None:
+            raise ValueError("History is streamed to " + self.writer.directory + ". Read it with TrajectoryReader.")
+        if name not in self.history:
+            raise ValueError("Variable " + name + " is not being recorded.")
+        return self.history[name][:self.n_records[name]]
+
+    def get_times(self, name):
+        """
+        Returns the market time of each record of variable name.
+        """
+        if self.writer is not None:
+            raise ValueError("History is streamed to " + self.writer.directory + ". Read it with TrajectoryReader.")
+        if name not in self.history:
+            raise ValueError("Variable " + name + " is not being recorded.")
+        return self.times[name][:self.n_records[name]]
+
+    @property
+    def prices(self):
+        return self.get_history("price")
+
+    @property
+    def qtys(self):
+        return self.get_history("qty")
+
+    @property
+    def bids(self):
+        return self.get_history("bid")
+
+    @property
+    def utilities(self):
+        return self.get_history("utility")
 
     def get_prices(self):
         return self.prices
@@ -55,9 +426,3 @@ class Simulation:
 
     def get_utilities(self):
         return self.utilities
-
-    
-        
-
-
-
@@ -0,0 +1,167 @@
+import numpy as np
+from root.market import Market, PropRespLinearMarket, PropRespZhangMarket
+
+class BuyerCSR:
+    """
+    Class to represent an nxm array by its nonzero (i, j) pairs, stored as compressed sparse rows over buyers.
+    Sparse markets share one structure between their bids, quantities and utilities, so only data differs.
+
+    Attributes
+    ----------
+    indptr : np.array
+        1d array of length n+1. Pairs of buyer i are stored at positions indptr[i]:indptr[i+1].
+    indices : np.array
+        1d array. indices[k] gives the good of pair k.
+    data : np.array
+        1d array. data[k] gives the value of pair k.
+    shape : tuple
+        (n, m), the number of buyers and goods.
+    """
+    def __init__(self, indptr: np.array, indices: np.array, data: np.array, shape: tuple):
+        if len(indptr) != shape[0] + 1 or len(indices) != len(data) or indptr[-1] != len(data):
+            raise ValueError("Check that indptr has n+1 entries and that indices and data have indptr[-1] entries.")
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_dense(cls, dense: np.array, mask: np.array = None):
+        """
+        Keeps the entries of a dense nxm array where mask is true. Defaults to the nonzero entries.
+        """
+        if mask is None:
+            mask = dense != 0
+        rows, indices = np.nonzero(mask)
+        # nonzero returns strided views; contiguous indices save a copy whenever they're used.
+        indices = np.ascontiguousarray(indices)
+        indptr = np.zeros(dense.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=dense.shape[0]), out=indptr[1:])
+        return cls(indptr, indices, dense[rows, indices], dense.shape)
+
+    def with_data(self, data: np.array):
+        """
+        Returns a BuyerCSR with the same structure as this one but different data.
+        """
+        return BuyerCSR(self.indptr, self.indices, data, self.shape)
+
+    def get_rows(self):
+        """
+        Returns the buyer of each pair.
+        """
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    def toarray(self):
+        dense = np.zeros(self.shape, dtype=self.data.dtype)
+        dense[self.get_rows(), self.indices] = self.data
+        return dense
+
+class SparseMarket(Market):
+    """
+    Class to represent a market whose bids, quantities and utilities are only stored for the nonzero (i, j) pairs.
+    Memory and the cost of each time step scale with the number of pairs, instead of n*m.
+
+    Buyers only ever bid on goods in the structure; under the linear and CES rules a pair with 0 utility would
+    receive a 0 bid after one step anyway.
+
+    Attributes
+    ----------
+    bid, qty, utility : np.array
+        1d arrays over pairs, in the order of the BuyerCSR structure. Use to_dense() to view them as nxm arrays.
+    indptr, indices : np.array
+        BuyerCSR structure shared by bid, qty and utility.
+    rows : np.array
+        1d array. rows[k] gives the buyer of pair k.
+    Other attributes are as in Market.
+    """
+    def __init__(self, budget: np.array, start_bids: BuyerCSR, utility: BuyerCSR):
+        self.n_buyers, self.n_goods = utility.shape
+        if np.shape(budget) != (self.n_buyers,):
+            raise ValueError("Check that budget and utility dimensions conform. Budget should be 1xn and Utility should be mxn")
+        if start_bids.shape != utility.shape or not (np.array_equal(start_bids.indptr, utility.indptr) and np.array_equal(start_bids.indices, utility.indices)):
+            raise ValueError("Check that starting bids and utility have the same dimensions and sparsity structure.")
+
+        self.indptr = utility.indptr
+        self.indices = utility.indices
+        self.rows = utility.get_rows()
+
+        if np.any(np.bincount(self.rows, weights=start_bids.data, minlength=self.n_buyers) > budget):
+            raise ValueError("Starting bids of each invididual cannot be greater than their budget!")
+
+        self.time = 0
+        self.bid = start_bids.data
+        self.price = np.bincount(self.indices, weights=self.bid, minlength=self.n_goods)
+        if not np.all(self.price):
+            raise ZeroDivisionError("Price of good has reached 0.")
+
+        self.qty = self.bid / self.price[self.indices]
+        self.budget = budget
+        self.utility = utility.data
+        self.individual_utility = np.zeros(self.n_buyers)
+        self._log_utility = None
+        self._log_utility_source = None
+        self.observer = None
+        self._workspace = None
+
+    @classmethod
+    def from_dense(cls, budget: np.array, start_bids: np.array, utility: np.array, *args):
+        """
+        Builds a sparse market from dense nxm bids and utilities, keeping the pairs where either is nonzero.
+        Gives the same dynamics as the dense market.
+        """
+        structure = BuyerCSR.from_dense(utility, (utility != 0) | (start_bids != 0))
+        bids = structure.with_data(start_bids[structure.get_rows(), structure.indices])
+        return cls(budget, bids, structure, *args)
+
+    def to_dense(self, values: np.array):
+        """
+        Returns values over pairs (e.g. get_bid() or get_qty()) as a dense nxm array.
+        """
+        return BuyerCSR(self.indptr, self.indices, values, (self.n_buyers, self.n_goods)).toarray()
+
+    def _get_buyer_market(self, buyers):
+        raise ValueError("Sparse markets only update all buyers at once.")
+
+    def _check_mutable(self):
+        raise ValueError("Sparse markets can't be changed in place. Build a new one with from_dense.")
+
+    def set_active_set(self, threshold: float = 1e-8, recheck_every: int = 100, max_density: float = 0.5):
+        raise ValueError("Sparse markets don't support active sets. Build a new one with from_dense to drop pairs.")
+
+    def set_workers(self, workers: int, shard_size: int = None):
+        raise ValueError("Sparse markets only update all buyers at once.")
+
+    def _update_price(self):
+        self.price = np.bincount(self.indices, weights=self.bid, minlength=self.n_goods) # calculate new prices
+        if not np.all(self.price):
+            raise ZeroDivisionError("Price of good " + str(np.argwhere(self.price == 0)[0]) + " reached 0 at time " + str(self.time) + ".")
+
+    def _update_qty(self):
+        # take() buffers out unless told indices are in range.
+        qty = np.take(self.price, self.indices, out=self._get_workspace("qty", self.bid.shape, np.result_type(self.bid, self.price)), mode='clip')
+        self.qty = np.divide(self.bid, qty, out=qty) # calculate new quantities
+
+    def _buyer_sum(self, x: np.array):
+        return np.bincount(self.rows, weights=x, minlength=self.n_buyers)
+
+    def _buyer_max(self, x: np.array):
+        # reduceat only sees buyers with pairs; the rest have max log(0).
+        out = np.full(self.n_buyers, -np.inf, dtype=x.dtype)
+        nonempty = np.diff(self.indptr) > 0
+        if np.any(nonempty):
+            out[nonempty] = np.maximum.reduceat(x, self.indptr[:-1][nonempty])
+        return out
+
+    def _per_buyer(self, x: np.array):
+        # Updating in place, the result is overwritten by the next call.
+        return np.take(x, self.rows, out=self._get_workspace("per_buyer", self.rows.shape, x.dtype), mode='clip')
+
+class SparsePropRespLinearMarket(PropRespLinearMarket, SparseMarket):
+    """
+    Class to represent a sparse market, using proportionate response dynamics with linear utilities.
+    """
+
+class SparsePropRespZhangMarket(PropRespZhangMarket, SparseMarket):
+    """
+    Class to represent a sparse market with Zhang's CES preferences, using the proportional response dynamic detailed in his paper.
+    """
@@ -0,0 +1,222 @@
+import itertools
+import multiprocessing
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory, util
+import numpy as np
+from root.cache import ResultCache
+from root.initializer import Initializer
+from root.simulation import Simulation
+
+class SweepJob:
+    """
+    Class to describe one run of a parameter sweep.
+
+    Attributes
+    ----------
+    market_class : type
+        Subclass of Market to run.
+    n_goods, n_buyers, seed : int
+        Initializer parameters.
+    method : str
+        Initializer method that generates [budget, bids, util], e.g. "initialize_linear_utilities_basic".
+    args : tuple
+        Extra parameters of market_class, e.g. (alpha,) or (alpha, n_linear).
+    time_steps : int
+        Maximum number of updates.
+    tols : dict
+        Tolerances passed to Simulation.run, e.g. {"price_tol": 1e-6}.
+    """
+    def __init__(self, market_class: type, n_goods: int, n_buyers: int, seed: int, method: str = "initialize_linear_utilities_basic", args: tuple = (), time_steps: int = 1000, tols: dict = None):
+        self.market_class = market_class
+        self.n_goods = n_goods
+        self.n_buyers = n_buyers
+        self.seed = seed
+        self.method = method
+        self.args = tuple(args)
+        self.time_steps = time_steps
+        self.tols = tols or {}
+
+    def get_instance_key(self):
+        return (self.n_goods, self.n_buyers, self.seed, self.method)
+
+def make_grid(market_classes: list, sizes: list, seeds: list, args: list = [()], time_steps: list = [1000], method: str = "initialize_linear_utilities_basic", tols: dict = None):
+    """
+    Returns a SweepJob for every combination of market class, (n_goods, n_buyers) size, seed, args and time_steps.
+    """
+    return [
+        SweepJob(market_class, n_goods, n_buyers, seed, method, job_args, steps, tols)
+        for market_class, (n_goods, n_buyers), seed, job_args, steps in itertools.product(market_classes, sizes, seeds, args, time_steps)
+    ]
+
+# Shared memory blocks attached by this worker process, by name.
+_attached = {}
+
+def _open_shared(name):
+    """
+    Attaches to the shared memory block name without registering it with the resource tracker. The sweep's process
+    owns the block and unregisters it when unlinking it, so a worker's registration would either be unlinked or
+    warned about as a leak by a tracker of its own, or be removed from the tracker the workers share with it.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+def _attach(block):
+    name, shape, dtype = block
+    if name not in _attached:
+        _attached[name] = _open_shared(name)
+    array = np.ndarray(shape, dtype=dtype, buffer=_attached[name].buf)
+    array.flags.writeable = False
+    return array
+
+def _detach():
+    """
+    Closes the blocks this worker attached. Blocks still viewed by arrays are left to close with the process.
+    """
+    while _attached:
+        _, shm = _attached.popitem()
+        try:
+            shm.close()
+        except BufferError:
+            pass
+
+def _init_worker():
+    # Runs when the worker exits normally, after the pool is closed.
+    util.Finalize(None, _detach, exitpriority=0)
+
+def _run_job(task):
+    index, job, blocks, cache = task
+    row = {
+        "job": index,
+        "market": job.market_class.__name__,
+        "n_goods": job.n_goods,
+        "n_buyers": job.n_buyers,
+        "seed": job.seed,
+        "args": job.args,
+        "time_steps": job.time_steps,
+        "error": None,
+    }
+    start = time.perf_counter()
+    try:
+        budget, bids, util = (_attach(block) for block in blocks)
+        # Bids are updated in place, so each job works on its own copy. Budgets and utilities are only read.
+        market = job.market_class(budget, bids.copy(), util, *job.args)
+        simulation = Simulation(market, strides={name: 0 for name in Simulation.getters})
+        converged_time, residuals = simulation.run(job.time_steps, cache=cache, **job.tols)
+        row.update({
+            "steps": market.get_time(),
+            "converged_time": converged_time,
+            "price_residual": float(residuals["price"]),
+            "bid_residual": float(residuals.get("bid", np.nan)),
+            "spending_residual": float(residuals["spending"]),
+            "min_price": float(np.min(market.get_price())),
+            "max_price": float(np.max(market.get_price())),
+            "mean_utility": float(np.mean(market.get_individual_utility())),
+        })
+    except Exception as e:
+        row["error"] = type(e).__name__ + ": " + str(e)
+    row["seconds"] = time.perf_counter() - start
+    return row
+
+def to_table(rows: list):
+    """
+    Turns a list of result rows into a table, a dict mapping each column to a list of values ordered by job.
+    """
+    rows = sorted(rows, key=lambda row: row["job"])
+    columns = []
+    for row in rows:
+        columns += [key for key in row if key not in columns]
+    return {key: [row.get(key) for row in rows] for key in columns}
+
+class Sweep:
+    """
+    Class to run a list of SweepJobs across a process pool.
+    Each distinct instance (sizes, seed and Initializer method) is generated once in this process, straight
+    into shared memory, so workers read utilities directly instead of receiving a pickled copy per job.
+
+    Attributes
+    ----------
+    jobs : list
+        SweepJobs to run.
+    processes : int
+        Number of worker processes. Defaults to the number of cores.
+    cache : ResultCache
+        Cache every job's run is looked up in and stored to, or None. Jobs repeating a cached run take no time,
+        and jobs of more steps continue from cached shorter ones.
+
+    Methods
+    -------
+    imap():
+        Yields each job's result row as soon as it finishes.
+    run(callback):
+        Runs every job and returns the results as a table.
+    """
+    def __init__(self, jobs: list, processes: int = None, cache: ResultCache = None):
+        self.jobs = jobs
+        self.processes = processes or multiprocessing.cpu_count()
+        self.cache = cache
+
+    def _share_instances(self):
+        """
+        Generates each distinct instance once, directly into shared memory.
+
+        Returns
+        -------
+        blocks : dict
+            blocks[key] gives (name, shape, dtype) of the shared budget, bids and util of instance key.
+        shms : list
+            SharedMemory objects to release when the sweep is done.
+        """
+        blocks = {}
+        shms = []
+        for job in self.jobs:
+            key = job.get_instance_key()
+            if key in blocks:
+                continue
+            initializer = Initializer(job.n_goods, job.n_buyers, job.seed)
+            blocks[key] = []
+            out = []
+            for shape in [(job.n_buyers,), (job.n_buyers, job.n_goods), (job.n_buyers, job.n_goods)]:
+                shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * initializer.dtype.itemsize, 1))
+                shms.append(shm)
+                out.append(np.ndarray(shape, dtype=initializer.dtype, buffer=shm.buf))
+                blocks[key].append((shm.name, shape, initializer.dtype.str))
+            getattr(initializer, job.method)(out=out)
+        return blocks, shms
+
+    def imap(self):
+        blocks, shms = self._share_instances()
+        try:
+            tasks = [(index, job, blocks[job.get_instance_key()], self.cache) for index, job in enumerate(self.jobs)]
+            with multiprocessing.Pool(self.processes, initializer=_init_worker) as pool:
+                for row in pool.imap_unordered(_run_job, tasks):
+                    yield row
+                # Let workers exit on their own, closing their blocks, instead of being terminated.
+                pool.close()
+                pool.join()
+        finally:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+    def run(self, callback=None):
+        """
+        Runs every job and returns the results as a table (see to_table).
+
+        Params
+        ------
+        callback : function
+            Called with each result row as soon as its job finishes, e.g. to save partial results.
+        """
+        rows = []
+        for row in self.imap():
+            rows.append(row)
+            if callback is not None:
+                callback(row)
+        return to_table(rows)
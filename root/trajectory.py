@@ -0,0 +1,229 @@
+import json
+import os
+import queue
+import threading
+import numpy as np
+
+class TrajectoryWriter:
+    """
+    Class to stream recorded market states to disk.
+    Records are collected into chunks in memory, and full chunks are appended to one file per variable by a
+    background thread, so the update loop only pays for copying each record.
+
+    Each variable name is stored as raw records in name.bin, with their times in name_times.npy.
+    index.json gives the dtype, record shape and number of records of each variable.
+
+    Attributes
+    ----------
+    directory : str
+        Directory the trajectory is written to.
+    chunk_size : int
+        Number of records of a variable collected before they are written.
+    dtype : np.dtype
+        dtype records are stored in. Defaults to the dtype of the first record of each variable.
+
+    Methods
+    -------
+    write(name, time, value):
+        Records value of variable name at time.
+    submit(fn):
+        Runs fn in the background thread once every record collected so far is written.
+    flush():
+        Writes all collected records and the index, and waits for them to reach disk.
+    close():
+        Flushes and stops the background thread.
+    """
+    def __init__(self, directory: str, chunk_size: int = 64, dtype=None):
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive.")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+        self.chunks = {}
+        self.n_buffered = {}
+        self.n_records = {}
+        self.times = {}
+        self.files = {}
+        # Bounded, so that a slow disk holds up the update loop instead of using unbounded memory.
+        self.queue = queue.Queue(maxsize=4)
+        self.error = None
+        self.thread = threading.Thread(target=self._write_chunks, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write_chunks(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if callable(item):
+                    for f in list(self.files.values()):
+                        f.flush()
+                    item()
+                elif item is not None and self.error is None:
+                    name, chunk = item
+                    chunk.tofile(self.files[name])
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+            if item is None:
+                return
+
+    def _check_error(self):
+        if self.error is not None:
+            raise IOError("Failed writing trajectory to " + self.directory + ".") from self.error
+
+    def write(self, name: str, time: int, value: np.array):
+        """
+        Records value of variable name at time. value is copied, so it can be changed afterwards.
+        """
+        self._check_error()
+        if name not in self.chunks:
+            self.chunks[name] = np.empty((self.chunk_size,) + np.shape(value), dtype=self.dtype or np.result_type(value))
+            self.n_buffered[name] = 0
+            self.n_records[name] = 0
+            self.times[name] = []
+            self.files[name] = open(os.path.join(self.directory, name + ".bin"), "wb")
+        k = self.n_buffered[name]
+        self.chunks[name][k] = value
+        self.times[name].append(time)
+        self.n_buffered[name] = k + 1
+        self.n_records[name] += 1
+        if k + 1 == self.chunk_size:
+            self._send(name)
+
+    def _send(self, name):
+        """
+        Hands the collected records of variable name to the background thread and starts a new chunk.
+        """
+        chunk = self.chunks[name]
+        self.queue.put((name, chunk[:self.n_buffered[name]]))
+        self.chunks[name] = np.empty_like(chunk)
+        self.n_buffered[name] = 0
+
+    def submit(self, fn):
+        self._check_error()
+        for name in self.chunks:
+            if self.n_buffered[name]:
+                self._send(name)
+        self.queue.put(fn)
+
+    def get_state(self):
+        """
+        Returns the dtype, record shape, record count and times of each variable written so far.
+        """
+        return {
+            name: {
+                "dtype": chunk.dtype.str,
+                "shape": list(chunk.shape[1:]),
+                "n_records": self.n_records[name],
+                "times": np.array(self.times[name], dtype=np.int64),
+            }
+            for name, chunk in self.chunks.items()
+        }
+
+    def restore(self, state: dict):
+        """
+        Continues a trajectory in this writer's directory from get_state(), dropping any records written after it.
+        Must be called before any records are written.
+        """
+        if self.chunks:
+            raise ValueError("Cannot restore a writer that has already written records.")
+        for name, entry in state.items():
+            dtype = np.dtype(entry["dtype"])
+            shape = tuple(int(x) for x in entry["shape"])
+            n_records = int(entry["n_records"])
+            self.chunks[name] = np.empty((self.chunk_size,) + shape, dtype=dtype)
+            self.n_buffered[name] = 0
+            self.n_records[name] = n_records
+            self.times[name] = [int(t) for t in entry["times"]]
+            path = os.path.join(self.directory, name + ".bin")
+            f = open(path, "r+b" if os.path.exists(path) else "wb")
+            size = n_records * dtype.itemsize * int(np.prod(shape))
+            f.seek(0, os.SEEK_END)
+            if f.tell() < size:
+                f.close()
+                raise ValueError("Trajectory " + path + " has fewer records than the state being restored.")
+            f.truncate(size)
+            f.seek(size)
+            self.files[name] = f
+
+    def flush(self):
+        for name in self.chunks:
+            if self.n_buffered[name]:
+                self._send(name)
+        self.queue.join()
+        self._check_error()
+        for name, f in self.files.items():
+            f.flush()
+            np.save(os.path.join(self.directory, name + "_times.npy"), np.array(self.times[name], dtype=np.int64))
+        index = {
+            name: {
+                "dtype": chunk.dtype.str,
+                "shape": list(chunk.shape[1:]),
+                "n_records": self.n_records[name],
+            }
+            for name, chunk in self.chunks.items()
+        }
+        with open(os.path.join(self.directory, "index.json"), "w") as f:
+            json.dump(index, f)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.flush()
+            self.queue.put(None)
+            self.thread.join()
+            for f in self.files.values():
+                f.close()
+
+class TrajectoryReader:
+    """
+    Class to lazily read a trajectory written by TrajectoryWriter.
+    Records are memory-mapped, so slicing a range of steps or buyers reads only what is used and makes no copy.
+
+    Attributes
+    ----------
+    directory : str
+        Directory the trajectory was written to.
+    index : dict
+        index[name] gives the dtype, record shape and number of records of variable name.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "index.json")) as f:
+            self.index = json.load(f)
+
+    def get_variables(self):
+        return list(self.index)
+
+    def get(self, name: str):
+        """
+        Returns a read-only memory-mapped array of the records of variable name, one row per record.
+        """
+        if name not in self.index:
+            raise ValueError("Variable " + name + " was not recorded.")
+        entry = self.index[name]
+        shape = (entry["n_records"],) + tuple(entry["shape"])
+        if entry["n_records"] == 0:
+            return np.empty(shape, dtype=entry["dtype"])
+        return np.memmap(os.path.join(self.directory, name + ".bin"), dtype=entry["dtype"], mode="r", shape=shape)
+
+    def get_times(self, name: str):
+        """
+        Returns the market time of each record of variable name.
+        """
+        if name not in self.index:
+            raise ValueError("Variable " + name + " was not recorded.")
+        return np.load(os.path.join(self.directory, name + "_times.npy"))
+
+    def slice(self, name: str, start: int = None, stop: int = None, buyers=slice(None)):
+        """
+        Returns records start:stop of variable name for the given buyers, as a view when buyers is a slice.
+        """
+        return self.get(name)[start:stop, buyers]
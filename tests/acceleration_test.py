@@ -0,0 +1,51 @@
+import unittest
+import numpy as np
+from root.acceleration import Accelerator, Aitken, Anderson, Damping, Momentum
+from root.market import PropRespLinearMarket, PropRespZhangMarket
+from root.simulation import Simulation
+from tests.helpers import make_params
+
+def run(market, accelerator, time_steps=20000):
+    simulation = Simulation(market, strides={name: 0 for name in Simulation.getters})
+    return simulation.run(time_steps, price_tol=1e-9, check_every=10, accelerator=accelerator)[0]
+
+class FeasibilityTest(unittest.TestCase):
+    def test(self):
+        # Skewed utilities make plain proportional response converge slowly.
+        budget, bids, utility = make_params(30, 8, 0, power=4)
+        bids[0, 0] = 0 # bids of 0 stay 0
+        for accelerator in [Accelerator(), Damping(), Momentum(), Aitken(), Anderson()]:
+            market = PropRespLinearMarket(budget, bids.copy(), utility)
+            for _ in range(50):
+                accelerator.step(market)
+                self.assertTrue(np.all(market.get_bid() >= 0))
+                np.testing.assert_allclose(market.get_bid().sum(axis=1), budget)
+                self.assertEqual(market.get_bid()[0, 0], 0)
+
+class AccelerationTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(100, 10, 1, power=4)
+        equilibrium = PropRespLinearMarket(budget, bids.copy(), utility)
+        for _ in range(50000):
+            equilibrium.update()
+        plain_steps = run(PropRespLinearMarket(budget, bids.copy(), utility), None)
+        self.assertIsNotNone(plain_steps)
+        for accelerator in [Momentum(), Aitken(), Anderson()]:
+            market = PropRespLinearMarket(budget, bids.copy(), utility)
+            steps = run(market, accelerator)
+            self.assertIsNotNone(steps)
+            self.assertLess(steps, plain_steps)
+            np.testing.assert_allclose(market.get_price(), equilibrium.get_price(), rtol=1e-5)
+
+class CESAccelerationTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(50, 10, 2, power=4)
+        plain = PropRespZhangMarket(budget, bids.copy(), utility, 0.5)
+        run(plain, None)
+        for accelerator in [Damping(), Momentum(), Aitken(), Anderson()]:
+            market = PropRespZhangMarket(budget, bids.copy(), utility, 0.5)
+            self.assertIsNotNone(run(market, accelerator))
+            np.testing.assert_allclose(market.get_price(), plain.get_price(), rtol=1e-6)
+
+if __name__ == '__main__':
+    unittest.main()
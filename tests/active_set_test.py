@@ -0,0 +1,117 @@
+import unittest
+import numpy as np
+from root.acceleration import Damping
+from root.checkpoint import get_market_state
+from root.chunked_market import ChunkedPropRespLinearMarket
+from root.market import GeneralPropRespQLMarketPD, MixedUtilityMarket, PropRespLinearMarket, PropRespZhangMarket
+from root.sparse_market import SparsePropRespLinearMarket
+from tests.helpers import make_params, run
+
+class ActiveSetLinearTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(60, 15, 0)
+        dense = run(PropRespLinearMarket(budget, bids.copy(), utility), 300)
+        market = run(PropRespLinearMarket(budget, bids.copy(), utility), 100)
+        market.set_active_set(1e-8, 20)
+        run(market, 200)
+        # Linear buyers end up spending on few goods.
+        self.assertLess(market.active_set.get_support(), 0.5 * 60 * 15)
+        self.assertLess(market.active_set.error, 15 * 1e-8)
+        np.testing.assert_allclose(market.get_price(), dense.get_price(), rtol=1e-7)
+        np.testing.assert_allclose(market.get_individual_utility(), dense.get_individual_utility(), rtol=1e-7)
+        # Pruned pairs read as 0 until the active set is turned off.
+        bid = market.get_bid()
+        self.assertEqual(np.count_nonzero(bid), market.active_set.get_support())
+        qty = market.get_qty()
+        np.testing.assert_allclose(qty[bid > 0], dense.get_qty()[bid > 0], rtol=1e-6)
+        market.set_active_set(None)
+        self.assertIsNone(market.active_set)
+        # Pruned bids were followed, down to the tiny ones.
+        np.testing.assert_allclose(market.get_bid(), dense.get_bid(), rtol=1e-6, atol=1e-300)
+        np.testing.assert_allclose(market.get_price(), dense.get_price(), rtol=1e-7)
+        run(market, 10)
+        run(dense, 10)
+        np.testing.assert_allclose(market.get_price(), dense.get_price(), rtol=1e-7)
+
+class ActiveSetReentryTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(30, 8, 1)
+        # Buyer 0 starts with almost nothing on the good they value most, so it is pruned and has to re-enter.
+        utility[0, 0] = 5
+        bids[0, 0] = 1e-12 * budget[0]
+        bids[0] *= budget[0] / bids[0].sum() * 0.999
+        dense = run(PropRespZhangMarket(budget, bids.copy(), utility, 0.5), 200)
+        market = PropRespZhangMarket(budget, bids.copy(), utility, 0.5)
+        market.set_active_set(1e-8, 10, max_density=1)
+        active = market.active_set
+        self.assertNotIn((0, 0), zip(active.rows, active.indices))
+        run(market, 200)
+        self.assertIn((0, 0), zip(active.rows, active.indices))
+        np.testing.assert_allclose(market.get_price(), dense.get_price(), rtol=1e-7)
+        np.testing.assert_allclose(market.get_bid(), dense.get_bid(), rtol=1e-6)
+
+class ActiveSetDensityTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(40, 10, 3)
+        # Zhang buyers keep spending on every good, so the market stays dense and updates as without an active set.
+        dense = run(PropRespZhangMarket(budget, bids.copy(), utility, 0.5), 50)
+        market = PropRespZhangMarket(budget, bids.copy(), utility, 0.5)
+        market.set_active_set(1e-8, 10)
+        self.assertTrue(market.active_set.dense)
+        self.assertEqual(market.active_set.get_support(), 40 * 10)
+        run(market, 50)
+        self.assertTrue(market.active_set.dense)
+        np.testing.assert_array_equal(market.get_bid(), dense.get_bid())
+        np.testing.assert_array_equal(market.get_price(), dense.get_price())
+        # Linear buyers start dense and are pruned at a later recheck, once few pairs are left.
+        dense = run(PropRespLinearMarket(budget, bids.copy(), utility), 300)
+        market = PropRespLinearMarket(budget, bids.copy(), utility)
+        market.set_active_set(1e-8, 20)
+        self.assertTrue(market.active_set.dense)
+        run(market, 300)
+        self.assertFalse(market.active_set.dense)
+        self.assertLess(market.active_set.get_support(), 0.5 * 40 * 10)
+        np.testing.assert_allclose(market.get_price(), dense.get_price(), rtol=1e-7)
+        market.set_active_set(None)
+        np.testing.assert_allclose(market.get_bid(), dense.get_bid(), rtol=1e-6, atol=1e-300)
+
+class ActiveSetErrorTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(10, 4, 2)
+        market = PropRespLinearMarket(budget, bids.copy(), utility)
+        for threshold in [0, 1]:
+            with self.assertRaises(ValueError):
+                market.set_active_set(threshold)
+        with self.assertRaises(ValueError):
+            market.set_active_set(1e-8, 0)
+        for max_density in [0, 1.5]:
+            with self.assertRaises(ValueError):
+                market.set_active_set(1e-8, 10, max_density)
+        self.assertIsNone(market.active_set)
+        batched = [np.stack(x) for x in zip(*[make_params(10, 4, seed) for seed in range(2)])]
+        unsupported = [
+            PropRespLinearMarket(*batched),
+            MixedUtilityMarket(budget, bids.copy(), utility, 0.5, np.arange(10) < 3),
+            MixedUtilityMarket(budget, bids.copy(), utility, np.linspace(0.2, 1, 10)[:, None]),
+            GeneralPropRespQLMarketPD(budget, bids.copy(), utility, 0.7),
+            SparsePropRespLinearMarket.from_dense(budget, bids.copy(), utility),
+            ChunkedPropRespLinearMarket(budget, bids.copy(), utility),
+        ]
+        for other in unsupported:
+            with self.subTest(market=type(other).__name__):
+                with self.assertRaises(ValueError):
+                    other.set_active_set()
+        market.set_active_set()
+        with self.assertRaises(ValueError):
+            get_market_state(market)
+        with self.assertRaises(ValueError):
+            market.update_buyers(slice(0, 5))
+        with self.assertRaises(ValueError):
+            market.add_buyers(budget[:2], utility[:2])
+        with self.assertRaises(ValueError):
+            Damping().step(market)
+        market.set_active_set(None)
+        get_market_state(market)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from root.analytics import METRICS, RunningStats, TrajectoryAnalytics
+from root.market import PropRespLinearMarket, PropRespZhangMarket
+from root.simulation import Simulation
+from tests.helpers import make_params
+
+class RunningStatsTest(unittest.TestCase):
+    def test(self):
+        stats = RunningStats(decay=0.5)
+        # Converges to 1 + [2, -3] with rate 0.8.
+        for t in range(40):
+            stats.update(1 + np.array([2.0, -3.0]) * (1 - 0.8 ** t))
+        summary = stats.get_summary()
+        self.assertEqual(summary["count"], 40)
+        np.testing.assert_allclose(summary["min"], [1, 1 - 3 * (1 - 0.8 ** 39)])
+        np.testing.assert_allclose(summary["max"], [1 + 2 * (1 - 0.8 ** 39), 1])
+        np.testing.assert_allclose(summary["rate"], [0.8, 0.8])
+        np.testing.assert_allclose(summary["error"], np.abs([2.0, -3.0]) * 0.8 ** 39)
+        np.testing.assert_allclose(summary["mean"], np.mean([1 + np.array([2.0, -3.0]) * (1 - 0.8 ** t) for t in range(40)], axis=0))
+        with self.assertRaises(ValueError):
+            RunningStats(decay=1)
+
+class StoppedTest(unittest.TestCase):
+    def test(self):
+        stats = RunningStats()
+        for value in [1.0, 2.0, 2.0, 2.0]:
+            stats.update(value)
+        summary = stats.get_summary()
+        self.assertTrue(np.isnan(summary["rate"]))
+        # The first value has the smallest weight, 0.9 ** 3.
+        self.assertAlmostEqual(summary["decayed_mean"], 2 - 0.729 / (1 + 0.9 + 0.81 + 0.729))
+
+class SimulationAnalyticsTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(30, 6, 0)
+        full = Simulation(PropRespZhangMarket(budget, bids.copy(), utility, 0.5))
+        full.run(50)
+        analytics = TrajectoryAnalytics(list(METRICS))
+        simulation = Simulation(PropRespZhangMarket(budget, bids.copy(), utility, 0.5), strides={name: 0 for name in Simulation.getters}, analytics=analytics)
+        simulation.run(50)
+        # The defaults keep no bids.
+        default = TrajectoryAnalytics()
+        Simulation(PropRespZhangMarket(budget, bids.copy(), utility, 0.5), strides={name: 0 for name in Simulation.getters}, analytics=default).run(5)
+        self.assertNotIn("kl_divergence", default.get_summary())
+        self.assertIsNone(default.previous_bid)
+        summary = analytics.get_summary()
+        # Summaries match metrics computed afterwards from the full history.
+        prices, history, utilities = full.get_prices(), full.get_bids(), full.get_utilities()
+        eisenberg_gale = np.sum(budget * np.log(utilities[1:]), axis=1)
+        kl = np.sum(history[1:] * np.log(history[1:] / history[:-1]), axis=(1, 2))
+        spending = np.sum(np.abs(prices[1:] - prices[:-1]), axis=1) / np.sum(budget)
+        self.assertEqual(summary["eisenberg_gale"]["count"], 50)
+        np.testing.assert_allclose(summary["eisenberg_gale"]["last"], eisenberg_gale[-1])
+        np.testing.assert_allclose(summary["eisenberg_gale"]["max"], eisenberg_gale.max())
+        np.testing.assert_allclose(summary["kl_divergence"]["min"], kl.min())
+        np.testing.assert_allclose(summary["kl_divergence"]["mean"], kl.mean())
+        np.testing.assert_allclose(summary["excess_spending"]["last"], spending[-1])
+        np.testing.assert_allclose(summary["buyer_utility"]["min"], utilities[1:].min(axis=0))
+        np.testing.assert_allclose(summary["price"]["last"], prices[-1])
+        self.assertLess(summary["excess_spending"]["rate"], 1)
+
+class BatchedAnalyticsTest(unittest.TestCase):
+    def test(self):
+        params = [make_params(12, 4, seed) for seed in range(2)]
+        budget, bids, utility = (np.stack(x) for x in zip(*params))
+        analytics = TrajectoryAnalytics(["eisenberg_gale", "kl_divergence"])
+        Simulation(PropRespLinearMarket(budget, bids.copy(), utility), strides={"bid": 0}, analytics=analytics).run(10)
+        for k in range(2):
+            replica = TrajectoryAnalytics(["eisenberg_gale", "kl_divergence"])
+            Simulation(PropRespLinearMarket(budget[k], bids[k].copy(), utility[k]), strides={"bid": 0}, analytics=replica).run(10)
+            for name, summary in replica.get_summary().items():
+                np.testing.assert_allclose(analytics.get_summary()[name]["mean"][k], summary["mean"])
+
+class ResumeAnalyticsTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(20, 5, 1)
+        analytics = TrajectoryAnalytics(every=2)
+        simulation = Simulation(PropRespZhangMarket(budget, bids.copy(), utility, 0.5), analytics=analytics)
+        simulation.run(40)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoint.npz")
+            simulation = Simulation(PropRespZhangMarket(budget, bids.copy(), utility, 0.5), analytics=TrajectoryAnalytics(every=2))
+            simulation.run(20, checkpoint_path=path, checkpoint_every=10)
+            with self.assertRaises(ValueError):
+                Simulation.resume(path)
+            with self.assertRaises(ValueError):
+                Simulation.resume(path, analytics=TrajectoryAnalytics(["price"], every=2))
+            resumed = Simulation.resume(path, analytics=TrajectoryAnalytics(every=2))
+            resumed.run(20)
+        expected = analytics.get_summary()
+        for name, summary in resumed.analytics.get_summary().items():
+            self.assertEqual(summary["count"], 20)
+            for key, value in summary.items():
+                np.testing.assert_array_equal(value, expected[name][key])
+        with self.assertRaises(ValueError):
+            TrajectoryAnalytics(["welfare"])
+
+if __name__ == '__main__':
+    unittest.main()
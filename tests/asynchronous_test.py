@@ -0,0 +1,83 @@
+import unittest
+import numpy as np
+from root.asynchronous import BuyerSchedule, CyclicSchedule, PrioritySchedule
+from root.equilibrium import get_equilibrium
+from root.market import PropRespLinearMarket, PropRespZhangMarket
+from root.sparse_market import SparsePropRespLinearMarket
+from tests.helpers import make_params
+
+class UpdateBuyersTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(20, 5, 0)
+        full = PropRespLinearMarket(budget, bids.copy(), utility)
+        full.update()
+        market = PropRespLinearMarket(budget, bids.copy(), utility)
+        buyers = np.array([3, 7, 11])
+        change = market.update_buyers(buyers)
+        # Updated buyers respond to the starting prices as in a full update, and the rest keep their bids.
+        np.testing.assert_allclose(market.get_bid()[buyers], full.get_bid()[buyers])
+        others = np.setdiff1d(np.arange(20), buyers)
+        np.testing.assert_array_equal(market.get_bid()[others], bids[others])
+        np.testing.assert_allclose(market.get_price(), market.get_bid().sum(axis=0))
+        np.testing.assert_allclose(change, np.abs(full.get_bid()[buyers] - bids[buyers]).sum(axis=1) / budget[buyers])
+        self.assertEqual(market.time, 1)
+
+class BatchedUpdateBuyersTest(unittest.TestCase):
+    def test(self):
+        params = [make_params(12, 4, seed) for seed in range(2)]
+        budget, bids, utility = (np.stack(x) for x in zip(*params))
+        market = PropRespZhangMarket(budget, bids.copy(), utility, 0.5)
+        change = market.update_buyers(slice(2, 6))
+        self.assertEqual(change.shape, (2, 4))
+        for k in range(2):
+            replica = PropRespZhangMarket(budget[k], bids[k].copy(), utility[k], 0.5)
+            replica.update_buyers(slice(2, 6))
+            np.testing.assert_allclose(market.get_bid()[k], replica.get_bid())
+            np.testing.assert_allclose(market.get_price()[k], replica.get_price())
+
+class ScheduleTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(60, 6, 2)
+        market = PropRespZhangMarket(budget, bids.copy(), utility, 0.5)
+        equilibrium = get_equilibrium(market)
+        for schedule in [BuyerSchedule(7, seed=0), CyclicSchedule(7), PrioritySchedule(7, seed=0)]:
+            market = PropRespZhangMarket(budget, bids.copy(), utility, 0.5)
+            steps = schedule.run(market, 10000, 1e-10)
+            self.assertIsNotNone(steps)
+            self.assertEqual(steps % schedule.get_sweep_steps(market), 0)
+            self.assertLess(schedule.get_residual(), 1e-10)
+            np.testing.assert_allclose(market.get_price(), equilibrium.price, rtol=1e-8)
+            # Prices kept by adding changes match the sum of the bids.
+            np.testing.assert_allclose(market.get_price(), market.get_bid().sum(axis=0), rtol=1e-12)
+
+class CyclicScheduleTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(7, 3, 3)
+        market = PropRespLinearMarket(budget, bids, utility)
+        schedule = CyclicSchedule(3)
+        chosen = [schedule._choose(market) for _ in range(4)]
+        self.assertEqual(chosen, [slice(0, 3), slice(3, 6), slice(6, 7), slice(0, 3)])
+
+class PriorityScheduleTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(30, 4, 4)
+        market = PropRespLinearMarket(budget, bids, utility)
+        schedule = PrioritySchedule(8, explore=0.5, seed=0)
+        schedule.step(market)
+        schedule.change = np.arange(30.0)
+        chosen = schedule._choose(market)
+        self.assertEqual(len(np.unique(chosen)), 8)
+        # Half the batch are the buyers that changed most.
+        self.assertEqual(set(chosen[:4]), {26, 27, 28, 29})
+        with self.assertRaises(ValueError):
+            PrioritySchedule(8, explore=2)
+
+class SparseTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(10, 3, 5)
+        market = SparsePropRespLinearMarket.from_dense(budget, bids, utility)
+        with self.assertRaises(ValueError):
+            BuyerSchedule(2).step(market)
+
+if __name__ == '__main__':
+    unittest.main()
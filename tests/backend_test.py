@@ -0,0 +1,67 @@
+import unittest
+import warnings
+from unittest import mock
+import numpy as np
+from root import backend
+from root.market import GeneralPropRespQLMarketPD, MixedUtilityMarket, PropRespLinearMarket, PropRespQLGroupedMarket, PropRespZhangMarket
+from tests.helpers import make_params, run
+
+def make_markets():
+    budget, bids, utility = make_params(12, 5, 0, zero_share=0.2)
+    batched = [np.stack(x) for x in zip(*[make_params(12, 5, seed, zero_share=0.2) for seed in range(2)])]
+    return {
+        "linear": lambda: PropRespLinearMarket(budget, bids.copy(), utility),
+        "zhang": lambda: PropRespZhangMarket(budget, bids.copy(), utility, 0.5),
+        "grouped": lambda: PropRespQLGroupedMarket(budget, bids.copy(), utility, 0.3, 2),
+        "pd": lambda: GeneralPropRespQLMarketPD(budget, bids.copy(), utility, 0.7),
+        "exponents": lambda: MixedUtilityMarket(budget, bids.copy(), utility, np.linspace(0.2, 1, 12)[:, None]),
+        "cobb_douglas": lambda: MixedUtilityMarket(budget, bids.copy(), utility, 0.5, np.arange(12) < 3),
+        "batched": lambda: PropRespZhangMarket(batched[0], batched[1].copy(), batched[2], 0.5),
+    }
+
+class BackendMatchesNumpyTest(unittest.TestCase):
+    def test(self):
+        # The Python reference kernels check the fused logic here; compiled backends are checked where installed.
+        for name, kernels in [("python", backend.PYTHON_KERNELS)] + list(backend.KERNELS.items()):
+            with mock.patch.dict(backend.KERNELS, {"numba": kernels}):
+                for market_name, make_market in make_markets().items():
+                    with self.subTest(kernels=name, market=market_name):
+                        reference = run(make_market(), 15)
+                        market = make_market()
+                        market.set_backend("numba")
+                        market.set_in_place(market_name == "zhang")
+                        run(market, 15)
+                        np.testing.assert_allclose(market.get_bid(), reference.get_bid(), rtol=1e-10)
+                        np.testing.assert_allclose(market.get_price(), reference.get_price(), rtol=1e-10)
+                        np.testing.assert_allclose(market.get_individual_utility(), reference.get_individual_utility(), rtol=1e-10)
+
+class BackendFallbackTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(12, 5, 0, zero_share=0.2)
+        market = PropRespZhangMarket(budget, bids, utility, 0.5)
+        with self.assertRaises(ValueError):
+            market.set_backend("cuda")
+        with mock.patch.dict(backend.KERNELS, clear=True):
+            self.assertEqual(backend.get_backends(), ["numpy"])
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                market.set_backend("numba")
+            self.assertEqual(len(caught), 1)
+            self.assertEqual(market.backend, "numpy")
+            self.assertIsNone(market._get_kernel("separable_response"))
+
+class BackendErrorTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(12, 5, 0, zero_share=0.2)
+        utility[3] = 0
+        utility[3, 1] = 1
+        bids[3] = 0
+        bids[3, 2] = 0.5
+        with mock.patch.dict(backend.KERNELS, {"numba": backend.PYTHON_KERNELS}):
+            for market in [PropRespLinearMarket(budget, bids.copy(), utility), PropRespZhangMarket(budget, bids.copy(), utility, 0.5)]:
+                market.set_backend("numba")
+                with self.assertRaises(ValueError):
+                    market.update()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import numpy as np
+from root.analytics import TrajectoryAnalytics
+from root.cache import ResultCache
+from root.market import PropRespZhangMarket
+from root.simulation import Simulation
+from root.sweep import Sweep, make_grid
+from tests.helpers import make_params
+
+def make_simulation(alpha=0.5, analytics=None):
+    budget, bids, utility = make_params(20, 6, 0)
+    return Simulation(PropRespZhangMarket(budget, bids, utility, alpha), strides={"bid": 5}, analytics=analytics)
+
+class CacheHitTest(unittest.TestCase):
+    def test(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory)
+            first = make_simulation(analytics=TrajectoryAnalytics())
+            result = first.run(30, price_tol=1e-12, check_every=5, cache=cache)
+            second = make_simulation(analytics=TrajectoryAnalytics())
+            market = second.market
+            with mock.patch.object(Simulation, "_run") as run:
+                cached = second.run(30, price_tol=1e-12, check_every=5, cache=cache)
+                run.assert_not_called()
+            # The market is restored in place.
+            self.assertIs(second.market, market)
+            self.assertEqual(market.get_time(), first.market.get_time())
+            np.testing.assert_array_equal(market.get_bid(), first.market.get_bid())
+            np.testing.assert_array_equal(second.get_bids(), first.get_bids())
+            np.testing.assert_array_equal(second.get_times("bid"), first.get_times("bid"))
+            self.assertEqual(cached, result)
+            self.assertEqual(second.analytics.get_summary()["eisenberg_gale"], first.analytics.get_summary()["eisenberg_gale"])
+            # Other parameters miss.
+            with mock.patch.object(Simulation, "_run", return_value=(None, {})) as run:
+                make_simulation(alpha=0.25).run(30, price_tol=1e-12, check_every=5, cache=cache)
+                make_simulation().run(30, price_tol=1e-10, check_every=5, cache=cache)
+                self.assertEqual(run.call_count, 2)
+
+class CachePrefixTest(unittest.TestCase):
+    def test(self):
+        uninterrupted = make_simulation()
+        result = uninterrupted.run(50, check_every=5)
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory)
+            make_simulation().run(20, check_every=5, cache=cache)
+            simulation = make_simulation()
+            with mock.patch.object(Simulation, "_run", side_effect=simulation._run) as run:
+                cached = simulation.run(50, check_every=5, cache=cache)
+                # Only the steps after the cached 20 are run.
+                self.assertEqual(run.call_args[0][0], 30)
+            self.assertEqual(cached[0], result[0])
+            self.assertEqual(cached[1].keys(), result[1].keys())
+            for name in result[1]:
+                self.assertEqual(cached[1][name], result[1][name])
+            np.testing.assert_array_equal(simulation.market.get_bid(), uninterrupted.market.get_bid())
+            np.testing.assert_array_equal(simulation.get_prices(), uninterrupted.get_prices())
+            np.testing.assert_array_equal(simulation.get_times("price"), np.arange(51))
+            # 20 steps checked every 3 don't line up with checks every 5, so aren't a prefix.
+            self.assertIsNone(cache.get(cache.get_key(make_simulation()._get_state(), {}), 50, 3))
+
+class CacheConvergedTest(unittest.TestCase):
+    def test(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory)
+            converged_time, _ = make_simulation().run(5000, price_tol=1e-6, check_every=10, cache=cache)
+            self.assertIsNotNone(converged_time)
+            # A longer run stops at the same step, so it is cached too.
+            with mock.patch.object(Simulation, "_run") as run:
+                self.assertEqual(make_simulation().run(10000, price_tol=1e-6, check_every=10, cache=cache)[0], converged_time)
+                run.assert_not_called()
+
+class CacheEvictionTest(unittest.TestCase):
+    def test(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory)
+            make_simulation().run(10, cache=cache)
+            size = cache.get_size()
+            cache.max_bytes = int(2.5 * size)
+            for alpha in [0.1, 0.2, 0.3]:
+                make_simulation(alpha).run(10, cache=cache)
+            # The least recently used entries are evicted.
+            self.assertLessEqual(cache.get_size(), cache.max_bytes)
+            self.assertEqual(len(os.listdir(directory)), 2)
+            with mock.patch.object(Simulation, "_run", return_value=(None, {})) as run:
+                make_simulation(0.3).run(10, cache=cache)
+                run.assert_not_called()
+            with self.assertRaises(ValueError):
+                ResultCache(directory, max_bytes=0)
+
+class CacheRaceTest(unittest.TestCase):
+    def test(self):
+        simulation = make_simulation()
+        simulation.run(10)
+        state = simulation._get_state()
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory)
+            key = cache.get_key(state, {})
+            makedirs = os.makedirs
+            def evicted(path, exist_ok=False):
+                # Another process evicts the key right after its directory is made, once.
+                makedirs(path, exist_ok=exist_ok)
+                if evicted.first:
+                    evicted.first = False
+                    os.rmdir(path)
+            evicted.first = True
+            with mock.patch("root.cache.os.makedirs", side_effect=evicted):
+                cache.put(key, 10, False, state)
+            self.assertEqual(cache.get(key, 10)[0], 10)
+            # Puts of the same entry at once each write a whole file, and leave no temporary files.
+            threads = [threading.Thread(target=cache.put, args=(key, 20, False, state)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(sorted(os.listdir(os.path.join(directory, key))), ["10.npz", "20.npz"])
+            self.assertEqual(cache.get(key, 20)[0], 20)
+
+class SweepCacheTest(unittest.TestCase):
+    def test(self):
+        jobs = make_grid([PropRespZhangMarket], sizes=[(5, 20)], seeds=[0], args=[(0.5,)], time_steps=[200])
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory)
+            first = Sweep(jobs, processes=1, cache=cache).run()
+            second = Sweep(jobs, processes=1, cache=cache).run()
+            self.assertEqual(len(os.listdir(directory)), 1)
+            self.assertEqual(first["min_price"], second["min_price"])
+            self.assertEqual(second["steps"], [200])
+
+if __name__ == '__main__':
+    unittest.main()
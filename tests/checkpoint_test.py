@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from root.initializer import Initializer
+from root.market import PropRespQLGroupedMarket, PropRespZhangMarket
+from root.simulation import Simulation
+from root.checkpoint import load_market, load_state, save_market
+from root.trajectory import TrajectoryReader, TrajectoryWriter
+
+class MarketRoundTripTest(unittest.TestCase):
+    def test(self):
+        params = Initializer(6, 20, 1).initialize_linear_utilities_basic()
+        market = PropRespQLGroupedMarket(*params, 0.5, 2)
+        market.update()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "market.npz")
+            save_market(path, market)
+            loaded = load_market(path)
+        self.assertIs(type(loaded), PropRespQLGroupedMarket)
+        self.assertEqual((loaded.time, loaded.alpha, loaded.n_linear), (1, 0.5, 2))
+        for i in range(5):
+            market.update()
+            loaded.update()
+        np.testing.assert_array_equal(loaded.get_bid(), market.get_bid())
+
+class ResumeTest(unittest.TestCase):
+    def test(self):
+        params = Initializer(6, 20, 1).initialize_linear_utilities_basic()
+        uninterrupted = Simulation(PropRespZhangMarket(*[x.copy() for x in params], 0.5), strides={"bid": 7})
+        uninterrupted.run(100)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoint.npz")
+            simulation = Simulation(PropRespZhangMarket(*params, 0.5), strides={"bid": 7})
+            simulation.run(65, checkpoint_path=path, checkpoint_every=20)
+            del simulation # crash after the checkpoint at t=60
+
+            resumed = Simulation.resume(path)
+        self.assertEqual(resumed.market.get_time(), 60)
+        resumed.run(40)
+        for name in ["price", "qty", "bid", "utility"]:
+            np.testing.assert_array_equal(resumed.get_history(name), uninterrupted.get_history(name))
+            np.testing.assert_array_equal(resumed.get_times(name), uninterrupted.get_times(name))
+
+class IncrementalCheckpointTest(unittest.TestCase):
+    def test(self):
+        params = Initializer(6, 20, 1).initialize_linear_utilities_basic()
+        uninterrupted = Simulation(PropRespZhangMarket(*[x.copy() for x in params], 0.5))
+        uninterrupted.run(60)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoint.npz")
+            simulation = Simulation(PropRespZhangMarket(*params, 0.5))
+            sizes = []
+            for _ in range(3):
+                simulation.run(10)
+                simulation.checkpoint(path)
+                simulation.checkpointer.wait()
+                sizes.append(os.path.getsize(path))
+            # Checkpoints hold offsets only; records are appended to the history files.
+            self.assertEqual(len(set(sizes)), 1)
+            self.assertNotIn("history", load_state(path)["simulation"])
+            self.assertEqual(os.path.getsize(os.path.join(path + ".history", "bid.bin")), 31 * params[1].nbytes)
+            simulation.run(5) # not checkpointed, so not resumed
+
+            resumed = Simulation.resume(path)
+            resumed.run(15)
+            resumed.checkpoint(path)
+            resumed.checkpointer.wait()
+            resumed = Simulation.resume(path)
+        resumed.run(15)
+        self.assertEqual(resumed.market.get_time(), 60)
+        for name in ["price", "qty", "bid", "utility"]:
+            np.testing.assert_array_equal(resumed.get_history(name), uninterrupted.get_history(name))
+            np.testing.assert_array_equal(resumed.get_times(name), uninterrupted.get_times(name))
+
+class ResumeStreamedTest(unittest.TestCase):
+    def test(self):
+        params = Initializer(6, 20, 1).initialize_linear_utilities_basic()
+        uninterrupted = Simulation(PropRespZhangMarket(*[x.copy() for x in params], 0.5))
+        uninterrupted.run(50)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoint.npz")
+            writer = TrajectoryWriter(directory, chunk_size=8)
+            simulation = Simulation(PropRespZhangMarket(*params, 0.5), writer=writer)
+            simulation.run(35, checkpoint_path=path, checkpoint_every=30)
+            writer.close() # records up to t=35 reach disk, past the checkpoint at t=30
+
+            with TrajectoryWriter(directory, chunk_size=8) as writer:
+                resumed = Simulation.resume(path, writer=writer)
+                resumed.run(20)
+            reader = TrajectoryReader(directory)
+            np.testing.assert_array_equal(reader.get("bid"), uninterrupted.get_bids())
+            np.testing.assert_array_equal(reader.get_times("price"), np.arange(51))
+            del reader
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import tempfile
+import tracemalloc
+import unittest
+import numpy as np
+from root.chunked_market import (ChunkedMixedUtilityMarket, ChunkedPropRespLinearMarket, ChunkedPropRespZhangMarket,
+                                 create_market_files, open_market_files)
+from root.checkpoint import get_market_state, set_market_state
+from root.initializer import Initializer
+from root.market import MixedUtilityMarket, PropRespLinearMarket, PropRespZhangMarket
+
+def run(dense, chunked, time_steps=20):
+    for i in range(time_steps):
+        dense.update()
+        chunked.update()
+
+class ChunkedLinearMatchesDenseTest(unittest.TestCase):
+    def test(self):
+        budget, bids, util = Initializer(20, 100, 0).initialize_linear_utilities_discrete()
+        dense = PropRespLinearMarket(budget, bids.copy(), util)
+        chunked = ChunkedPropRespLinearMarket(budget, bids.copy(), util)
+        chunked.chunk_size = 7
+        np.testing.assert_allclose(chunked.get_qty(), dense.get_qty())
+        # Quantities are those the bids were computed from, which differ most early on.
+        run(dense, chunked, 1)
+        np.testing.assert_allclose(chunked.get_bid(), dense.get_bid())
+        np.testing.assert_allclose(chunked.get_qty(), dense.get_qty())
+        run(dense, chunked)
+        np.testing.assert_allclose(chunked.get_price(), dense.get_price())
+        np.testing.assert_allclose(chunked.get_bid(), dense.get_bid())
+        np.testing.assert_allclose(chunked.get_qty(), dense.get_qty())
+        np.testing.assert_allclose(chunked.get_individual_utility(), dense.get_individual_utility())
+
+class ChunkedZhangMatchesDenseTest(unittest.TestCase):
+    def test(self):
+        budget, bids, util = Initializer(20, 100, 0).initialize_linear_utilities_basic()
+        dense = PropRespZhangMarket(budget, bids.copy(), util, 0.5)
+        chunked = ChunkedPropRespZhangMarket(budget, bids.copy(), util, 0.5)
+        chunked.chunk_size = 30
+        run(dense, chunked)
+        np.testing.assert_allclose(chunked.get_bid(), dense.get_bid())
+
+class ChunkedMixedMatchesDenseTest(unittest.TestCase):
+    def test(self):
+        budget, bids, util = Initializer(10, 50, 1).initialize_linear_utilities_basic()
+        exponent = np.linspace(0.3, 1, 50)[:, None]
+        cobb_douglas = np.arange(50) % 5 == 0
+        dense = MixedUtilityMarket(budget, bids.copy(), util, exponent, cobb_douglas)
+        chunked = ChunkedMixedUtilityMarket(budget, bids.copy(), util, exponent, cobb_douglas)
+        chunked.chunk_size = 8
+        run(dense, chunked)
+        np.testing.assert_allclose(chunked.get_bid(), dense.get_bid())
+        np.testing.assert_allclose(chunked.get_individual_utility(), dense.get_individual_utility())
+
+class MemoryMappedTest(unittest.TestCase):
+    def test(self):
+        n_buyers, n_goods, chunk_size = 20000, 50, 500
+        rng = np.random.default_rng(0)
+        with tempfile.TemporaryDirectory() as directory:
+            budget, bids, util = create_market_files(directory, n_buyers, n_goods)
+            for start in range(0, n_buyers, chunk_size):
+                chunk = slice(start, start + chunk_size)
+                util[chunk] = rng.random((chunk_size, n_goods))
+                budget[chunk] = 1
+                bids[chunk] = util[chunk] / (1.01 * util[chunk].sum(axis=1, keepdims=True))
+            for array in [budget, bids, util]:
+                array.flush()
+            del budget, bids, util
+            dense = PropRespLinearMarket(*(np.array(array) for array in open_market_files(directory)))
+
+            chunked = ChunkedPropRespLinearMarket.from_files(directory)
+            self.assertIsInstance(chunked.get_bid(), np.memmap)
+            chunked.chunk_size = chunk_size
+            for i in range(3):
+                dense.update()
+            tracemalloc.start()
+            for i in range(3):
+                chunked.update()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            # Only a few chunks of the nxm arrays should be in memory at once.
+            self.assertLess(peak, dense.get_bid().nbytes / 4)
+            chunked.get_bid().flush()
+            del chunked
+            np.testing.assert_allclose(open_market_files(directory)[1], dense.get_bid())
+
+class ChunkedInPlaceTest(unittest.TestCase):
+    def test(self):
+        budget, bids, util = Initializer(50, 2000, 0).initialize_linear_utilities_basic()
+        chunk_bytes = 512 * 50 * 8
+        for workers in [1, 3]:
+            market = ChunkedPropRespZhangMarket(budget, bids.copy(), util, 0.5)
+            market.set_workers(workers, 512)
+            market.set_in_place()
+            plain = ChunkedPropRespZhangMarket(budget, bids.copy(), util, 0.5)
+            plain.set_workers(workers, 512)
+            for i in range(5):
+                market.update()
+                plain.update()
+            tracemalloc.start()
+            start = tracemalloc.get_traced_memory()[0]
+            market.update()
+            peak = tracemalloc.get_traced_memory()[1] - start
+            tracemalloc.stop()
+            # Threads reuse their chunks' scratch arrays, so steps make no new arrays of a chunk's size.
+            self.assertLess(peak, chunk_bytes)
+            plain.update()
+            np.testing.assert_array_equal(market.get_bid(), plain.get_bid())
+
+class ShardedDeterminismTest(unittest.TestCase):
+    def test(self):
+        budget, bids, util = Initializer(30, 1000, 0).initialize_linear_utilities_basic()
+        dense = PropRespZhangMarket(budget, bids.copy(), util, 0.5)
+        markets = []
+        for workers in [1, 2, 3, 8]:
+            market = ChunkedPropRespZhangMarket(budget, bids.copy(), util, 0.5)
+            market.chunk_size = 64
+            market.set_workers(workers)
+            markets.append(market)
+        run(dense, markets[0])
+        for market in markets[1:]:
+            for i in range(20):
+                market.update()
+            np.testing.assert_array_equal(market.get_bid(), markets[0].get_bid())
+            np.testing.assert_array_equal(market.get_price(), markets[0].get_price())
+            np.testing.assert_array_equal(market.get_individual_utility(), markets[0].get_individual_utility())
+        np.testing.assert_allclose(markets[0].get_bid(), dense.get_bid())
+        # Thread pools aren't part of the state; restored markets start a new one.
+        restored = set_market_state(get_market_state(markets[-1]))
+        restored.update()
+        markets[-1].update()
+        np.testing.assert_array_equal(restored.get_bid(), markets[-1].get_bid())
+        with self.assertRaises(ValueError):
+            restored.set_workers(0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import numpy as np
+from root.initializer import Initializer
+from root.market import PropRespLinearMarket, PropRespZhangMarket, PropRespQLGroupedMarket
+from root.ensemble import EnsembleMarket
+
+class EnsembleMatchesReplicasTest(unittest.TestCase):
+    def test(self):
+        params = [Initializer(5, 30, seed).initialize_linear_utilities_basic() for seed in range(4)]
+        ensemble = EnsembleMarket.from_params(PropRespQLGroupedMarket, [[x.copy() for x in p] for p in params], 0.5, 2)
+        ensemble.run(10)
+
+        for k, (budget, bids, util) in enumerate(params):
+            market = PropRespQLGroupedMarket(budget, bids, util, 0.5, 2)
+            for i in range(10):
+                market.update()
+            np.testing.assert_allclose(ensemble.get_bid()[k], market.get_bid())
+            np.testing.assert_allclose(ensemble.get_price()[k], market.get_price())
+
+class EnsembleAlphaTest(unittest.TestCase):
+    def test(self):
+        # alpha can vary by replica
+        budget, bids, util = Initializer(5, 30, 0).initialize_linear_utilities_basic()
+        alphas = np.array([0.25, 0.75])
+        ensemble = EnsembleMarket.from_params(PropRespZhangMarket, [[budget, bids.copy(), util]] * 2, alphas[:, None, None])
+        ensemble.update()
+        for k in range(2):
+            market = PropRespZhangMarket(budget, bids.copy(), util, alphas[k])
+            market.update()
+            np.testing.assert_allclose(ensemble.get_bid()[k], market.get_bid())
+
+class EnsembleConvergenceTest(unittest.TestCase):
+    def test(self):
+        params = [Initializer(5, 30, seed).initialize_linear_utilities_basic() for seed in range(3)]
+        ensemble = EnsembleMarket.from_params(PropRespLinearMarket, params)
+        self.assertFalse(np.any(ensemble.get_converged(1e-3)))
+        ensemble.run(500)
+        self.assertEqual(ensemble.get_individual_utility().shape, (3, 30))
+        np.testing.assert_array_equal(ensemble.get_converged(1e-3), [True, True, True])
+
+class EnsembleZeroUtilityTest(unittest.TestCase):
+    def test(self):
+        budgets = np.ones((2, 2))
+        utility = np.array([[[1.0, 1.0], [1.0, 1.0]], [[1.0, 1.0], [1.0, 0.0]]])
+        bids = np.array([[[0.5, 0.5], [0.5, 0.5]], [[0.5, 0.5], [0.0, 1.0]]])
+        ensemble = EnsembleMarket(PropRespLinearMarket, budgets, bids, utility)
+        with self.assertRaisesRegex(ValueError, "Individual 1 in replica \\[1\\] receives no utility"):
+            ensemble.update()
+
+if __name__ == '__main__':
+    unittest.main()
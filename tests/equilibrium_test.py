@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from root import equilibrium
+from root.equilibrium import get_equilibrium, solve_equilibrium
+from root.market import GeneralPropRespCDMarket, PropRespLinearMarket, PropRespZhangMarket
+from root.simulation import Simulation
+from tests.helpers import make_params, run
+
+class LinearEquilibriumTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(20, 5, 0)
+        market = run(PropRespLinearMarket(budget, bids, utility), 20000)
+        solution = solve_equilibrium(budget, utility)
+        self.assertLess(solution.residual, 1e-12)
+        np.testing.assert_allclose(solution.price, market.get_price(), rtol=1e-6)
+        np.testing.assert_allclose(solution.bid.sum(axis=1), budget)
+        np.testing.assert_allclose(solution.bid.sum(axis=0), solution.price)
+        # Linear buyers only spend on goods with the most utility per unit price.
+        ratio = utility / solution.price
+        spent = solution.bid > 1e-9
+        np.testing.assert_allclose(ratio[spent], np.broadcast_to(ratio.max(axis=1, keepdims=True), ratio.shape)[spent])
+
+class LargeLinearEquilibriumTest(unittest.TestCase):
+    def test(self):
+        budget, _, utility = make_params(2000, 30, 1)
+        solution = solve_equilibrium(budget, utility)
+        self.assertLess(solution.residual, 1e-12)
+
+class DegenerateLinearEquilibriumTest(unittest.TestCase):
+    def test(self):
+        # Equal budgets make the spending graph degenerate, and many buyers end up nearly tied.
+        utility = np.random.RandomState(0).rand(1000, 50)
+        utility /= utility.sum(axis=1, keepdims=True)
+        budget = np.ones(1000)
+        solution = solve_equilibrium(budget, utility)
+        self.assertLess(solution.residual, 1e-12)
+        self.assertTrue(np.all(solution.bid >= 0))
+        np.testing.assert_allclose(solution.bid.sum(axis=1), budget)
+        np.testing.assert_allclose(solution.bid.sum(axis=0), solution.price)
+
+class CESEquilibriumTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(30, 6, 2)
+        market = run(PropRespZhangMarket(budget, bids, utility, 0.5), 2000)
+        solution = get_equilibrium(market)
+        self.assertLess(solution.residual, 1e-12)
+        np.testing.assert_allclose(solution.price, market.get_price(), rtol=1e-9)
+        self.assertLess(solution.get_utility_error(market.get_individual_utility()), 1e-9)
+
+class CobbDouglasEquilibriumTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(30, 6, 3)
+        market = run(GeneralPropRespCDMarket(budget, bids, utility), 100)
+        solution = get_equilibrium(market)
+        np.testing.assert_allclose(solution.price, market.get_price(), rtol=1e-9)
+        self.assertLess(solution.get_utility_error(market.get_individual_utility()), 1e-9)
+
+class BatchedEquilibriumTest(unittest.TestCase):
+    def test(self):
+        budget, _, utility = make_params(40, 5, 4)
+        solution = solve_equilibrium(np.stack([budget, budget[::-1]]), np.stack([utility, utility[::-1]]))
+        self.assertEqual(solution.price.shape, (2, 5))
+        self.assertEqual(solution.bid.shape, (2, 40, 5))
+        np.testing.assert_allclose(solution.price[0], solve_equilibrium(budget, utility).price)
+        np.testing.assert_allclose(solution.price[1], solution.price[0])
+
+class CacheTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(20, 5, 5)
+        market = PropRespLinearMarket(budget, bids.copy(), utility)
+        solution = get_equilibrium(market)
+        market.update()
+        self.assertIs(get_equilibrium(market), solution)
+        self.assertIsNot(get_equilibrium(PropRespLinearMarket(budget * 2, bids * 2, utility)), solution)
+        for k in range(equilibrium.CACHE_SIZE + 1):
+            get_equilibrium(PropRespLinearMarket(budget + k + 1, bids, utility))
+        self.assertIsNot(get_equilibrium(market), solution)
+
+class SimulationErrorTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_params(20, 5, 6)
+        market = PropRespZhangMarket(budget, bids, utility, 0.5)
+        with self.assertRaises(ValueError):
+            Simulation(market, strides={"price_error": 1})
+        simulation = Simulation(market, strides={"bid": 0, "utility_error": 5}, equilibrium=get_equilibrium(market))
+        steps, residuals = simulation.run(1000, price_tol=1e-12, check_every=10)
+        self.assertIsNotNone(steps)
+        self.assertLess(residuals["price_error"], 1e-9)
+        price_error = simulation.get_history("price_error")
+        self.assertEqual(len(price_error), steps + 1)
+        self.assertLess(price_error[-1], price_error[1])
+        self.assertEqual(len(simulation.get_history("utility_error")), steps // 5 + 1)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoint.npz")
+            simulation.checkpoint(path)
+            simulation.checkpointer.wait()
+            resumed = Simulation.resume(path)
+            self.assertIsNotNone(resumed.equilibrium)
+            np.testing.assert_array_equal(resumed.get_history("price_error"), price_error)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import numpy as np
+
+def make_params(n_buyers, n_goods, seed, power=1, zero_share=0.0, proportional_bids=False):
+    """
+    Returns seeded (budget, bids, utility) for a test market: budgets from Unif[0.5, 1.5] and utilities from Unif[0,1]
+    raised to power. A zero_share of utilities is set to 0, with good 0 kept positive for every buyer. Bids spend
+    99.9% of each budget, split at random, or in proportion to utility if proportional_bids is set.
+    """
+    rng = np.random.default_rng(seed)
+    budget = rng.random(n_buyers) + 0.5
+    utility = rng.random((n_buyers, n_goods)) ** power
+    if zero_share:
+        utility[rng.random((n_buyers, n_goods)) < zero_share] = 0
+        utility[:, 0] += 0.1
+    if proportional_bids:
+        bids = utility * (budget / utility.sum(axis=1) * 0.999)[:, None]
+    else:
+        bids = rng.random((n_buyers, n_goods))
+        bids *= budget[:, None] / bids.sum(axis=1, keepdims=True) * 0.999
+    return budget, bids, utility
+
+def run(market, time_steps):
+    """
+    Runs time_steps updates of market, and returns it.
+    """
+    for _ in range(time_steps):
+        market.update()
+    return market
@@ -1,6 +1,10 @@
+import tempfile
 import unittest
+import numpy as np
+from root.chunked_market import ChunkedPropRespLinearMarket
 from root.initializer import Initializer
 from root.market import PropRespLinearMarket
+from root.sparse_market import SparsePropRespLinearMarket
 from root.simulation import Simulation
 
 class InitializerBasicTest(unittest.TestCase):
@@ -33,4 +37,74 @@ class InitializerDiscreteTest(unittest.TestCase):
         # print(np.sum(params[1], axis=1))
 
         simulation = Simulation(market)
-        simulation.run(20)
\ No newline at end of file
+        simulation.run(20)
+
+METHODS = ["initialize_linear_utilities_basic", "initialize_linear_utilities_discrete", "initialize_low_mid_high_utilities", "initialize_structured_utilities"]
+
+class InitializerSeedTest(unittest.TestCase):
+    def test(self):
+        for method in METHODS:
+            first = getattr(Initializer(6, 40, 3), method)()
+            second = getattr(Initializer(6, 40, 3), method)()
+            for x, y in zip(first, second):
+                np.testing.assert_array_equal(x, y)
+            initializer = Initializer(6, 40, 4)
+            self.assertFalse(np.array_equal(getattr(initializer, method)()[2], first[2]))
+            # Each call draws a new instance.
+            self.assertFalse(np.array_equal(getattr(initializer, method)()[2], getattr(Initializer(6, 40, 4), method)()[2]))
+
+class InitializerChunksTest(unittest.TestCase):
+    def test(self):
+        # Instances don't depend on the number of workers or where they're written.
+        for method in METHODS:
+            budget, bids, util = getattr(Initializer(5, 50, 0, chunk_size=7), method)()
+            out = [np.zeros(50), np.zeros((50, 5)), np.zeros((50, 5))]
+            getattr(Initializer(5, 50, 0, chunk_size=7, workers=3), method)(out=out)
+            for x, y in zip(out, [budget, bids, util]):
+                np.testing.assert_array_equal(x, y)
+            np.testing.assert_allclose(util.sum(axis=1), 1)
+            self.assertTrue(np.all(bids.sum(axis=1) < budget))
+            PropRespLinearMarket(budget, bids, util).update()
+        with self.assertRaises(ValueError):
+            Initializer(5, 50, 0).initialize_linear_utilities_basic(out=[np.zeros(50), np.zeros((50, 4)), np.zeros((50, 5))])
+
+class InitializerStructuredTest(unittest.TestCase):
+    def test(self):
+        util = Initializer(8, 200, 0).initialize_linear_utilities_discrete()[2]
+        self.assertTrue(np.all(util.max(axis=1) > 0))
+        np.testing.assert_allclose(util[util > 0], np.broadcast_to(util.max(axis=1, keepdims=True), util.shape)[util > 0])
+
+        # Without noise, buyers of a group have the same utilities.
+        util = Initializer(8, 200, 0).initialize_low_mid_high_utilities(n_groups=3, levels=(1.0, 2.0, 3.0), noise=0)[2]
+        self.assertLessEqual(len(np.unique(util, axis=0)), 3)
+        ratio = util / util.min(axis=1, keepdims=True)
+        self.assertTrue(np.all(np.isin(np.round(ratio, 9), [1.0, 1.5, 2.0, 3.0])))
+
+        util = Initializer(20, 2000, 0).initialize_structured_utilities(n_groups=4, tiers=(0.5, 2.0), knockout=0.5)[2]
+        self.assertTrue(np.all(np.any(util > 0, axis=1)))
+        self.assertAlmostEqual(np.mean(util == 0), 0.5, delta=0.02)
+        with self.assertRaises(ValueError):
+            Initializer(20, 2000, 0).initialize_structured_utilities(knockout=1)
+
+class InitializerOutputsTest(unittest.TestCase):
+    def test(self):
+        budget, bids, util = Initializer(10, 60, 2, chunk_size=16).initialize_structured_utilities(knockout=0.7)
+        sparse_budget, sparse_bids, sparse_util = Initializer(10, 60, 2, chunk_size=16).initialize_structured_utilities(knockout=0.7, sparse=True)
+        np.testing.assert_array_equal(sparse_budget, budget)
+        np.testing.assert_array_equal(sparse_bids.toarray(), bids)
+        np.testing.assert_array_equal(sparse_util.toarray(), util)
+        self.assertEqual(len(sparse_util.data), np.count_nonzero(util))
+        SparsePropRespLinearMarket(sparse_budget, sparse_bids, sparse_util).update()
+        with self.assertRaises(ValueError):
+            Initializer(10, 60, 2).initialize_structured_utilities(out=[budget.copy(), bids.copy(), util.copy()], sparse=True)
+
+        with tempfile.TemporaryDirectory() as directory:
+            files = Initializer(10, 60, 2, chunk_size=16).to_files(directory, "initialize_structured_utilities", knockout=0.7)
+            for x, y in zip(files, [budget, bids, util]):
+                np.testing.assert_array_equal(x, y)
+            market = ChunkedPropRespLinearMarket.from_files(directory)
+            market.update()
+            del files, market
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,9 @@
+import tracemalloc
 import unittest
-from root.market import Market, GeneralPropRespCDMarket
+from unittest import mock
+from root.market import Market, GeneralPropRespCDMarket, GeneralPropRespQLMarketPD, MixedUtilityMarket, PropRespLinearMarket, PropRespQLGroupedMarket, PropRespZhangMarket
 import numpy as np
+from tests.helpers import make_params
 
 class BasicInitTests(unittest.TestCase):
     def test(self):
@@ -86,5 +89,366 @@ class PropRespCDTest(unittest.TestCase):
 
 
 
+class VectorizedUpdateTest(unittest.TestCase):
+    def test(self):
+        # Compare against the buyer-by-buyer update for the grouped market.
+        rng = np.random.default_rng(0)
+        utility = rng.random((20, 6))
+        budget = np.ones(20)
+        bids = utility / (1.01 * utility.sum(axis=1))[:, None]
+        alpha, n_linear = 0.5, 2
+
+        market = PropRespQLGroupedMarket(budget, bids.copy(), utility, alpha, n_linear)
+        market.update()
+
+        price = bids.sum(axis=0)
+        qty = bids / price
+        expected = np.zeros(bids.shape)
+        for i in range(20):
+            response = [utility[i, j] * qty[i, j] if j < n_linear else (utility[i, j] * qty[i, j]) ** alpha for j in range(6)]
+            expected[i] = budget[i] * np.array(response) / sum(response)
+        np.testing.assert_allclose(market.get_bid(), expected)
+        np.testing.assert_allclose(market.get_bid().sum(axis=1), budget)
+
+class ZeroUtilityTest(unittest.TestCase):
+    def test(self):
+        budget = np.array([1.0, 1.0])
+        utility = np.array([[1.0, 0.0], [1.0, 1.0]])
+        bids = np.array([[0.0, 1.0], [0.5, 0.5]]) # buyer 0 only bids on a good they don't value
+        market = PropRespLinearMarket(budget, bids, utility)
+        with self.assertRaisesRegex(ValueError, "Individual 0 receives no utility"):
+            market.update()
+
+class ZeroPriceTest(unittest.TestCase):
+    def test(self):
+        budget = np.array([1.0, 1.0])
+        utility = np.array([[1.0, 1.0], [1.0, 1.0]])
+        bids = np.array([[0.5, 0.5], [0.5, 0.5]])
+        market = PropRespZhangMarket(budget, bids, utility, 0.5)
+        market.bid[:, 1] = 0
+        with self.assertRaisesRegex(ZeroDivisionError, "Price of good \\[1\\] reached 0 at time 0"):
+            market.update()
+
+class CDLogDomainTest(unittest.TestCase):
+    def test(self):
+        budget = np.array([1.0, 2.0, 1.0])
+        utility = np.array([
+            [0.5, 0.5, 0.0],
+            [0.2, 0.3, 0.5],
+            [0.0, 0.4, 0.6]
+        ])
+        bids = np.array([
+            [0.5, 0.5, 0.0], # no bid on a good with 0 power still gives positive utility
+            [0.5, 0.5, 1.0],
+            [0.2, 0.4, 0.4]
+        ])
+        market = GeneralPropRespCDMarket(budget=budget, start_bids=bids.copy(), utility=utility)
+        market.update()
+
+        qty = bids / bids.sum(axis=0)
+        expected_utility = np.prod(np.power(qty, utility), axis=1)
+        np.testing.assert_allclose(market.get_individual_utility(), expected_utility)
+        # Cobb-Douglas buyers spend a_ij of their budget on good j.
+        np.testing.assert_allclose(market.get_bid(), budget[:, None] * utility)
+
+class CDUnderflowTest(unittest.TestCase):
+    def test(self):
+        # Utility of 500 goods each with a small quantity underflows outside the log domain.
+        n, m = 1000, 500
+        utility = np.full((n, m), 2.0)
+        budget = np.ones(n)
+        bids = np.full((n, m), 1 / (1.01 * m))
+        market = GeneralPropRespCDMarket(budget=budget, start_bids=bids, utility=utility)
+        market.update()
+        np.testing.assert_allclose(market.get_bid().sum(axis=1), budget)
+
+class CDZeroQuantityTest(unittest.TestCase):
+    def test(self):
+        budget = np.array([1.0, 1.0])
+        utility = np.array([[0.5, 0.5], [0.5, 0.5]])
+        bids = np.array([[1.0, 0.0], [0.5, 0.5]]) # buyer 0 needs good 1 but has none of it
+        market = GeneralPropRespCDMarket(budget=budget, start_bids=bids, utility=utility)
+        with self.assertRaisesRegex(ValueError, "Individual 0 receives no utility"):
+            market.update()
+
+
+class LogDomainUnderflowTest(unittest.TestCase):
+    def test(self):
+        # (utility * qty) ** alpha underflows to 0 for buyer 0, but their bids are still well defined.
+        budget = np.array([1.0, 1.0])
+        utility = np.array([[1e-200, 2e-200], [1.0, 1.0]])
+        bids = np.array([[0.5, 0.5], [0.5, 0.5]])
+        market = PropRespZhangMarket(budget, bids, utility, 2.0)
+        market.update()
+        np.testing.assert_allclose(market.get_bid()[0], [0.2, 0.8])
+
+class LogDomainFloat32Test(unittest.TestCase):
+    def test(self):
+        rng = np.random.default_rng(0)
+        utility = rng.random((2000, 10)).astype(np.float32)
+        bids = (utility / (1.01 * utility.sum(axis=1))[:, None]).astype(np.float32)
+        budget = np.ones(2000, dtype=np.float32)
+        market = GeneralPropRespQLMarketPD(budget, bids, utility, 0.5)
+        for i in range(500):
+            market.update()
+        self.assertEqual(market.get_bid().dtype, np.float32)
+        self.assertTrue(np.all(np.isfinite(market.get_bid())))
+        np.testing.assert_allclose(market.get_bid().sum(axis=1), budget, rtol=1e-5)
+
+class MixedUtilityTest(unittest.TestCase):
+    def test(self):
+        # Buyer 0 linear, buyer 1 CES in the last two goods, buyer 2 Cobb-Douglas.
+        budget = np.array([1.0, 2.0, 1.0])
+        utility = np.array([
+            [1.0, 2.0, 3.0],
+            [2.0, 1.0, 4.0],
+            [0.2, 0.3, 0.5]
+        ])
+        bids = np.array([
+            [0.2, 0.3, 0.5],
+            [0.5, 0.5, 1.0],
+            [0.2, 0.4, 0.4]
+        ])
+        exponent = np.array([
+            [1.0, 1.0, 1.0],
+            [1.0, 0.5, 0.5],
+            [1.0, 1.0, 1.0]
+        ])
+        market = MixedUtilityMarket(budget, bids.copy(), utility, exponent, cobb_douglas=[False, False, True])
+        market.update()
+
+        response = (utility * bids / bids.sum(axis=0)) ** exponent
+        np.testing.assert_allclose(market.get_bid()[:2], budget[:2, None] * response[:2] / response[:2].sum(axis=1, keepdims=True))
+        np.testing.assert_allclose(market.get_individual_utility()[:2], response[:2].sum(axis=1))
+        np.testing.assert_allclose(market.get_bid()[2], budget[2] * utility[2])
+
+class MixedUtilitySpecialCasesTest(unittest.TestCase):
+    def test(self):
+        # The special-case markets are configurations of MixedUtilityMarket, and linear exponents match the linear market.
+        np.random.seed(0)
+        budget = np.random.rand(6) + 1
+        utility = np.random.rand(6, 4)
+        bids = np.random.rand(6, 4)
+        bids *= budget[:, None] / bids.sum(axis=1, keepdims=True) * 0.5
+        pairs = [
+            (PropRespLinearMarket(budget, bids.copy(), utility), MixedUtilityMarket(budget, bids.copy(), utility)),
+            (PropRespZhangMarket(budget, bids.copy(), utility, 0.5), MixedUtilityMarket(budget, bids.copy(), utility, 0.5)),
+            (PropRespQLGroupedMarket(budget, bids.copy(), utility, 0.5, 2), MixedUtilityMarket(budget, bids.copy(), utility, np.array([1, 1, 0.5, 0.5]))),
+        ]
+        for market, mixed in pairs:
+            for _ in range(20):
+                market.update()
+                mixed.update()
+            np.testing.assert_allclose(mixed.get_bid(), market.get_bid())
+            np.testing.assert_allclose(mixed.get_individual_utility(), market.get_individual_utility())
+
+def make_mutation_params(n_buyers, n_goods, seed):
+    # Bids start in proportion to skewed utilities.
+    return make_params(n_buyers, n_goods, seed, power=2, proportional_bids=True)
+
+def assert_matches_rebuild(test, market, rebuild, time_steps=10):
+    # A changed market should step exactly like one built from scratch on its arrays.
+    rebuilt = rebuild(market.budget.copy(), market.get_bid() * (1 - 1e-12), market.utility.copy())
+    np.testing.assert_allclose(market.get_price(), rebuilt.get_price())
+    np.testing.assert_allclose(market.get_qty(), rebuilt.get_qty())
+    for i in range(time_steps):
+        market.update()
+        rebuilt.update()
+    np.testing.assert_allclose(market.get_bid(), rebuilt.get_bid())
+    np.testing.assert_allclose(market.get_individual_utility(), rebuilt.get_individual_utility())
+
+class MutationTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_mutation_params(30, 6, 0)
+        new_budget, new_bids, new_utility = make_mutation_params(3, 6, 1)
+        original_utility = utility.copy()
+        rebuild = lambda *p: PropRespZhangMarket(*p, 0.5)
+        market = rebuild(budget, bids, utility)
+        for i in range(20):
+            market.update()
+        market.add_buyers(new_budget, new_utility, new_bids)
+        self.assertEqual(market.n_buyers, 33)
+        assert_matches_rebuild(self, market, rebuild)
+        bid_buffer = market.get_bid().base
+        market.add_buyers(new_budget[:1], new_utility[:1])
+        self.assertIs(market.get_bid().base, bid_buffer) # room was left for more buyers
+        assert_matches_rebuild(self, market, rebuild)
+        market.remove_buyers([0, 5, 33])
+        self.assertEqual(market.get_bid().shape, (31, 6))
+        assert_matches_rebuild(self, market, rebuild)
+        market.set_budgets([1, 2], [2.0, 0.1])
+        np.testing.assert_allclose(market.get_bid()[[1, 2]].sum(axis=1), [2.0, 0.1])
+        assert_matches_rebuild(self, market, rebuild)
+        market.set_utilities(np.arange(31) < 4, new_utility[0])
+        assert_matches_rebuild(self, market, rebuild)
+        market.add_goods(np.full((31, 2), 0.3))
+        self.assertEqual(market.n_goods, 8)
+        assert_matches_rebuild(self, market, rebuild)
+        market.remove_goods([0, 7])
+        assert_matches_rebuild(self, market, rebuild)
+        np.testing.assert_array_equal(utility, original_utility) # the caller's arrays are never written to
+
+class MutationAttributesTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_mutation_params(10, 4, 2)
+        exponent = np.linspace(0.3, 1, 10)[:, None]
+        market = MixedUtilityMarket(budget, bids, utility, exponent)
+        with self.assertRaises(ValueError):
+            market.add_buyers(budget[:2], utility[:2])
+        market.add_buyers(budget[:2], utility[:2], exponent=[[0.5], [1]])
+        np.testing.assert_array_equal(market.exponent[-2:, 0], [0.5, 1])
+        market.remove_buyers(0)
+        self.assertEqual(market.exponent.shape, (11, 1))
+        assert_matches_rebuild(self, market, lambda *p: MixedUtilityMarket(*p, market.exponent.copy()))
+        with self.assertRaises(ZeroDivisionError):
+            market.add_goods(np.zeros((11, 1)))
+        with self.assertRaises(ValueError):
+            market.set_budgets(0, -1)
+
+class WarmStartTest(unittest.TestCase):
+    def test(self):
+        def steps_to_converge(market, tol=1e-6):
+            for t in range(1, 100000):
+                price = market.get_price()
+                market.update()
+                if t > 1 and np.max(np.abs(market.get_price() - price) / price) < tol:
+                    return t
+        budget, bids, utility = make_mutation_params(200, 20, 3)
+        new_budget, _, new_utility = make_mutation_params(2, 20, 4)
+        market = PropRespZhangMarket(budget, bids, utility, 0.9)
+        steps_to_converge(market, 1e-12)
+        market.add_buyers(new_budget, new_utility)
+        market.set_budgets([3, 4], [1.5, 0.7])
+        warm = steps_to_converge(market, 1e-10)
+        start_bids = market.utility * (market.budget / market.utility.sum(axis=1) * 0.999)[:, None]
+        cold = steps_to_converge(PropRespZhangMarket(market.budget.copy(), start_bids, market.utility.copy(), 0.9), 1e-10)
+        self.assertLess(warm * 1.5, cold)
+
+def get_step_allocation(market, time_steps=10):
+    """
+    Returns the most memory allocated at once while market runs time_steps updates, after warming up.
+    """
+    for _ in range(2):
+        market.update()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    for _ in range(time_steps):
+        market.update()
+    peak = tracemalloc.get_traced_memory()[1] - start
+    tracemalloc.stop()
+    return peak
+
+class InPlaceTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_mutation_params(500, 400, 0)
+        cd_utility = utility / utility.sum(axis=1, keepdims=True)
+        makers = [
+            lambda: PropRespLinearMarket(budget, bids.copy(), utility),
+            lambda: PropRespZhangMarket(budget, bids.copy(), utility, 0.5),
+            lambda: MixedUtilityMarket(budget, bids.copy(), utility, np.where(np.arange(400) < 10, 1.0, 0.5)),
+            lambda: GeneralPropRespQLMarketPD(budget, bids.copy(), utility, 0.5),
+            lambda: GeneralPropRespCDMarket(budget, bids.copy(), cd_utility),
+        ]
+        for make in makers:
+            market = make()
+            market.set_in_place()
+            # Steps make no new arrays of the market's size.
+            self.assertLess(get_step_allocation(market), bids.nbytes / 10)
+            price = market.get_price()
+            market.update()
+            self.assertIs(market.get_price(), price)
+            # Results are the same as allocating new arrays.
+            plain = make()
+            for _ in range(market.get_time()):
+                plain.update()
+            np.testing.assert_array_equal(market.get_bid(), plain.get_bid())
+            np.testing.assert_array_equal(market.get_qty(), plain.get_qty())
+            np.testing.assert_array_equal(market.get_individual_utility(), plain.get_individual_utility())
+
+class ShardedUpdateTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_mutation_params(50, 8, 0)
+        batched = [np.stack(x) for x in zip(*[make_mutation_params(50, 8, seed) for seed in range(2)])]
+        makers = [
+            lambda: PropRespLinearMarket(budget, bids.copy(), utility),
+            lambda: PropRespZhangMarket(budget, bids.copy(), utility, 0.5),
+            lambda: MixedUtilityMarket(budget, bids.copy(), utility, 0.5, np.arange(50) % 5 == 0),
+            lambda: GeneralPropRespQLMarketPD(budget, bids.copy(), utility, 0.5),
+            lambda: PropRespZhangMarket(batched[0], batched[1].copy(), batched[2], 0.5),
+        ]
+        for make in makers:
+            dense = make()
+            markets = []
+            for workers in [1, 2, 3]:
+                market = make()
+                market.set_workers(workers, shard_size=7)
+                markets.append(market)
+            for _ in range(10):
+                dense.update()
+                for market in markets:
+                    market.update()
+            # Shards are the same whatever the number of workers, so results are too.
+            for market in markets[1:]:
+                np.testing.assert_array_equal(market.get_price(), markets[0].get_price())
+                np.testing.assert_array_equal(market.get_qty(), markets[0].get_qty())
+                np.testing.assert_array_equal(market.get_bid(), markets[0].get_bid())
+                np.testing.assert_array_equal(market.get_individual_utility(), markets[0].get_individual_utility())
+            np.testing.assert_allclose(markets[0].get_price(), dense.get_price())
+            np.testing.assert_allclose(markets[0].get_qty(), dense.get_qty())
+            np.testing.assert_allclose(markets[0].get_bid(), dense.get_bid())
+            np.testing.assert_allclose(markets[0].get_individual_utility(), dense.get_individual_utility())
+
+        market = makers[1]()
+        market.set_workers(4)
+        self.assertGreaterEqual(market.shard_size, 50)
+        market.update()
+        # Shards take their rows of log(utility) once it is cached.
+        self.assertTrue(market._has_log_utility())
+        with self.assertRaises(ValueError):
+            market.set_active_set()
+        with self.assertRaises(ValueError):
+            market.set_workers(0)
+        market.set_workers(None)
+        self.assertIsNone(market.shard_size)
+        market.set_active_set()
+
+class ShardedInPlaceTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_mutation_params(500, 400, 0)
+        makers = [
+            lambda: PropRespLinearMarket(budget, bids.copy(), utility),
+            lambda: PropRespZhangMarket(budget, bids.copy(), utility, 0.5),
+        ]
+        for make in makers:
+            market = make()
+            # The last shard is shorter than the others.
+            market.set_workers(2, shard_size=120)
+            market.set_in_place()
+            # Workers reuse their shards' scratch arrays, so steps make no new arrays of a shard's size.
+            self.assertLess(get_step_allocation(market), bids.nbytes / 10)
+            plain = make()
+            plain.set_workers(2, shard_size=120)
+            for _ in range(market.get_time()):
+                plain.update()
+            np.testing.assert_array_equal(market.get_bid(), plain.get_bid())
+            np.testing.assert_array_equal(market.get_price(), plain.get_price())
+
+class ShardedWorkersTest(unittest.TestCase):
+    def test(self):
+        budget, bids, utility = make_mutation_params(200, 8, 1)
+        markets = []
+        # Shards of 16 buyers by default, so the market is sharded whatever the number of workers.
+        with mock.patch("root.market.SHARD_BYTES", 16 * 8 * 8):
+            for workers in [1, 4]:
+                market = PropRespZhangMarket(budget, bids.copy(), utility, 0.5)
+                market.set_workers(workers)
+                self.assertEqual(market.shard_size, 16)
+                markets.append(market)
+        for _ in range(5):
+            for market in markets:
+                market.update()
+        np.testing.assert_array_equal(markets[0].get_price(), markets[1].get_price())
+        np.testing.assert_array_equal(markets[0].get_bid(), markets[1].get_bid())
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
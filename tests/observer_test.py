@@ -0,0 +1,40 @@
+import unittest
+import numpy as np
+from root.initializer import Initializer
+from root.market import PropRespLinearMarket
+from root.observer import StepObserver
+from root.simulation import Simulation
+
+class ObserverTest(unittest.TestCase):
+    def test(self):
+        params = Initializer(10, 50, 1).initialize_linear_utilities_basic()
+        observer = StepObserver()
+        observer.add_metric("max_price", lambda market: float(np.max(market.get_price())), every=5)
+        simulation = Simulation(PropRespLinearMarket(*params), observer=observer)
+        simulation.run(20)
+
+        report = observer.get_report()
+        self.assertEqual(report["steps"], 20)
+        for phase in ["price", "qty", "bid", "record", "observer"]:
+            self.assertGreater(report[phase + "_seconds"], 0)
+        self.assertEqual([t for t, value in observer.metrics["max_price"]], [5, 10, 15, 20])
+        self.assertEqual(report["max_price"], float(np.max(simulation.market.get_price())))
+        # Bids are only scanned every bid_every steps.
+        checked = simulation.get_bids()[[10, 20]]
+        self.assertEqual(report["min_bid"], float(np.min(checked[checked > 0])))
+
+class ObserverDetachTest(unittest.TestCase):
+    def test(self):
+        params = Initializer(10, 50, 1).initialize_linear_utilities_basic()
+        market = PropRespLinearMarket(*params)
+        observer = StepObserver(near_zero=1.0, bid_every=0) # min price is below the mean
+        market.set_observer(observer)
+        market.update()
+        market.set_observer(None)
+        market.update()
+        self.assertEqual(observer.steps, 1)
+        self.assertEqual(observer.near_zero_prices, 1)
+        self.assertEqual(observer.min_bid, np.inf)
+
+if __name__ == '__main__':
+    unittest.main()
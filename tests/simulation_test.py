@@ -0,0 +1,84 @@
+import unittest
+from unittest import mock
+import numpy as np
+from root.initializer import Initializer
+from root.market import PropRespLinearMarket
+from root.simulation import Simulation
+
+class EarlyStoppingTest(unittest.TestCase):
+    def test(self):
+        params = Initializer(10, 50, 1).initialize_linear_utilities_basic()
+        simulation = Simulation(PropRespLinearMarket(*params))
+        converged_time, residuals = simulation.run(10000, price_tol=1e-4, bid_tol=1e-4, check_every=5)
+        self.assertIsNotNone(converged_time)
+        self.assertEqual(converged_time % 5, 0)
+        self.assertLess(converged_time, 10000)
+        self.assertEqual(len(simulation.get_prices()), converged_time + 1)
+        self.assertLessEqual(residuals["price"], 1e-4)
+        self.assertLessEqual(residuals["bid"], 1e-4)
+
+class NoToleranceTest(unittest.TestCase):
+    def test(self):
+        params = Initializer(10, 50, 1).initialize_linear_utilities_basic()
+        simulation = Simulation(PropRespLinearMarket(*params))
+        converged_time, residuals = simulation.run(20)
+        self.assertIsNone(converged_time)
+        self.assertEqual(simulation.market.get_time(), 20)
+        self.assertEqual(set(residuals), {"price", "bid", "spending"})
+        np.testing.assert_allclose(residuals["spending"], np.sum(np.abs(simulation.get_prices()[-1] - simulation.get_prices()[-2])) / 50)
+
+class HistoryCopiesTest(unittest.TestCase):
+    def test(self):
+        # bids are updated in place, so history must hold copies
+        params = Initializer(10, 50, 1).initialize_linear_utilities_basic()
+        start_bids = params[1].copy()
+        simulation = Simulation(PropRespLinearMarket(*params))
+        simulation.run(3)
+        self.assertEqual(simulation.get_bids().shape, (4, 50, 10))
+        np.testing.assert_array_equal(simulation.get_bids()[0], start_bids)
+        np.testing.assert_array_equal(simulation.get_bids()[-1], simulation.market.get_bid())
+        self.assertFalse(np.array_equal(simulation.get_bids()[1], simulation.get_bids()[2]))
+
+class HistoryStrideTest(unittest.TestCase):
+    def test(self):
+        params = Initializer(10, 50, 1).initialize_linear_utilities_basic()
+        simulation = Simulation(PropRespLinearMarket(*params), strides={"bid": 100, "qty": 0}, dtype=np.float32)
+        simulation.run(250)
+        simulation.run(50)
+        np.testing.assert_array_equal(simulation.get_times("bid"), [0, 100, 200, 300])
+        np.testing.assert_array_equal(simulation.get_times("price"), np.arange(301))
+        self.assertEqual(simulation.get_prices().dtype, np.float32)
+        self.assertEqual(len(simulation.history["bid"]), 6) # grown geometrically, from the 3 records of the first run
+        np.testing.assert_allclose(simulation.get_bids()[-1], simulation.market.get_bid(), rtol=1e-6, atol=1e-30)
+        with self.assertRaises(ValueError):
+            simulation.get_qtys()
+
+class HistoryGrowthTest(unittest.TestCase):
+    def test(self):
+        params = Initializer(10, 50, 1).initialize_linear_utilities_basic()
+        simulation = Simulation(PropRespLinearMarket(*params))
+        sizes = set()
+        for _ in range(200):
+            simulation.run(1)
+            sizes.add(len(simulation.history["bid"]))
+        # Short runs reallocate only when the history doubles.
+        self.assertLessEqual(len(sizes), 9)
+        self.assertEqual(len(simulation.get_bids()), 201)
+        np.testing.assert_array_equal(simulation.get_times("bid"), np.arange(201))
+        # Runs that stop early don't reserve every step they might have run.
+        simulation = Simulation(PropRespLinearMarket(*Initializer(10, 50, 1).initialize_linear_utilities_basic()))
+        converged_time, _ = simulation.run(100000, price_tol=1e-4, check_every=5)
+        self.assertLessEqual(len(simulation.history["bid"]), 2 * (converged_time + 1))
+        # Runs of known length reserve their records exactly, and growth past them is capped at GROWTH_BYTES.
+        record_bytes = 50 * 10 * 8
+        with mock.patch("root.simulation.GROWTH_BYTES", 3 * record_bytes):
+            simulation = Simulation(PropRespLinearMarket(*Initializer(10, 50, 1).initialize_linear_utilities_basic()))
+            simulation.run(100)
+            self.assertEqual(len(simulation.history["bid"]), 101)
+            simulation.run(1)
+            self.assertEqual(len(simulation.history["bid"]), 104)
+            self.assertEqual(len(simulation.history["price"]), 202)
+            np.testing.assert_array_equal(simulation.get_times("bid"), np.arange(102))
+
+if __name__ == '__main__':
+    unittest.main()
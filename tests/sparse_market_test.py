@@ -0,0 +1,67 @@
+import tracemalloc
+import unittest
+import numpy as np
+from root.initializer import Initializer
+from root.market import PropRespLinearMarket, PropRespZhangMarket
+from root.sparse_market import BuyerCSR, SparsePropRespLinearMarket, SparsePropRespZhangMarket
+
+class BuyerCSRTest(unittest.TestCase):
+    def test(self):
+        dense = np.array([[0, 1.5, 0], [0, 0, 0], [2, 0, 3]])
+        csr = BuyerCSR.from_dense(dense)
+        np.testing.assert_array_equal(csr.indptr, [0, 1, 1, 3])
+        np.testing.assert_array_equal(csr.indices, [1, 0, 2])
+        np.testing.assert_array_equal(csr.get_rows(), [0, 2, 2])
+        np.testing.assert_array_equal(csr.toarray(), dense)
+
+class SparseLinearMatchesDenseTest(unittest.TestCase):
+    def test(self):
+        budget, bids, util = Initializer(20, 100, 0).initialize_linear_utilities_discrete()
+        dense = PropRespLinearMarket(budget, bids.copy(), util)
+        sparse = SparsePropRespLinearMarket.from_dense(budget, bids.copy(), util)
+        self.assertEqual(len(sparse.get_bid()), np.count_nonzero(util))
+        for i in range(20):
+            dense.update()
+            sparse.update()
+        np.testing.assert_allclose(sparse.get_price(), dense.get_price())
+        np.testing.assert_allclose(sparse.to_dense(sparse.get_bid()), dense.get_bid())
+        np.testing.assert_allclose(sparse.get_individual_utility(), dense.get_individual_utility())
+
+class SparseZhangMatchesDenseTest(unittest.TestCase):
+    def test(self):
+        budget, bids, util = Initializer(20, 100, 0).initialize_linear_utilities_discrete()
+        dense = PropRespZhangMarket(budget, bids.copy(), util, 0.5)
+        sparse = SparsePropRespZhangMarket.from_dense(budget, bids.copy(), util, 0.5)
+        for i in range(20):
+            dense.update()
+            sparse.update()
+        np.testing.assert_allclose(sparse.to_dense(sparse.get_qty()), dense.get_qty())
+
+class SparseZeroPriceTest(unittest.TestCase):
+    def test(self):
+        # nobody values good 2
+        util = BuyerCSR(np.array([0, 1, 3]), np.array([0, 0, 1]), np.array([1.0, 1.0, 1.0]), (2, 3))
+        with self.assertRaises(ZeroDivisionError):
+            SparsePropRespLinearMarket(np.ones(2), util.with_data(np.array([0.5, 0.5, 0.5])), util)
+
+class SparseInPlaceTest(unittest.TestCase):
+    def test(self):
+        budget, bids, util = Initializer(200, 1000, 0).initialize_structured_utilities(knockout=0.5, sparse=True)
+        for market_class, args in [(SparsePropRespLinearMarket, ()), (SparsePropRespZhangMarket, (0.5,))]:
+            market = market_class(budget, bids.with_data(bids.data.copy()), util, *args)
+            market.set_in_place()
+            market.update()
+            tracemalloc.start()
+            start = tracemalloc.get_traced_memory()[0]
+            for _ in range(10):
+                market.update()
+            peak = tracemalloc.get_traced_memory()[1] - start
+            tracemalloc.stop()
+            self.assertLess(peak, bids.data.nbytes / 10)
+            plain = market_class(budget, bids.with_data(bids.data.copy()), util, *args)
+            for _ in range(11):
+                plain.update()
+            np.testing.assert_array_equal(market.get_bid(), plain.get_bid())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from multiprocessing import resource_tracker, shared_memory
+from unittest import mock
+import numpy as np
+from root import sweep
+from root.market import PropRespLinearMarket, PropRespZhangMarket
+from root.sweep import Sweep, SweepJob, make_grid
+
+class SweepTest(unittest.TestCase):
+    def test(self):
+        jobs = make_grid([PropRespZhangMarket], sizes=[(5, 20), (10, 30)], seeds=[0, 1], args=[(0.25,), (0.75,)], time_steps=[2000], tols={"price_tol": 1e-8})
+        jobs.append(SweepJob(PropRespLinearMarket, 5, 20, 0, args=(0.5,))) # wrong number of args
+        streamed = []
+        table = Sweep(jobs, processes=2).run(callback=streamed.append)
+
+        self.assertEqual(len(streamed), 9)
+        self.assertEqual(table["job"], list(range(9)))
+        self.assertEqual(table["n_buyers"], [20, 20, 20, 20, 30, 30, 30, 30, 20])
+        self.assertTrue(all(error is None for error in table["error"][:8]))
+        self.assertIn("TypeError", table["error"][8])
+        self.assertTrue(all(t is not None and t < 2000 for t in table["converged_time"][:8]))
+
+class SweepMatchesSerialTest(unittest.TestCase):
+    def test(self):
+        # jobs sharing an instance get the same instance
+        jobs = make_grid([PropRespZhangMarket], sizes=[(5, 20)], seeds=[3], args=[(0.5,)], time_steps=[10, 10])
+        table = Sweep(jobs, processes=2).run()
+        self.assertEqual(table["min_price"][0], table["min_price"][1])
+        self.assertEqual(table["steps"], [10, 10])
+
+class SweepAttachTest(unittest.TestCase):
+    def test(self):
+        shm = shared_memory.SharedMemory(create=True, size=8 * 6)
+        try:
+            np.ndarray((2, 3), buffer=shm.buf)[:] = 1
+            # Workers leave the block to its owner's resource tracker.
+            with mock.patch.object(resource_tracker, "register") as register:
+                array = sweep._attach((shm.name, (2, 3), "<f8"))
+                register.assert_not_called()
+            np.testing.assert_array_equal(array, np.ones((2, 3)))
+            self.assertFalse(array.flags.writeable)
+            del array
+            sweep._detach()
+            self.assertEqual(sweep._attached, {})
+        finally:
+            shm.close()
+            shm.unlink()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from root.initializer import Initializer
+from root.market import PropRespLinearMarket
+from root.simulation import Simulation
+from root.trajectory import TrajectoryReader, TrajectoryWriter
+
+class StreamedMatchesMemoryTest(unittest.TestCase):
+    def test(self):
+        params = Initializer(10, 50, 1).initialize_linear_utilities_basic()
+        in_memory = Simulation(PropRespLinearMarket(*[x.copy() for x in params]), strides={"bid": 3})
+        in_memory.run(100)
+
+        with tempfile.TemporaryDirectory() as directory:
+            with TrajectoryWriter(directory, chunk_size=8) as writer:
+                streamed = Simulation(PropRespLinearMarket(*params), strides={"bid": 3}, writer=writer)
+                streamed.run(60)
+                streamed.run(40)
+            with self.assertRaises(ValueError):
+                streamed.get_bids()
+
+            reader = TrajectoryReader(directory)
+            self.assertEqual(sorted(reader.get_variables()), ["bid", "price", "qty", "utility"])
+            np.testing.assert_array_equal(reader.get("bid"), in_memory.get_bids())
+            np.testing.assert_array_equal(reader.get_times("bid"), in_memory.get_times("bid"))
+            np.testing.assert_array_equal(reader.get("price"), in_memory.get_prices())
+
+            view = reader.slice("bid", 5, 10, slice(20, 30))
+            self.assertIsInstance(view, np.memmap)
+            np.testing.assert_array_equal(view, in_memory.get_bids()[5:10, 20:30])
+            del view
+
+class WriterDtypeTest(unittest.TestCase):
+    def test(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with TrajectoryWriter(directory, chunk_size=4, dtype=np.float32) as writer:
+                for t in range(10):
+                    writer.write("price", t, np.full(3, t, dtype=np.float64))
+            self.assertEqual(os.path.getsize(os.path.join(directory, "price.bin")), 10 * 3 * 4)
+            reader = TrajectoryReader(directory)
+            np.testing.assert_array_equal(reader.get("price")[:, 0], np.arange(10))
+
+if __name__ == '__main__':
+    unittest.main()